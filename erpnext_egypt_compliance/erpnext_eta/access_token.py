@@ -0,0 +1,83 @@
+import json
+import time
+
+import frappe
+from frappe.utils import cint
+from frappe.utils.password import decrypt, encrypt
+
+# seconds before its expiry a token is no longer handed out
+ACCESS_TOKEN_EXPIRY_BUFFER = 3 * 60
+ACCESS_TOKEN_REFRESH_LOCK_TIMEOUT = 30
+
+
+def get_access_token(connector, request_token, force_refresh: bool = False) -> str:
+    """
+    Get the access token of an ETA connector, shared by all the workers of the site.
+
+    Tokens are kept encrypted in redis until their expiry. When none is valid, a single worker
+    requests a new one while the others wait for it, and the connector document is not written.
+    The token is also held on the connector instance, so repeated calls neither hit redis nor decrypt.
+
+    Args:
+        connector (Document): The ETA Connector or ETA POS Connector.
+        request_token (callable): Requests a token from the ETA identity server and returns its response.
+        force_refresh (bool): Request a new token even if the cached one is still valid.
+    """
+    held = getattr(connector, "_eta_access_token", None)
+    if not force_refresh and held and held[1] > time.time():
+        return held[0]
+
+    key = f"{connector.doctype}::{connector.name}"
+    if not force_refresh and (cached := _get_cached_access_token(key)):
+        return _hold(connector, *cached)
+
+    cache = frappe.cache()
+    lock_key = cache.make_key(f"eta_access_token_lock:{key}")
+    lock_token = frappe.generate_hash(length=16)
+    while not cache.set(lock_key, lock_token, nx=True, ex=ACCESS_TOKEN_REFRESH_LOCK_TIMEOUT):
+        # another worker is refreshing the token
+        time.sleep(0.2)
+        if not force_refresh and (cached := _get_cached_access_token(key)):
+            return _hold(connector, *cached)
+
+    try:
+        if not force_refresh and (cached := _get_cached_access_token(key)):
+            return _hold(connector, *cached)
+
+        eta_response = request_token()
+        access_token = eta_response.get("access_token")
+        expires_in = cint(eta_response.get("expires_in")) - ACCESS_TOKEN_EXPIRY_BUFFER
+        if expires_in <= 0:
+            return access_token
+
+        valid_until = time.time() + expires_in
+        cache.set(
+            cache.make_key(f"eta_access_token:{key}"),
+            json.dumps({"access_token": encrypt(access_token), "valid_until": valid_until}),
+            ex=expires_in,
+        )
+        return _hold(connector, access_token, valid_until)
+    finally:
+        # a slow refresh may have outlived its lock, which then belongs to another worker
+        if frappe.safe_decode(cache.get(lock_key)) == lock_token:
+            cache.delete(lock_key)
+
+
+def clear_access_token(connector):
+    """Drop the cached access token of a connector, e.g. when its credentials change."""
+    connector._eta_access_token = None
+    frappe.cache().delete_value(f"eta_access_token:{connector.doctype}::{connector.name}")
+
+
+def _get_cached_access_token(key: str):
+    cache = frappe.cache()
+    cached = cache.get(cache.make_key(f"eta_access_token:{key}"))
+    if not cached:
+        return None
+    cached = json.loads(cached)
+    return decrypt(cached["access_token"]), cached["valid_until"]
+
+
+def _hold(connector, access_token: str, valid_until: float) -> str:
+    connector._eta_access_token = (access_token, valid_until)
+    return access_token
@@ -0,0 +1,46 @@
+import hashlib
+from typing import Iterator
+
+
+def iter_canonical(document_structure) -> Iterator[str]:
+    """
+    Yield the ETA canonical serialization of a document structure in chunks.
+    see https://sdk.preprod.invoicing.eta.gov.eg/document-serialization-approach/
+    """
+    if not isinstance(document_structure, dict):
+        yield '"' + str(document_structure) + '"'
+        return
+
+    for name, value in document_structure.items():
+        name = '"' + name.upper() + '"'
+        yield name
+        if isinstance(value, list):
+            for item in value:
+                yield name
+                yield from iter_canonical(item)
+        else:
+            yield from iter_canonical(value)
+
+
+def serialize(document_structure) -> str:
+    """Serialize a document structure to its ETA canonical string."""
+    return "".join(iter_canonical(document_structure))
+
+
+def canonical_sha256(document_structure, buffer_size: int = 64 * 1024) -> str:
+    """
+    The hex SHA-256 of the canonical serialization of a document structure.
+
+    The serialization is hashed as it is produced, a buffer at a time, without building the whole string.
+    """
+    digest = hashlib.sha256()
+    buffer, buffered = [], 0
+    for chunk in iter_canonical(document_structure):
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= buffer_size:
+            digest.update("".join(buffer).encode("utf-8"))
+            buffer, buffered = [], 0
+
+    digest.update("".join(buffer).encode("utf-8"))
+    return digest.hexdigest()
@@ -5,15 +5,18 @@ import frappe
 from frappe.model.document import Document
 import requests
 import json
-from datetime import datetime
 from erpnext_egypt_compliance.erpnext_eta.legacy_einvoice import get_eta_inv_datetime_diff
-from erpnext_egypt_compliance.erpnext_eta.doctype.eta_pos_connector.eta_pos_connector import ETASession
+from erpnext_egypt_compliance.erpnext_eta.access_token import clear_access_token, get_access_token
+from erpnext_egypt_compliance.erpnext_eta.doctype.eta_pos_connector.eta_pos_connector import get_eta_session
 
 
 class ETAConnector(Document):
 
     def validate(self):
         self.ensure_single_default_per_company()
+
+    def on_update(self):
+        clear_access_token(self)
     
     def ensure_single_default_per_company(self):
         """Ensure only one default ETA Connector per company."""
@@ -45,21 +48,15 @@ class ETAConnector(Document):
 
         self.DOCUMET_SUBMISSION = self.ETA_BASE + "/documentsubmissions"
         self.DOCUMENT_TYPES = self.ETA_BASE + "/documenttypes"
-        self.session = ETASession().get_session()
+        self.session = get_eta_session(self.ETA_BASE)
 
     def get_eta_access_token(self):
-
-        if self.access_token:
-            access_token = self.get_password(fieldname="access_token")
-        else:
-            access_token = self.refresh_eta_token()
-        return (
-            access_token
-            if (access_token and frappe.utils.add_to_date(datetime.now(), minutes=3) < self.expires_in)
-            else self.refresh_eta_token()
-        )
+        return get_access_token(self, self._request_access_token)
 
     def refresh_eta_token(self):
+        return get_access_token(self, self._request_access_token, force_refresh=True)
+
+    def _request_access_token(self):
         headers = {"content-type": "application/x-www-form-urlencoded"}
 
         response = self.session.post(
@@ -75,11 +72,16 @@ class ETAConnector(Document):
         if response.status_code == 200:
             eta_response = response.json()
             if eta_response.get("access_token"):
-                self.access_token = eta_response.get("access_token")
-                self.expires_in = frappe.utils.add_to_date(datetime.now(), seconds=eta_response.get("expires_in"))
-                self.save()
-                frappe.db.commit()
-                return eta_response.get("access_token")
+                return eta_response
+
+        frappe.log_error(
+            title="ETA Token Refresh Failed",
+            message=f"HTTP {response.status_code}: {response.text}",
+        )
+        frappe.throw(
+            frappe._("Failed to refresh ETA access token (HTTP {0})").format(response.status_code),
+            title=frappe._("ETA Authentication Error"),
+        )
 
     def get_headers(self):
         return {
@@ -96,9 +98,10 @@ class ETAConnector(Document):
 
 
     def gracefully_autofetch_eta_status(self):
+        from erpnext_egypt_compliance.erpnext_eta.status_sync import sync_eta_statuses
+
         docs = frappe.get_all(
             "Sales Invoice", filters=[["eta_status", "=", "Submitted"], ["company", "=", self.company]], pluck="name"
         )
-        for docname in docs:
-            self.update_eta_docstatus(docname)
-            frappe.db.commit()
+        sync_eta_statuses(self, docs)
+        frappe.db.commit()
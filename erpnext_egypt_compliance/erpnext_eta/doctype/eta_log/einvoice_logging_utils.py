@@ -2,7 +2,8 @@ import frappe
 from typing import Union, Dict, List
 from erpnext_egypt_compliance.erpnext_eta.utils import get_company_eta_connector
 from erpnext_egypt_compliance.erpnext_eta.utils import create_eta_log
-from erpnext_egypt_compliance.erpnext_eta.einvoice_submitter import EInvoiceSubmitter
+from erpnext_egypt_compliance.erpnext_eta.einvoice_submitter import EInvoiceSubmitter, pack_submissions
+from erpnext_egypt_compliance.erpnext_eta.einvoice_schema import get_invoice_hash
 
 
 
@@ -13,15 +14,35 @@ def get_eta_documents(invoices: list) -> list:
 	]
 
 
+def get_changed_since_signing(einvoices: List[Dict]) -> List[Dict]:
+	"""The signed e-invoices whose canonical hash differs from the one recorded when they were handed to the signer."""
+	signed = [e for e in einvoices if e.get("documentTypeVersion") == "1.0"]
+	if not signed:
+		return []
+
+	document_hashes = dict(
+		frappe.get_all(
+			"Sales Invoice",
+			filters={"name": ["in", [e.get("internalID") for e in signed]], "eta_document_hash": ["is", "set"]},
+			fields=["name", "eta_document_hash"],
+			as_list=True,
+		)
+	)
+	return [
+		e for e in signed
+		if e.get("internalID") in document_hashes and document_hashes[e.get("internalID")] != get_invoice_hash(e)
+	]
+
+
 def _submit_einvoice(einvoices: Union[Dict, List[Dict]], connector ,submitted_by ,show_msg=False, submission_reason=None):
 	"""
-	Submits an e-invoice using the logger.
+	Submits e-invoices using the logger, split into as few submissions as the ETA limits allow.
 	Args:
 		einvoice (Union[Dict, List[Dict]]): The e-invoice data to be submitted. Can be a single dictionary or a list of dictionaries.
 		company (str): The name of the company for which the e-invoice is being submitted.
 		submission_reason (str): Optional reason for submission when resubmitting
 	Returns:
-		dict: The response from the ETA after submitting the e-invoice.
+		list: The response from the ETA for each submission, one ETA Log is created per submission.
 	"""
 	try:
 		# Always ensure einvoices is a list
@@ -31,22 +52,56 @@ def _submit_einvoice(einvoices: Union[Dict, List[Dict]], connector ,submitted_by
 		# Fetch ETA connector for the company
 		# connector = get_company_eta_connector(company)
 
-		# Prepare ETA log
-		documents = get_eta_documents(einvoices)
-		eta_log = create_eta_log(documents=documents, from_doctype="Sales Invoice", submitted_by=submitted_by, submission_reason=submission_reason)
+		changed = get_changed_since_signing(einvoices)
+		if changed:
+			# their signature no longer matches the document, the ETA would reject them
+			create_eta_log(
+				documents=get_eta_documents(changed),
+				from_doctype="Sales Invoice",
+				submission_status="Failed",
+				submission_summary="Document changed after it was signed, sign it again",
+				submitted_by=submitted_by,
+				submission_reason=submission_reason,
+			)
+			changed_ids = {e.get("internalID") for e in changed}
+			einvoices = [e for e in einvoices if e.get("internalID") not in changed_ids]
+
+		submissions, oversized = pack_submissions(einvoices)
+		if oversized:
+			# logged apart so they don't fail the rest of the batch
+			create_eta_log(
+				documents=get_eta_documents(oversized),
+				from_doctype="Sales Invoice",
+				submission_status="Failed",
+				submission_summary="Document exceeds the ETA submission size limit",
+				submitted_by=submitted_by,
+				submission_reason=submission_reason,
+			)
 
-		# Submit documents
 		submitter = EInvoiceSubmitter(connector)
-		eta_response = submitter.submit_documents(einvoices)
+		eta_responses = []
+		for submission in submissions:
+			# Prepare ETA log
+			documents = get_eta_documents(submission)
+			eta_log = create_eta_log(documents=documents, from_doctype="Sales Invoice", submitted_by=submitted_by, submission_reason=submission_reason)
+
+			# Submit documents
+			eta_response = submitter.submit_documents(submission)
 
-		# Process response
-		eta_log._process_response(eta_response)
+			# Process response
+			eta_log._process_response(eta_response)
+			eta_responses.append(eta_response)
 
 		# User feedback (only in manual case)
 		if show_msg:
-			frappe.msgprint(f" ETA Log created successfully", indicator="blue", alert=True)
-
-		return eta_response
+			if changed:
+				frappe.msgprint("The e-invoice changed after it was signed, sign it again.", indicator="red", alert=True)
+			elif oversized:
+				frappe.msgprint("The e-invoice exceeds the ETA submission size limit.", indicator="red", alert=True)
+			else:
+				frappe.msgprint(f" ETA Log created successfully", indicator="blue", alert=True)
+
+		return eta_responses
 
 	except Exception as e:
 		error_msg = f" Failed to submit e-invoice for company ': {str(e)}"
@@ -1,10 +1,12 @@
 # Copyright (c) 2024, Axentor, LLC and contributors
 # For license information, please see license.txt
 
+import itertools
+
 import frappe
 import requests
 from frappe.model.document import Document
-from erpnext_egypt_compliance.erpnext_eta.utils import parse_error_details
+from erpnext_egypt_compliance.erpnext_eta.utils import bulk_set_values, parse_error_details
 from erpnext_egypt_compliance.erpnext_eta.ereceipt_submitter import EReceiptSubmitter
 import json
 from erpnext_egypt_compliance.erpnext_eta.utils import get_company_eta_connector
@@ -49,18 +51,19 @@ class ETALog(Document):
     def process_documents(self, eta_response):
         internal_id_key = "internalId" if self.from_doctype == "Sales Invoice" else "receiptNumber"
         child_rows = frappe._dict({row.reference_document: row for row in self.get("documents", default=[])})
+        eta_fields = {}
 
         for doc in eta_response.get("acceptedDocuments", []):
             if doc.get(internal_id_key):
                 docname = doc.get(internal_id_key)
-                self.update_eta_fields(doc, docname, eta_response, eta_response.get("submissionId"), "Submitted")
+                eta_fields[docname] = self.get_eta_fields(doc, eta_response.get("submissionId"), "Submitted")
                 fields = {"uuid": doc.get("uuid"), "long_id": doc.get("longId"), "accepted": True}
                 child_rows.get(docname, {}).update(fields)
 
         for doc in eta_response.get("rejectedDocuments", []):
             if doc.get(internal_id_key):
                 docname = doc.get(internal_id_key)
-                self.update_eta_fields(doc, docname, eta_response, eta_response.get("submissionId"))
+                eta_fields[docname] = self.get_eta_fields(doc, eta_response.get("submissionId"))
                 fields = {
                     "uuid": doc.get("uuid"),
                     "error": parse_error_details(doc.get("error", {})),
@@ -68,7 +71,10 @@ class ETALog(Document):
                 }
                 child_rows.get(docname, {}).update(fields)
 
-    def update_eta_fields(self, doc, docname, eta_response, submission_id, eta_status=None):
+        # one multi-row UPDATE per chunk instead of one per document
+        bulk_set_values(self.from_doctype, eta_fields)
+
+    def get_eta_fields(self, doc, submission_id, eta_status=None):
         if self.from_doctype == "Sales Invoice":
             fields = {
                 "eta_uuid": doc.get("uuid"),
@@ -76,6 +82,9 @@ class ETALog(Document):
                 "eta_long_key": doc.get("longId"),
                 "eta_submission_id": submission_id,
                 "eta_status": eta_status,
+                # restart the status polling of a (re)submitted invoice
+                "eta_status_checked_at": frappe.utils.now_datetime(),
+                "eta_status_attempts": 0,
             }
         else:
             fields = {
@@ -85,7 +94,7 @@ class ETALog(Document):
                 "custom_eta_submission_id": submission_id,
                 "custom_eta_status": eta_status,
             }
-        frappe.db.set_value(self.from_doctype, docname, fields)
+        return fields
 
     @frappe.whitelist()
     def get_submission_status(self):
@@ -129,9 +138,10 @@ class ETALog(Document):
         # TODO: Need to Migrate to EReceiptSubmitter
         connector = frappe.get_doc("ETA POS Connector", self.pos_profile)
         submitter = EReceiptSubmitter(connector)
+        receipts = submitter.get_receipt_statuses([doc.uuid for doc in self.documents if doc.uuid])
         for doc in self.documents:
-            eta_response = submitter.get_receipt_status(doc.uuid)
-            fieldname = "eta_status" if doc.reference_doctype == "Sales Invoice" else "custome_eta_status"
+            eta_response = receipts.get(doc.uuid)
+            fieldname = "eta_status" if doc.reference_doctype == "Sales Invoice" else "custom_eta_status"
             if isinstance(eta_response, dict):
                 if eta_response.get("receipt", {}).get("status"):
                     receipt_status = eta_response["receipt"]["status"]
@@ -147,37 +157,33 @@ class ETALog(Document):
                 frappe.throw("Submission ID is required to check status")
 
             # Retrieve the connector from the first document in the child table
-            sinv_doc_company = frappe.get_value("Sales Invoice", self.documents[0], "company")
+            sinv_doc_company = frappe.get_value("Sales Invoice", self.documents[0].reference_document, "company")
             connector = get_company_eta_connector(sinv_doc_company)
 
-            submission_response = self._get_submission_details(connector)
-            
+            pages = EInvoiceSubmitter(connector).iter_submission_pages(self.submission_id)
+            submission_response = next(pages, None)
+
             if not submission_response:
                 frappe.msgprint('No submission response')
                 return
-                
-            self._update_documents_from_submission(submission_response)
-            self.save()
+
+            document_summaries = itertools.chain(
+                submission_response.get("documentSummary") or [],
+                (summary for page in pages for summary in page.get("documentSummary") or []),
+            )
+            self._update_documents_from_submission(submission_response, document_summaries)
                         
         except requests.RequestException as e:
             frappe.log_error(f"ETA API Request Failed: {str(e)}", "ETA API Error")
             frappe.throw(f"Failed to fetch submission details: {str(e)}")
 
-    def _get_submission_details(self, connector):
-        url = f"{connector.ETA_BASE}/documentSubmissions/{self.submission_id}"
+    def _update_documents_from_submission(self, submission_response, document_summaries):
+        """
+        Reconcile the documents of the log with the streamed `documentSummary` entries of all the
+        submission pages, then write every changed row and invoice in one pass.
+        """
+        doc_rows = {doc_row.reference_document: doc_row for doc_row in self.documents}
 
-        submitter = EInvoiceSubmitter(connector)
-        page_no = len(self.documents)
-        submission_response = submitter.get_submission_details(self.submission_id, page_no)
-        return submission_response
-
-    def _update_documents_from_submission(self, submission_response):
-        # Map internal IDs to their document details
-        document_map = {
-            doc.get("internalId"): doc 
-            for doc in submission_response.get("documentSummary", [])
-        }
-        
         # a dictionary to count document statuses
         status_counts = {
             "Submitted": 0,
@@ -186,9 +192,11 @@ class ETALog(Document):
             "Rejected": 0,
             "Cancelled": 0
         }
-        for doc_row in self.documents:
-            eta_doc = document_map.get(doc_row.reference_document)
-            if not eta_doc:
+        invoice_statuses = {}
+        row_values = {}
+        for eta_doc in document_summaries:
+            doc_row = doc_rows.get(eta_doc.get("internalId"))
+            if not doc_row:
                 continue
             
             # Update the status count
@@ -196,14 +204,18 @@ class ETALog(Document):
             if status in status_counts:
                 status_counts[status] += 1
             
-            doc_row.update({
+            row_values[doc_row.name] = {
                 "uuid": eta_doc.get("uuid"),
                 "eta_status": eta_doc.get("status"),
                 "long_id": eta_doc.get("longId"), 
                 "accepted": eta_doc.get("status") == "Valid",
                 "error": eta_doc.get("documentStatusReason") if eta_doc.get("documentStatusReason") else ""
-            })
-            frappe.db.set_value("Sales Invoice", doc_row.reference_document, "eta_status", status)
+            }
+            doc_row.update(row_values[doc_row.name])
+            invoice_statuses[doc_row.reference_document] = {"eta_status": status}
+
+        bulk_set_values("ETA Log Documents", row_values)
+        bulk_set_values("Sales Invoice", invoice_statuses)
         # Map ETA status to internal submission status
         self.submission_status = {
             "Valid": "Completed",
@@ -215,7 +227,7 @@ class ETALog(Document):
         metadata = submission_response.get("metadata", {})
         
         summary = [
-            f"Total Documents: {metadata.get('totalCount', 0)}",
+            f"Total Documents: {submission_response.get('documentCount') or metadata.get('totalCount', 0)}",
             f"Submitted: {status_counts['Submitted']}",
             f"Valid Documents: {status_counts['Valid']}",
             f"Invalid Documents: {status_counts['Invalid']}",
@@ -224,5 +236,11 @@ class ETALog(Document):
         ]
         
         self.submission_summary = "\n".join(summary)
-        # Store full response
-        self.eta_response = json.dumps(submission_response, indent=4)
\ No newline at end of file
+        # Store the response header, the documents are on the rows
+        submission_response = {k: v for k, v in submission_response.items() if k != "documentSummary"}
+        self.eta_response = json.dumps(submission_response, indent=4)
+        self.db_set({
+            "submission_status": self.submission_status,
+            "submission_summary": self.submission_summary,
+            "eta_response": self.eta_response,
+        })
\ No newline at end of file
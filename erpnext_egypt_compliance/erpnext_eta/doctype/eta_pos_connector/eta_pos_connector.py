@@ -4,14 +4,24 @@
 import frappe
 from frappe.model.document import Document
 import requests
-from frappe.utils import now, get_datetime
 from frappe.integrations.utils import make_request
 import json
 from erpnext_egypt_compliance.erpnext_eta.utils import create_eta_log, parse_error_details
+from erpnext_egypt_compliance.erpnext_eta.access_token import clear_access_token, get_access_token
 
 from requests.adapters import HTTPAdapter
+import os
 import ssl
+import threading
 import urllib3
+from urllib.parse import urlsplit
+
+# ssl.OP_LEGACY_SERVER_CONNECT, required by the ETA endpoints
+ETA_SSL_OPTIONS = 0x4
+
+_sessions = {}
+_sessions_pid = None
+_sessions_lock = threading.Lock()
 
 class ETAPOSConnector(Document):
 	def __init__(self, *args, **kwargs):
@@ -28,22 +38,20 @@ class ETAPOSConnector(Document):
 			self.ETA_BASE = self.PROD_URL
 			self.ID_URL = self.PROD_ID_URL
 
+		self.session = get_eta_session(self.ETA_BASE)
+
+	def on_update(self):
+		clear_access_token(self)
+
 	def get_access_token(self):
-		if self.access_token:
-			access_token = self.get_password(fieldname="access_token", raise_exception=False)
-		else:
-			access_token = self.refresh_eta_token()
-		# Add 3-minute buffer before expiry (matches B2B connector behavior)
-		expiry_with_buffer = frappe.utils.add_to_date(get_datetime(now()), minutes=3)
-		return (
-			access_token
-			if (access_token and expiry_with_buffer < get_datetime(self.expires_in))
-			else self.refresh_eta_token()
-		)
+		return get_access_token(self, self._request_access_token)
 
 	@frappe.whitelist()
 	def refresh_eta_token(self):
-		eta_session = ETASession().get_session()
+		return get_access_token(self, self._request_access_token, force_refresh=True)
+
+	def _request_access_token(self):
+		eta_session = get_eta_session(self.ID_URL)
 
 		headers = {
 			"content-type": "application/x-www-form-urlencoded",
@@ -90,21 +98,35 @@ class ETAPOSConnector(Document):
 				title=frappe._("ETA Authentication Error"),
 			)
 
-		# Token refresh successful
-		self.access_token = eta_response.get("access_token")
-		self.expires_in = frappe.utils.add_to_date(now(), seconds=eta_response.get("expires_in"))
-		self.save(ignore_permissions=True)
-		frappe.db.commit()
-		return eta_response.get("access_token")
+		return eta_response
 			
   
+def get_eta_session(url, ssl_options=ETA_SSL_OPTIONS):
+	"""
+	Get the session of this process for an ETA endpoint.
+
+	Sessions are shared per host and TLS settings, so their keep-alive connections are reused across
+	connectors, invoices, receipts and token refreshes. A forked worker starts with no sessions.
+	"""
+	global _sessions_pid
+
+	key = (urlsplit(url).netloc, ssl_options)
+	with _sessions_lock:
+		if _sessions_pid != os.getpid():
+			_sessions.clear()
+			_sessions_pid = os.getpid()
+		if key not in _sessions:
+			_sessions[key] = ETASession(ssl_options).get_session()
+		return _sessions[key]
+
+
 class ETASession:
-	def __init__(self):
+	def __init__(self, ssl_options=ETA_SSL_OPTIONS):
 		# Create a SSLContext object with TLSv1.2
 		ssl_context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
 		# ssl_context.minimum_version = ssl.TLSVersion.TLSv1_2
 		# ssl_context.options |= ssl.OP_NO_RENEGOTIATION
-		ssl_context.options |= 0x4
+		ssl_context.options |= ssl_options
 		# Create a new Requests Session
 		self.session = requests.Session()
 
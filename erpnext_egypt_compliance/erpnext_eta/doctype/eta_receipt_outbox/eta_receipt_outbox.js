@@ -0,0 +1,8 @@
+// Copyright (c) 2026, Axentor, LLC and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("ETA Receipt Outbox", {
+// 	refresh(frm) {
+
+// 	},
+// });
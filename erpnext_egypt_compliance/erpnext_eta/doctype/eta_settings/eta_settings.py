@@ -4,6 +4,9 @@
 # import frappe
 from frappe.model.document import Document
 
+from erpnext_egypt_compliance.erpnext_eta.master_data import clear_eta_settings_cache
+
 
 class ETASettings(Document):
-    pass
+    def on_update(self):
+        clear_eta_settings_cache()
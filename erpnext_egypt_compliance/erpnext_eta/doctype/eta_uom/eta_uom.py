@@ -4,6 +4,15 @@
 # import frappe
 from frappe.model.document import Document
 
+from erpnext_egypt_compliance.erpnext_eta.master_data import clear_uom_eta_codes_cache
+
 
 class ETAUOM(Document):
-    pass
+    def on_update(self):
+        clear_uom_eta_codes_cache()
+
+    def on_trash(self):
+        clear_uom_eta_codes_cache()
+
+    def after_rename(self, old, new, merge=False):
+        clear_uom_eta_codes_cache()
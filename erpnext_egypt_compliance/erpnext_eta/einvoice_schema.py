@@ -1,7 +1,7 @@
-import collections
 import json
 import re
 
+from functools import cached_property
 from typing import List, Dict, Optional
 
 from pydantic import BaseModel, validator, Field, root_validator
@@ -13,10 +13,15 @@ from erpnext_egypt_compliance.erpnext_eta.utils import (
     validate_allowed_values,
     eta_round,
 )
-from erpnext_egypt_compliance.erpnext_eta.ereceipt_schema import ItemWiseTaxDetails
+from erpnext_egypt_compliance.erpnext_eta.canonical import canonical_sha256
+from erpnext_egypt_compliance.erpnext_eta.ereceipt_schema import get_item_tax_rates
 from erpnext_egypt_compliance.erpnext_eta.legacy_einvoice import _abs_values
-INVOICE_RAW_DATA = {}
-COMPANY_DATA = {}
+from erpnext_egypt_compliance.erpnext_eta.master_data import (
+    get_eta_settings,
+    get_issuer_profile,
+    get_item_eta_codes,
+    get_uom_eta_code,
+)
 
 
 class Signature(BaseModel):
@@ -105,10 +110,11 @@ class Delivery(BaseModel):
 
 
     @classmethod
-    def get_delivery_data(cls, invoice):
+    def get_delivery_data(cls, invoice, loader=None):
         from datetime import date, datetime
         from frappe.core.utils import html2text
 
+        loader = loader or InvoiceDataLoader()
         if not invoice.get("custom_eta_more_details", []):
             return cls()
 
@@ -124,10 +130,11 @@ class Delivery(BaseModel):
             date_validity = None
 
         # strip terms
-        if delivery.get("terms"):
-            terms = frappe.get_value("Terms and Conditions", delivery.get("terms"), "terms", as_dict=True)
-            if terms:
-                delivery["terms"] = html2text(terms.get("terms"))
+        terms = delivery.get("terms")
+        if terms:
+            terms_text = loader.get_terms(terms)
+            if terms_text:
+                terms = html2text(terms_text)
 
 
         return cls(
@@ -138,7 +145,7 @@ class Delivery(BaseModel):
             countryOfOrigin=delivery.get("country_of_origin"),
             grossWeight=delivery.get("gross_weight"),
             netWeight=delivery.get("net_weight"),
-            terms=delivery.get("terms"),
+            terms=terms,
         )
     
 
@@ -164,40 +171,20 @@ class Payment(BaseModel):
         return v
 
     @classmethod
-    def get_payment_data(cls, bank_account: str, terms: str | None = None):
+    def get_payment_data(cls, bank_account: str, terms: str | None = None, loader=None):
         from frappe.utils import strip_html
-        from frappe.contacts.doctype.address.address import get_address_display
 
-        bank_account_data = frappe.get_value("Bank Account", bank_account, ["bank", "bank_account_no", "iban",], as_dict=True)
-        swift_number = frappe.get_value("Bank", bank_account_data.get("bank"), "swift_number")
+        bank_details = (loader or InvoiceDataLoader()).get_bank_details(bank_account)
         # strip terms
         if terms:
             terms = strip_html(terms)
 
-        # get Bank Address
-        address_name = frappe.get_all(
-            "Dynamic Link",
-            filters={
-                "link_doctype": "Bank",
-                "link_name": bank_account_data.get("bank"),
-                "parenttype": "Address",
-                "parentfield": "links"
-            },
-            fields=["parent"],
-            limit=1
-        )
-
-        bank_address = None
-        if address_name:
-            bank_address = frappe.get_doc("Address", address_name[0].parent)
-            bank_address = get_address_display(bank_address.as_dict()).replace("<br>", " ")
-
         return cls(
-            bankName=bank_account_data.bank,
-            bankAddress=bank_address,
-            bankAccountNo=bank_account_data.bank_account_no,
-            bankAccountIBAN=bank_account_data.iban,
-            swiftCode=swift_number,
+            bankName=bank_details.bank,
+            bankAddress=bank_details.bank_address,
+            bankAccountNo=bank_details.bank_account_no,
+            bankAccountIBAN=bank_details.iban,
+            swiftCode=bank_details.swift_number,
             terms=terms,
         )
 
@@ -305,11 +292,6 @@ class Invoice(BaseModel):
     def validate_mandatories(cls, values):
         return validate_mandatory_fields(cls, values)
 
-    @validator("dateTimeIssued", pre=True, always=True)
-    def eta_datetime_format(cls, value):
-        seconds = INVOICE_RAW_DATA.get("posting_time").seconds
-        return eta_datetime_issued_format(value, seconds)
-
     @validator("totalSalesAmount", "netAmount", "totalAmount")
     def apply_eta_round_total_sales_amount(cls, value, values):
         return eta_round(value)
@@ -318,35 +300,298 @@ class Invoice(BaseModel):
         return json.dumps(self.dict(exclude_none=True, exclude_unset=True), **kwargs)
 
 
+class InvoiceDataLoader:
+    """Read the master data an e-invoice is built from, one record per call."""
+
+    def get_invoice(self, docname: str) -> Dict:
+        return frappe.get_doc("Sales Invoice", docname).as_dict()
+
+    def get_issuer_profile(self, company: str) -> Dict:
+        return get_issuer_profile(company)
+
+    def get_customer(self, customer: str) -> Dict:
+        return frappe.get_doc("Customer", customer).as_dict()
+
+    def get_address(self, address: str) -> Dict:
+        return frappe.get_doc("Address", address).as_dict()
+
+    def get_country_code(self, country: str) -> str:
+        return frappe.db.get_value("Country", country, "code")
+
+    def get_item_eta_codes(self, item_codes: List[str]) -> Dict[str, Dict]:
+        """Return the resolved ETA code of each item, see `get_item_eta_codes`."""
+        return get_item_eta_codes(item_codes)
+
+    def get_uom_eta(self, uom: str) -> str:
+        return get_uom_eta_code(uom)
+
+    def get_eta_setting(self, fieldname: str):
+        return get_eta_settings().get(fieldname)
+
+    def get_bank_details(self, bank_account: str) -> Dict:
+        """Return the bank account, its bank SWIFT code and the bank address display."""
+        from frappe.contacts.doctype.address.address import get_address_display
+
+        bank_details = frappe.get_value("Bank Account", bank_account, ["bank", "bank_account_no", "iban",], as_dict=True)
+        bank_details.swift_number = frappe.get_value("Bank", bank_details.get("bank"), "swift_number")
+
+        # get Bank Address
+        address_name = frappe.get_all(
+            "Dynamic Link",
+            filters={
+                "link_doctype": "Bank",
+                "link_name": bank_details.get("bank"),
+                "parenttype": "Address",
+                "parentfield": "links"
+            },
+            fields=["parent"],
+            limit=1
+        )
+
+        bank_details.bank_address = None
+        if address_name:
+            bank_address = frappe.get_doc("Address", address_name[0].parent)
+            bank_details.bank_address = get_address_display(bank_address.as_dict()).replace("<br>", " ")
+        return bank_details
+
+    def get_terms(self, terms: str) -> str:
+        return frappe.get_value("Terms and Conditions", terms, "terms")
+
+
+class BulkInvoiceDataLoader(InvoiceDataLoader):
+    """
+    Prefetch the master data of several Sales Invoices in a fixed number of queries.
+
+    Records that were not prefetched fall back to the per-record reads of `InvoiceDataLoader`.
+    """
+
+    INVOICE_CHILD_TABLES = (
+        ("Sales Invoice Item", "items"),
+        ("Sales Taxes and Charges", "taxes"),
+        ("ETA Details", "custom_eta_more_details"),
+    )
+
+    def __init__(self, docnames: List[str]):
+        self.invoices = self._get_all_by_name("Sales Invoice", docnames)
+        self._load_invoice_children()
+
+        self.customers = self._get_all_by_name("Customer", {i.customer for i in self.invoices.values()})
+        self.addresses = self._get_all_by_name("Address", {c.customer_primary_address for c in self.customers.values()})
+        self.country_codes = self._get_values_by_name("Country", {a.country for a in self.addresses.values()}, "code")
+
+        lines = [line for invoice in self.invoices.values() for line in invoice["items"]]
+        self.item_eta_codes = get_item_eta_codes([line.item_code for line in lines])
+        self.eta_settings = get_eta_settings()
+
+        more_details = [invoice["custom_eta_more_details"][0] for invoice in self.invoices.values() if invoice["custom_eta_more_details"]]
+        self.terms = self._get_values_by_name("Terms and Conditions", {d.terms for d in more_details}, "terms")
+        self.bank_details = self._load_bank_details({d.bank_account for d in more_details})
+
+    @staticmethod
+    def _get_all_by_name(doctype: str, names, fields=None) -> Dict:
+        names = [name for name in names if name]
+        if not names:
+            return {}
+        return {
+            row.name: row
+            for row in frappe.get_all(doctype, filters={"name": ["in", names]}, fields=fields or ["*"])
+        }
+
+    @classmethod
+    def _get_values_by_name(cls, doctype: str, names, fieldname: str) -> Dict:
+        rows = cls._get_all_by_name(doctype, names, fields=["name", fieldname])
+        return {name: row.get(fieldname) for name, row in rows.items()}
+
+    def _load_invoice_children(self):
+        for child_doctype, parentfield in self.INVOICE_CHILD_TABLES:
+            for invoice in self.invoices.values():
+                invoice[parentfield] = []
+            if not self.invoices:
+                continue
+
+            rows = frappe.get_all(
+                child_doctype,
+                filters={
+                    "parenttype": "Sales Invoice",
+                    "parentfield": parentfield,
+                    "parent": ["in", list(self.invoices)],
+                },
+                fields=["*"],
+                order_by="idx asc",
+            )
+            for row in rows:
+                self.invoices[row.parent][parentfield].append(row)
+
+    def _load_bank_details(self, bank_accounts) -> Dict:
+        from frappe.contacts.doctype.address.address import get_address_display
+
+        accounts = self._get_all_by_name("Bank Account", bank_accounts, fields=["name", "bank", "bank_account_no", "iban"])
+        banks = {account.bank for account in accounts.values() if account.bank}
+        swift_numbers = self._get_values_by_name("Bank", banks, "swift_number")
+
+        bank_address_names = {}
+        if banks:
+            links = frappe.get_all(
+                "Dynamic Link",
+                filters={
+                    "link_doctype": "Bank",
+                    "link_name": ["in", list(banks)],
+                    "parenttype": "Address",
+                    "parentfield": "links",
+                },
+                fields=["parent", "link_name"],
+            )
+            for link in links:
+                bank_address_names.setdefault(link.link_name, link.parent)
+        bank_addresses = self._get_all_by_name("Address", bank_address_names.values())
+
+        bank_details = {}
+        for name, account in accounts.items():
+            bank_address = bank_addresses.get(bank_address_names.get(account.bank))
+            bank_details[name] = frappe._dict(
+                bank=account.bank,
+                bank_account_no=account.bank_account_no,
+                iban=account.iban,
+                swift_number=swift_numbers.get(account.bank),
+                bank_address=get_address_display(bank_address).replace("<br>", " ") if bank_address else None,
+            )
+        return bank_details
+
+    def get_invoice(self, docname: str) -> Dict:
+        if docname in self.invoices:
+            return self.invoices[docname]
+        return super().get_invoice(docname)
+
+    def get_customer(self, customer: str) -> Dict:
+        if customer in self.customers:
+            return self.customers[customer]
+        return super().get_customer(customer)
+
+    def get_address(self, address: str) -> Dict:
+        if address in self.addresses:
+            return self.addresses[address]
+        return super().get_address(address)
+
+    def get_country_code(self, country: str) -> str:
+        if country in self.country_codes:
+            return self.country_codes[country]
+        return super().get_country_code(country)
+
+    def get_item_eta_codes(self, item_codes: List[str]) -> Dict[str, Dict]:
+        missing = [code for code in item_codes if code not in self.item_eta_codes]
+        if missing:
+            self.item_eta_codes.update(super().get_item_eta_codes(missing))
+        return {code: self.item_eta_codes[code] for code in item_codes if code in self.item_eta_codes}
+
+    def get_eta_setting(self, fieldname: str):
+        return self.eta_settings.get(fieldname)
+
+    def get_bank_details(self, bank_account: str) -> Dict:
+        if bank_account in self.bank_details:
+            return self.bank_details[bank_account]
+        return super().get_bank_details(bank_account)
+
+    def get_terms(self, terms: str) -> str:
+        if terms in self.terms:
+            return self.terms[terms]
+        return super().get_terms(terms)
+
+
+class InvoiceBuildContext:
+    """
+    The state of a single e-invoice build.
+
+    The builders read the invoice and its company issuer profile from the context they are given
+    rather than from module state, so several invoices can be built concurrently in one process.
+    """
+
+    def __init__(self, invoice: Dict, company: Dict, loader: InvoiceDataLoader = None):
+        self.invoice = invoice
+        self.company = company
+        self.loader = loader or InvoiceDataLoader()
+        # item_code -> resolved ETA code of the invoice lines, see `get_invoice_lines`
+        self.item_eta_codes = {}
+
+    @property
+    def branch_data(self) -> Dict:
+        return self.company.get("branch_data") or {}
+
+    @cached_property
+    def eta_taxes(self) -> List[Dict]:
+        """The tax rows of the invoice that are reported to the ETA."""
+        return [tax for tax in self.invoice.get("taxes") or [] if not tax.get("disable_eta")]
+
+    @cached_property
+    def item_tax_rates(self) -> Dict[str, List[Optional[float]]]:
+        """item_code -> rate of the item in each of `eta_taxes`."""
+        return get_item_tax_rates(self.eta_taxes)
+
+    @classmethod
+    def load(cls, docname: str, loader: InvoiceDataLoader = None):
+        """Load the Sales Invoice and the issuer profile of its company."""
+        loader = loader or InvoiceDataLoader()
+        invoice = loader.get_invoice(docname)
+        company = loader.get_issuer_profile(invoice.get("company"))
+        return cls(invoice, company, loader)
+
+
 def get_invoice_asjson(docname: str, as_dict: bool=False):
     # Get the raw data from the database
-    set_global_raw_data(docname)
-
-    issuer = get_issuer()
-    receiver = get_receiver()
-    validate_receiver_compliance(receiver)
-    document_type = "C" if INVOICE_RAW_DATA.get("is_return") else "I"
-    document_type_version = "1.0" if INVOICE_RAW_DATA.eta_signature else "0.9"
-    date_time_issued = INVOICE_RAW_DATA.get("posting_date")
-    taxpayer_activity_code = COMPANY_DATA.get("eta_default_activity_code")
-    internal_id = INVOICE_RAW_DATA.get("name")
-    first_row = INVOICE_RAW_DATA.get("custom_eta_more_details")[0] if INVOICE_RAW_DATA.get("custom_eta_more_details") else {}
-    purchase_order_reference = INVOICE_RAW_DATA.get("po_no")
-    purchase_order_description = first_row.get("purchase_order_description") if INVOICE_RAW_DATA.get("custom_eta_more_details") else ""
-    sales_order_reference = first_row.get("sales_order_reference") if INVOICE_RAW_DATA.get("custom_eta_more_details") else ""
-    sales_order_description = first_row.get("sales_order_description") if INVOICE_RAW_DATA.get("custom_eta_more_details") else ""
-    proforma_invoice_number = first_row.get("proforma_invoice_number") if INVOICE_RAW_DATA.get("custom_eta_more_details") else ""
-    bank_acc = first_row.get("bank_account") if INVOICE_RAW_DATA.get("custom_eta_more_details") else None
+    ctx = InvoiceBuildContext.load(docname)
+    return build_invoice(ctx, as_dict)
+
+
+def build_invoices_asjson(docnames: List[str], as_dict: bool = False) -> List:
+    """
+    Build the e-invoices of several Sales Invoices, loading their master data in bulk.
+
+    Produces the same documents as calling `get_invoice_asjson` for each docname, in the same order.
+    """
+    loader = BulkInvoiceDataLoader(docnames)
+    return [build_invoice(InvoiceBuildContext.load(docname, loader), as_dict) for docname in docnames]
+
+
+def get_signable_invoice(einvoice: Dict) -> Dict:
+    """The document the ETA signer signs: the e-invoice without its signatures, as version 1.0."""
+    signable = {key: value for key, value in einvoice.items() if key != "signatures"}
+    signable["documentTypeVersion"] = "1.0"
+    return signable
+
+
+def get_invoice_hash(einvoice: Dict) -> str:
+    """
+    The hex SHA-256 of the canonical serialization of an e-invoice, the digest its signature covers.
+    see https://sdk.invoicing.eta.gov.eg/signature-creation/
+    """
+    return canonical_sha256(get_signable_invoice(einvoice))
+
+
+def build_invoice(ctx: InvoiceBuildContext, as_dict: bool=False):
+    issuer = get_issuer(ctx)
+    receiver = get_receiver(ctx)
+    validate_receiver_compliance(ctx, receiver)
+    document_type = "C" if ctx.invoice.get("is_return") else "I"
+    document_type_version = "1.0" if ctx.invoice.eta_signature else "0.9"
+    date_time_issued = eta_datetime_issued_format(ctx.invoice.get("posting_date"), ctx.invoice.get("posting_time").seconds)
+    taxpayer_activity_code = ctx.company.get("eta_default_activity_code")
+    internal_id = ctx.invoice.get("name")
+    first_row = ctx.invoice.get("custom_eta_more_details")[0] if ctx.invoice.get("custom_eta_more_details") else {}
+    purchase_order_reference = ctx.invoice.get("po_no")
+    purchase_order_description = first_row.get("purchase_order_description") if ctx.invoice.get("custom_eta_more_details") else ""
+    sales_order_reference = first_row.get("sales_order_reference") if ctx.invoice.get("custom_eta_more_details") else ""
+    sales_order_description = first_row.get("sales_order_description") if ctx.invoice.get("custom_eta_more_details") else ""
+    proforma_invoice_number = first_row.get("proforma_invoice_number") if ctx.invoice.get("custom_eta_more_details") else ""
+    bank_acc = first_row.get("bank_account") if ctx.invoice.get("custom_eta_more_details") else None
     payment = None
     if bank_acc:
-        payment = Payment.get_payment_data(bank_account=bank_acc, terms=INVOICE_RAW_DATA.get("terms"))
-    invoice_lines = get_invoice_lines()
+        payment = Payment.get_payment_data(bank_account=bank_acc, terms=ctx.invoice.get("terms"), loader=ctx.loader)
+    invoice_lines = get_invoice_lines(ctx)
     total_discount_amount = calculate_total_discount_amount(invoice_lines)
     total_sales_amount = sum([line.salesTotal for line in invoice_lines])
-    net_amount, __legacy_total_amount = get_net_total_amount()
+    net_amount, __legacy_total_amount = get_net_total_amount(ctx)
     total_amount = sum(line.total for line in invoice_lines)
     tax_totals = get_tax_totals(invoice_lines)
-    signatures = get_signatures()
+    signatures = get_signatures(ctx)
 
     invoice = Invoice(
         issuer=issuer,
@@ -362,7 +607,7 @@ def get_invoice_asjson(docname: str, as_dict: bool=False):
         salesOrderDescription=sales_order_description or "",
         proformaInvoiceNumber=proforma_invoice_number or "",
         payment=payment.model_dump() if payment else {},
-        delivery=Delivery.get_delivery_data(INVOICE_RAW_DATA).model_dump(),
+        delivery=Delivery.get_delivery_data(ctx.invoice, loader=ctx.loader).model_dump(),
         invoiceLines=invoice_lines,
         totalDiscountAmount=total_discount_amount,
         extraDiscountAmount=0.0,
@@ -377,63 +622,31 @@ def get_invoice_asjson(docname: str, as_dict: bool=False):
     return invoice.json(indent=4, ensure_ascii=False) if not as_dict else _abs_values(invoice.model_dump(exclude_none=True, exclude_unset=True))
 
 
-def set_global_raw_data(docname: str) -> None:
-    """Get the raw POS data from the database."""
-
-    def _pos_total_qty():
-        """Add _total_qty to the POS Invoice Item."""
-        total = collections.defaultdict(int)
-        for item in INVOICE_RAW_DATA.get("items"):
-            total[item.get("item_code")] += item.get("qty")
-        INVOICE_RAW_DATA["_total_qty"] = total
-
-    def _add_branch_data():
-        """Add branch data to the POS Invoice."""
-        branch = frappe.get_doc("Branch", COMPANY_DATA.get("eta_default_branch"))
-        branch_address = frappe.get_doc("Address", branch.get("eta_branch_address"))
-        INVOICE_RAW_DATA["branch_data"] = {
-            **branch.as_dict(),
-            **branch_address.as_dict(),
-        }
-
-    global INVOICE_RAW_DATA
-    global COMPANY_DATA
-
-    # Set the global POS data
-    INVOICE_RAW_DATA = frappe.get_doc("Sales Invoice", docname).as_dict()
-
-    # Set the global company data
-    COMPANY_DATA = frappe.get_doc("Company", INVOICE_RAW_DATA.get("company")).as_dict()
-
-    _pos_total_qty()
-    _add_branch_data()
-
-
-def get_issuer():
+def get_issuer(ctx: InvoiceBuildContext):
     """Get the invoice issuer."""
     return Issuer(
-        type=COMPANY_DATA.get("eta_issuer_type"),
-        id=COMPANY_DATA.get("eta_tax_id"),
-        name=COMPANY_DATA.get("eta_issuer_name"),
+        type=ctx.company.get("eta_issuer_type"),
+        id=ctx.company.get("eta_tax_id"),
+        name=ctx.company.get("eta_issuer_name"),
         address=IssuerAddress(
-            branchId=INVOICE_RAW_DATA.get("branch_data").get("eta_branch_id"),
-            country=frappe.db.get_value("Country", COMPANY_DATA.get("country"), "code"),
-            governate=INVOICE_RAW_DATA.get("branch_data").get("state"),
-            regionCity=INVOICE_RAW_DATA.get("branch_data").get("city"),
-            street=INVOICE_RAW_DATA.get("branch_data").get("address_line1"),
-            buildingNumber=INVOICE_RAW_DATA.get("branch_data").get("building_number"),
-            postalCode=COMPANY_DATA.get("postal_code", None),
-            floor=COMPANY_DATA.get("floor", None),
-            room=COMPANY_DATA.get("room", None),
-            landmark=COMPANY_DATA.get("landmark", None),
-            additionalInformation=COMPANY_DATA.get("additional_information", None),
+            branchId=ctx.branch_data.get("eta_branch_id"),
+            country=ctx.company.get("country_code"),
+            governate=ctx.branch_data.get("state"),
+            regionCity=ctx.branch_data.get("city"),
+            street=ctx.branch_data.get("address_line1"),
+            buildingNumber=ctx.branch_data.get("building_number"),
+            postalCode=ctx.company.get("postal_code", None),
+            floor=ctx.company.get("floor", None),
+            room=ctx.company.get("room", None),
+            landmark=ctx.company.get("landmark", None),
+            additionalInformation=ctx.company.get("additional_information", None),
         ),
     )
 
 
-def get_receiver():
+def get_receiver(ctx: InvoiceBuildContext):
     """Get the invoice receiver."""
-    customer = frappe.get_doc("Customer", INVOICE_RAW_DATA.get("customer")).as_dict()
+    customer = ctx.loader.get_customer(ctx.invoice.get("customer"))
     customer_type = customer.get("eta_receiver_type", "P")
     customer_id = customer.get("tax_id", "").replace("-", "")
 
@@ -444,7 +657,7 @@ def get_receiver():
                 _("Customer {0} must have a Tax ID to be used as Business receiver.").format(customer.get("name")),
                 title=_("ETA Validation"),
             )
-    if customer_type == "P" and INVOICE_RAW_DATA.get("grand_total") >= 45000 and not re.match(r"^\d{14}$", customer_id):
+    if customer_type == "P" and ctx.invoice.get("grand_total") >= 45000 and not re.match(r"^\d{14}$", customer_id):
             frappe.throw(
                 _("Customer {0} must have a valid Tax ID (14 digits) to be used as Business receiver for invoices with grand total equal or above 45,000 EGP.").format(customer.get("name")),
                 title=_("ETA Validation"),
@@ -481,9 +694,9 @@ def get_receiver():
         )
 
     if customer_address_name:
-        customer_address = frappe.get_doc("Address", customer_address_name)
+        customer_address = ctx.loader.get_address(customer_address_name)
         address = ReceiverAddress(
-            country=frappe.db.get_value("Country", customer_address.country, "code"),
+            country=ctx.loader.get_country_code(customer_address.country),
             governate=customer_address.state,
             regionCity=customer_address.city,
             street=customer_address.address_line1,
@@ -503,7 +716,7 @@ def get_receiver():
     )
     return eta_receiver
 
-def validate_receiver_compliance(receiver: Receiver):
+def validate_receiver_compliance(ctx: InvoiceBuildContext, receiver: Receiver):
     """Validate ETA compliance rules for receiver before submission."""
 
     if receiver.type == "B":
@@ -514,7 +727,7 @@ def validate_receiver_compliance(receiver: Receiver):
             )
 
     elif receiver.type == "P":
-        if INVOICE_RAW_DATA.get("grand_total") >= 25000:
+        if ctx.invoice.get("grand_total") >= 25000:
             if not receiver.id or not re.fullmatch(r"\d{14}", receiver.id):
                 frappe.throw(
                     _("Individuals with invoices ≥ 25,000 EGP must have a valid 14-digit Tax ID"),
@@ -533,45 +746,36 @@ def _get_tax_amount(item_tax_detail: float, net_rate: float, qty: float, _exchan
     return item_tax_detail * net_rate * qty * _exchange_rate
 
 
-def _get_item_taxable_items(_item_data: Dict, net_total: float):
+def _get_item_taxable_items(ctx: InvoiceBuildContext, _item_data: Dict, net_total: float):
     """Calculate taxable items - use net_total as tax base."""
     taxable_items = []
-    if INVOICE_RAW_DATA.get("taxes"):
-        for tax in INVOICE_RAW_DATA.get("taxes"):
-            if tax.get("disable_eta"):
-                continue
-
-            tax_type = tax.get("eta_tax_type")
-            sub_type = tax.get("eta_tax_sub_type")
-
-            item_wise_tax_detail_asjson = json.loads(tax.get("item_wise_tax_detail"))
-            items_tax_detail_list = ItemWiseTaxDetails(data=item_wise_tax_detail_asjson)
-            item_tax_detail = items_tax_detail_list.data.get(_item_data.get("item_code"))
-
-            rate = item_tax_detail[0]
-
-            # HOTFIX: Use net_total (already in EGP) as tax base
-            # TODO: Test & Support the Tax Price inclusive.
-            amount = eta_round(net_total * rate / 100)
-
-            taxable_items.append(
-                TaxableItem(
-                    taxType=tax_type,
-                    amount=amount,
-                    subType=sub_type,
-                    rate=rate,
-                )
+    rates = ctx.item_tax_rates.get(_item_data.get("item_code")) or [None] * len(ctx.eta_taxes)
+    for tax, rate in zip(ctx.eta_taxes, rates, strict=True):
+        tax_type = tax.get("eta_tax_type")
+        sub_type = tax.get("eta_tax_sub_type")
+
+        # HOTFIX: Use net_total (already in EGP) as tax base
+        # TODO: Test & Support the Tax Price inclusive.
+        amount = eta_round(net_total * rate / 100)
+
+        taxable_items.append(
+            TaxableItem(
+                taxType=tax_type,
+                amount=amount,
+                subType=sub_type,
+                rate=rate,
             )
+        )
     return taxable_items
 
 
-def _get_sales_and_net_totals(_item_data: Dict):
+def _get_sales_and_net_totals(ctx: InvoiceBuildContext, _item_data: Dict):
 
     item_base_amount = _item_data.get("base_amount")
-    item_exchange_rate = INVOICE_RAW_DATA.get("conversion_rate") or _item_data.get("_exchange_rate") or 1
+    item_exchange_rate = ctx.invoice.get("conversion_rate") or _item_data.get("_exchange_rate") or 1
     item_net_amount = _item_data.get("net_amount")
 
-    if INVOICE_RAW_DATA.get("currency") == "EGP":
+    if ctx.invoice.get("currency") == "EGP":
         _sales_total = _net_total = item_base_amount
     else:
         _sales_total = _net_total = item_net_amount * item_exchange_rate
@@ -579,18 +783,18 @@ def _get_sales_and_net_totals(_item_data: Dict):
     return _sales_total, _net_total
 
 
-def _get_item_unit_value(_item_data: Dict):
+def _get_item_unit_value(ctx: InvoiceBuildContext, _item_data: Dict):
     """Get the item unit value."""
 
-    if INVOICE_RAW_DATA.get("currency") == "EGP":
+    if ctx.invoice.get("currency") == "EGP":
         return Value(
             currencySold="EGP",
             amountEGP=_item_data.get("net_rate"),
         )
     
     else:
-        currency_sold = INVOICE_RAW_DATA.get("currency")
-        currency_exchange_rate = _exchange_rate = INVOICE_RAW_DATA.get("conversion_rate")
+        currency_sold = ctx.invoice.get("currency")
+        currency_exchange_rate = _exchange_rate = ctx.invoice.get("conversion_rate")
         amount_egp = _unit_price = _item_data.get("net_rate") * (_exchange_rate or 1)
         
 
@@ -605,30 +809,23 @@ def _get_item_unit_value(_item_data: Dict):
             currencyExchangeRate = currency_exchange_rate
         )
 
-def _get_item_code_and_type(_item_data: Dict):
-    # default item code and type
-    _code = _item_data.get("eta_item_code") or frappe.get_value("ETA Settings", "ETA Settings", "eta_item_code")
-    _type = _item_data.get("eta_code_type", "GS1")
-
-    if _item_data.get("eta_inherit_brand"):
-        _code = frappe.get_value("Brand", _item_data.get("brand"), "eta_item_code")
-        _type = frappe.get_value("Brand", _item_data.get("brand"), "eta_code_type")
-    elif _item_data.get("eta_inherit_item_group"):
-        _code = frappe.get_value("Item Group", _item_data.get("item_group"), "eta_item_code")
-        _type = frappe.get_value("Item Group", _item_data.get("item_group"), "eta_code_type")
+def _get_item_code_and_type(ctx: InvoiceBuildContext, _item_data: Dict):
+    item_eta_code = ctx.item_eta_codes.get(_item_data.get("item_code")) or {}
+    if item_eta_code.get("inherited"):
+        return item_eta_code.get("item_code"), item_eta_code.get("item_type")
 
+    # default item code and type
+    _code = item_eta_code.get("item_code") or ctx.loader.get_eta_setting("eta_item_code")
+    _type = item_eta_code.get("item_type") or "GS1"
     return _code, _type
 
 
-def _get_item_data(_item_data: Dict):
-    _item_doc = frappe.get_doc("Item", _item_data.get("item_code")).as_dict()
-    _eta_item_code, _eta_item_type = _get_item_code_and_type(_item_doc)
-    unit_type = frappe.get_value("UOM", _item_data.get("uom"), "eta_uom") or frappe.get_value(
-        "ETA Settings", "ETA Settings", "eta_uom"
-    )
-    unit_value = _get_item_unit_value(_item_data)
-    sales_total, net_total = _get_sales_and_net_totals(_item_data)
-    taxable_items = _get_item_taxable_items(_item_data, net_total)
+def _get_item_data(ctx: InvoiceBuildContext, _item_data: Dict):
+    _eta_item_code, _eta_item_type = _get_item_code_and_type(ctx, _item_data)
+    unit_type = ctx.loader.get_uom_eta(_item_data.get("uom")) or ctx.loader.get_eta_setting("eta_uom")
+    unit_value = _get_item_unit_value(ctx, _item_data)
+    sales_total, net_total = _get_sales_and_net_totals(ctx, _item_data)
+    taxable_items = _get_item_taxable_items(ctx, _item_data, net_total)
     item_total = _get_item_total(net_total, taxable_items)
     # TODO:
     item_discount = None
@@ -649,10 +846,11 @@ def _get_item_data(_item_data: Dict):
     }
 
 
-def get_invoice_lines():
+def get_invoice_lines(ctx: InvoiceBuildContext):
+    ctx.item_eta_codes = ctx.loader.get_item_eta_codes([item.get("item_code") for item in ctx.invoice.get("items")])
     invoice_lines = []
-    for item in INVOICE_RAW_DATA.get("items"):
-        item_data = _get_item_data(item)
+    for item in ctx.invoice.get("items"):
+        item_data = _get_item_data(ctx, item)
         invoice_lines.append(
             InvoiceLine(
                 description=item_data.get("description"),
@@ -680,15 +878,15 @@ def calculate_total_discount_amount(_invoice_lines):
     return sum([sum([d.amount for d in discount]) for discount in invoice_discounts_list if discount])
 
 
-def get_net_total_amount():
-    is_foreign_currency = INVOICE_RAW_DATA.get("conversion_rate") or INVOICE_RAW_DATA.get("_foreign_company_currency")
+def get_net_total_amount(ctx: InvoiceBuildContext):
+    is_foreign_currency = ctx.invoice.get("conversion_rate") or ctx.invoice.get("_foreign_company_currency")
 
-    _base_total = INVOICE_RAW_DATA.get("base_total")
-    _net_total = INVOICE_RAW_DATA.get("net_total")
-    _base_grand_total = INVOICE_RAW_DATA.get("base_grand_total")
-    _exchange_rate = INVOICE_RAW_DATA.get("conversion_rate") or INVOICE_RAW_DATA.get("_exchange_rate") or 1
+    _base_total = ctx.invoice.get("base_total")
+    _net_total = ctx.invoice.get("net_total")
+    _base_grand_total = ctx.invoice.get("base_grand_total")
+    _exchange_rate = ctx.invoice.get("conversion_rate") or ctx.invoice.get("_exchange_rate") or 1
 
-    if INVOICE_RAW_DATA.get("currency") == "EGP":
+    if ctx.invoice.get("currency") == "EGP":
         _net_amount = _net_total * _exchange_rate
         _total_amount = _base_grand_total
     else:
@@ -712,11 +910,11 @@ def get_tax_totals(invoice_lines):
             for tax_type, amount in tax_sums.items()] 
 
 
-def get_signatures():
+def get_signatures(ctx: InvoiceBuildContext):
     return [
         Signature(
             signatureType="I",
-            value=INVOICE_RAW_DATA.get("eta_signature") if INVOICE_RAW_DATA.get("eta_signature") else "ANY",
+            value=ctx.invoice.get("eta_signature") if ctx.invoice.get("eta_signature") else "ANY",
         )
     ]
 
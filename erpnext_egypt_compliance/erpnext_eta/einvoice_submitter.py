@@ -1,6 +1,20 @@
+import math
+
 import frappe
 import json
 from erpnext_egypt_compliance.erpnext_eta.doctype.eta_connector.eta_connector import ETAConnector
+from erpnext_egypt_compliance.erpnext_eta.eta_http import iter_concurrently, send_concurrently
+
+# ETA limits on a single POST to /documentsubmissions
+ETA_MAX_DOCUMENTS_PER_SUBMISSION = 500
+ETA_MAX_SUBMISSION_BYTES = 10 * 1024 * 1024
+
+# bytes `EInvoiceSubmitter._prepare_data` adds around and between the serialized documents
+SUBMISSION_ENVELOPE_BYTES = len(b'{"documents": []}')
+SUBMISSION_SEPARATOR_BYTES = len(b", ")
+
+ETA_SUBMISSION_PAGE_SIZE = 100
+
 
 class EInvoiceSubmitter:
     """
@@ -26,7 +40,7 @@ class EInvoiceSubmitter:
     
     def _prepare_data(self, einvoices):
         data = frappe._dict({"documents": einvoices})
-        return json.dumps(data, ensure_ascii=False).encode("utf8")
+        return _serialize(data)
 
     def _send_submit_request(self, data):
         url = self.eta_connector.DOCUMET_SUBMISSION
@@ -54,6 +68,37 @@ class EInvoiceSubmitter:
         else:
             frappe.throw(f"Failed to download PDF. Status code: {response.status_code}")
     
+    def get_eta_pdfs(self, docnames):
+        """
+        Download the ETA PDFs of several Sales Invoices concurrently.
+
+        Returns:
+            dict: docname -> PDF content, for the invoices downloaded successfully.
+        """
+        headers = self.eta_connector.get_headers()
+        uuids = frappe.get_all(
+            "Sales Invoice",
+            filters={"name": ["in", docnames], "eta_uuid": ["is", "set"]},
+            fields=["name", "eta_uuid"],
+            as_list=True,
+        )
+        responses = send_concurrently(
+            self.eta_connector.session,
+            {
+                docname: ("GET", f"{self.eta_connector.ETA_BASE}/documents/{uuid}/pdf", {"headers": headers})
+                for docname, uuid in uuids
+            },
+        )
+
+        pdfs = {}
+        for docname, response in responses.items():
+            if isinstance(response, Exception) or response.status_code != 200:
+                status = response if isinstance(response, Exception) else f"Status code: {response.status_code}"
+                frappe.log_error(f"ETA PDF Download Error for invoice {docname}: {status}")
+                continue
+            pdfs[docname] = response.content
+        return pdfs
+
     def cancel_document(self, uuid, reason):
         """Cancel a submitted document in the ETA portal
         
@@ -91,26 +136,102 @@ class EInvoiceSubmitter:
         traceback = frappe.get_traceback()
         error_doc = frappe.log_error("Submit EInvoice", message=str(exception) + "\n" + str(traceback))
 
-    def get_submission_details(self, submission_id, page_no=1):
+    def get_submission_details(self, submission_id, page_no=1, page_size=ETA_SUBMISSION_PAGE_SIZE):
         """
         Fetch document submission details from ETA API.
         """
-        headers = self.eta_connector.get_headers()
-        headers.update({
-            "PageSize": "20",
-            "PageNo": str(page_no)
-        })
-        url = f"{self.eta_connector.ETA_BASE}/documentSubmissions/{submission_id}"
+        url, headers = self._get_submission_page_request(submission_id, page_no, page_size)
+        response = None
         try:
             response = self.eta_connector.session.get(url, headers=headers)
             response.raise_for_status()
             return response.json()
         except Exception as e:
-            message = f"Failed to fetch submission details: {e}"
-            if response is not None:
-                try:
-                    message += f"\nResponse: {response.text}"
-                except Exception:
-                    pass
-            frappe.log_error(message)
+            self._log_submission_details_error(e, response)
             return frappe._dict()
+
+    def iter_submission_pages(self, submission_id, page_size=ETA_SUBMISSION_PAGE_SIZE, concurrency=None):
+        """
+        Yield every page of the details of a submission.
+
+        The first page is yielded first, it gives the document count; the remaining pages are then
+        fetched concurrently and yielded in the order they arrive.
+        """
+        first_page = self.get_submission_details(submission_id, 1, page_size)
+        if not first_page:
+            return
+        yield first_page
+
+        page_count = math.ceil((first_page.get("documentCount") or 0) / page_size)
+        requests_by_page = {}
+        for page_no in range(2, page_count + 1):
+            url, headers = self._get_submission_page_request(submission_id, page_no, page_size)
+            requests_by_page[page_no] = ("GET", url, {"headers": headers})
+
+        for _page_no, response in iter_concurrently(self.eta_connector.session, requests_by_page, concurrency):
+            if isinstance(response, Exception) or not response.ok:
+                self._log_submission_details_error(response, None if isinstance(response, Exception) else response)
+                continue
+            yield response.json()
+
+    def iter_submission_documents(self, submission_id, page_size=ETA_SUBMISSION_PAGE_SIZE, concurrency=None):
+        """Yield the `documentSummary` entries of a submission, across all of its pages."""
+        for page in self.iter_submission_pages(submission_id, page_size, concurrency):
+            yield from page.get("documentSummary") or []
+
+    def _get_submission_page_request(self, submission_id, page_no, page_size):
+        headers = self.eta_connector.get_headers()
+        headers.update({
+            "PageSize": str(page_size),
+            "PageNo": str(page_no)
+        })
+        return f"{self.eta_connector.ETA_BASE}/documentSubmissions/{submission_id}", headers
+
+    def _log_submission_details_error(self, error, response=None):
+        message = f"Failed to fetch submission details: {error}"
+        if response is not None:
+            try:
+                message += f"\nResponse: {response.text}"
+            except Exception:
+                pass
+        frappe.log_error(message)
+
+
+def pack_submissions(
+    einvoices, max_bytes=ETA_MAX_SUBMISSION_BYTES, max_documents=ETA_MAX_DOCUMENTS_PER_SUBMISSION
+):
+    """
+    Split e-invoices into the fewest consecutive submissions within the ETA size and document limits.
+
+    Sizes are those of the payload `EInvoiceSubmitter._prepare_data` builds for the submission.
+
+    Returns:
+        tuple: (submissions, oversized), the lists of e-invoices to submit together and the e-invoices
+            that exceed the size limit even on their own.
+    """
+    submissions, oversized = [], []
+    current, current_bytes = [], SUBMISSION_ENVELOPE_BYTES
+    for einvoice in einvoices:
+        size = len(_serialize(einvoice))
+        if SUBMISSION_ENVELOPE_BYTES + size > max_bytes:
+            oversized.append(einvoice)
+            continue
+
+        if current and (
+            current_bytes + SUBMISSION_SEPARATOR_BYTES + size > max_bytes or len(current) >= max_documents
+        ):
+            submissions.append(current)
+            current, current_bytes = [], SUBMISSION_ENVELOPE_BYTES
+
+        if current:
+            current_bytes += SUBMISSION_SEPARATOR_BYTES
+        current.append(einvoice)
+        current_bytes += size
+
+    if current:
+        submissions.append(current)
+    return submissions, oversized
+
+
+def _serialize(data):
+    return json.dumps(data, ensure_ascii=False).encode("utf8")
@@ -0,0 +1,227 @@
+import json
+from collections import defaultdict
+from typing import Dict, List
+
+import frappe
+from frappe.utils import cint, now
+
+from erpnext_egypt_compliance.erpnext_eta.ereceipt_submitter import (
+    EReceiptSubmitter,
+    get_receipts_per_submission,
+)
+from erpnext_egypt_compliance.erpnext_eta.eta_http import get_eta_http_concurrency
+from erpnext_egypt_compliance.erpnext_eta.utils import (
+    acquire_cache_lock,
+    bulk_set_values,
+    extend_cache_lock,
+    release_cache_lock,
+)
+
+ERECEIPT_OUTBOX_LOCK_TIMEOUT = 30 * 60
+ERECEIPT_OUTBOX_FIELDS = (
+    "name",
+    "creation",
+    "modified",
+    "owner",
+    "modified_by",
+    "docstatus",
+    "uuid",
+    "pos_connector",
+    "reference_doctype",
+    "reference_document",
+    "status",
+    "attempts",
+    "receipt",
+    "error",
+)
+
+
+def is_eta_unreachable(eta_response: Dict) -> bool:
+    """
+    Whether a receipt submission failed before the ETA could accept or reject its receipts.
+
+    That is a submission that was never sent or got no HTTP response, marked `unreachable` by the
+    `EReceiptSubmitter`, or one the ETA throttled (429) or failed (5xx). A submission the ETA answered
+    is never resubmitted, even when recording its outcome failed afterwards.
+    """
+    if eta_response.get("unreachable"):
+        return True
+    status_code = cint(eta_response.get("status_code"))
+    return status_code == 429 or status_code >= 500
+
+
+def add_to_ereceipt_outbox(pos_connector: str, receipts: List[Dict], doctype: str, error: str = None):
+    """
+    Keep e-receipts that could not be delivered to the ETA as Pending in the outbox.
+
+    The outbox is keyed on the receipt uuid, a receipt already in it is left untouched.
+    """
+    timestamp, user = now(), frappe.session.user
+    values = [
+        (
+            receipt["header"]["uuid"],
+            timestamp,
+            timestamp,
+            user,
+            user,
+            0,
+            receipt["header"]["uuid"],
+            pos_connector,
+            doctype,
+            receipt["header"]["receiptNumber"],
+            "Pending",
+            0,
+            json.dumps(receipt, ensure_ascii=False),
+            error,
+        )
+        for receipt in receipts
+    ]
+    frappe.db.bulk_insert("ETA Receipt Outbox", ERECEIPT_OUTBOX_FIELDS, values, ignore_duplicates=True)
+
+
+def replay_ereceipt_outbox():
+    """Enqueue a replay of the outbox of every ETA POS Connector with undelivered receipts."""
+    for pos_connector in frappe.get_all(
+        "ETA Receipt Outbox",
+        filters={"status": ["in", ["Pending", "In-Flight"]]},
+        pluck="pos_connector",
+        distinct=True,
+    ):
+        frappe.enqueue(
+            method="erpnext_egypt_compliance.erpnext_eta.ereceipt_outbox.replay_connector_outbox",
+            queue="long",
+            pos_connector=pos_connector,
+            job_name=f"ereceipt_outbox_{pos_connector}",
+        )
+
+
+def replay_connector_outbox(pos_connector: str):
+    """
+    Submit the undelivered receipts of a connector, oldest first, until none is left or the ETA is still down.
+
+    Each round claims as many full batches as `ETA Settings.eta_http_concurrency` allows, marks them
+    In-Flight and submits them concurrently. Receipts left In-Flight by an interrupted replay are first
+    looked up on the ETA, so a receipt is never submitted twice. The replay lock is renewed before each
+    round, and a replay that lost it stops.
+    """
+    lock_key = frappe.cache().make_key(f"ereceipt_outbox_lock:{pos_connector}")
+    lock_token = acquire_cache_lock(lock_key, ERECEIPT_OUTBOX_LOCK_TIMEOUT)
+    if not lock_token:
+        return
+
+    try:
+        connector = frappe.get_doc("ETA POS Connector", pos_connector)
+        submitter = EReceiptSubmitter(connector)
+        _recover_in_flight_receipts(submitter, pos_connector)
+
+        batch_size = get_receipts_per_submission(connector)
+        while extend_cache_lock(lock_key, lock_token, ERECEIPT_OUTBOX_LOCK_TIMEOUT):
+            pending = frappe.get_all(
+                "ETA Receipt Outbox",
+                filters={"pos_connector": pos_connector, "status": "Pending"},
+                fields=["name", "reference_doctype", "receipt"],
+                order_by="creation asc",
+                limit=batch_size * get_eta_http_concurrency(),
+            )
+            if not pending:
+                break
+
+            uuids = [row.name for row in pending]
+            _claim_receipts(uuids)
+            frappe.db.commit()
+
+            try:
+                reached = _submit_outbox_receipts(submitter, pending, batch_size)
+            except Exception:
+                # e.g. no access token, the receipts were not submitted
+                frappe.db.rollback()
+                frappe.log_error(title=f"Replay E-Receipt Outbox: {pos_connector}")
+                _release_receipts(uuids)
+                frappe.db.commit()
+                break
+
+            if not reached:
+                # the ETA is still unreachable, the next replay picks them up
+                break
+    finally:
+        release_cache_lock(lock_key, lock_token)
+
+
+def _recover_in_flight_receipts(submitter: EReceiptSubmitter, pos_connector: str):
+    uuids = frappe.get_all(
+        "ETA Receipt Outbox", filters={"pos_connector": pos_connector, "status": "In-Flight"}, pluck="name"
+    )
+    if not uuids:
+        return
+
+    received = submitter.get_receipt_statuses(uuids)
+    bulk_set_values(
+        "ETA Receipt Outbox",
+        {uuid: {"status": "Accepted" if uuid in received else "Pending"} for uuid in uuids},
+    )
+    frappe.db.commit()
+
+
+def _claim_receipts(uuids: List[str]):
+    Outbox = frappe.qb.DocType("ETA Receipt Outbox")
+    (
+        frappe.qb.update(Outbox)
+        .set(Outbox.status, "In-Flight")
+        .set(Outbox.attempts, Outbox.attempts + 1)
+        .set(Outbox.last_attempt_at, now())
+        .where(Outbox.name.isin(uuids))
+    ).run()
+
+
+def _release_receipts(uuids: List[str]):
+    Outbox = frappe.qb.DocType("ETA Receipt Outbox")
+    (
+        frappe.qb.update(Outbox)
+        .set(Outbox.status, "Pending")
+        .where(Outbox.name.isin(uuids) & (Outbox.status == "In-Flight"))
+    ).run()
+
+
+def _submit_outbox_receipts(submitter: EReceiptSubmitter, rows: List[Dict], batch_size: int) -> bool:
+    """Submit claimed outbox rows and record their outcome, returns whether any batch reached the ETA."""
+    rows_by_doctype = defaultdict(list)
+    for row in rows:
+        rows_by_doctype[row.reference_doctype].append(row)
+
+    reached, values_by_name = False, {}
+    for doctype, doctype_rows in rows_by_doctype.items():
+        batches = list(frappe.utils.create_batch(doctype_rows, batch_size))
+        eta_responses = submitter.submit_ereceipt_batches(
+            [{"receipts": [json.loads(row.receipt) for row in batch]} for batch in batches], doctype
+        )
+        for batch, eta_response in zip(batches, eta_responses, strict=True):
+            if is_eta_unreachable(eta_response):
+                error = str(eta_response.get("error") or eta_response.get("status_code"))
+                values_by_name.update({row.name: {"status": "Pending", "error": error} for row in batch})
+                continue
+
+            reached = True
+            values_by_name.update(_get_outbox_results(batch, eta_response))
+
+    bulk_set_values("ETA Receipt Outbox", values_by_name)
+    frappe.db.commit()
+    return reached
+
+
+def _get_outbox_results(batch: List[Dict], eta_response: Dict) -> Dict:
+    """Outbox values of a batch the ETA answered, receipts neither accepted nor rejected share the response error."""
+    accepted = {document.get("uuid") for document in eta_response.get("acceptedDocuments") or []}
+    rejected = {
+        document.get("uuid"): json.dumps(document.get("error"), ensure_ascii=False)
+        for document in eta_response.get("rejectedDocuments") or []
+    }
+
+    results = {}
+    for row in batch:
+        if row.name in accepted:
+            results[row.name] = {"status": "Accepted", "error": None}
+        else:
+            error = rejected.get(row.name) or str(eta_response.get("error"))
+            results[row.name] = {"status": "Rejected", "error": error}
+        results[row.name]["eta_log"] = eta_response.get("eta_log")
+    return results
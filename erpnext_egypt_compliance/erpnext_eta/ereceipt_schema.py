@@ -1,24 +1,37 @@
 import collections
-import hashlib
 import json
 from datetime import datetime
-from typing import Dict, List, Optional
+from functools import cached_property
+from typing import Dict, Iterator, List, Optional
 from uuid import uuid4
 
 import frappe
 import frappe.utils
 import pytz
+from frappe import _
 from pydantic import BaseModel, Field, conint, validator
 
+from erpnext_egypt_compliance.erpnext_eta.canonical import (  # noqa: F401
+    canonical_sha256,
+    serialize,
+)
+from erpnext_egypt_compliance.erpnext_eta.ereceipt_outbox import (
+    add_to_ereceipt_outbox,
+    is_eta_unreachable,
+)
+from erpnext_egypt_compliance.erpnext_eta.ereceipt_submitter import (
+    EReceiptSubmitter,
+    get_receipts_per_submission,
+)
+from erpnext_egypt_compliance.erpnext_eta.master_data import (
+    get_eta_settings,
+    get_issuer_profile,
+    get_uom_eta_code,
+)
 from erpnext_egypt_compliance.erpnext_eta.utils import (
     eta_datetime_issued_format,
     get_company_eta_connector,
 )
-from frappe import _
-from erpnext_egypt_compliance.erpnext_eta.ereceipt_submitter import EReceiptSubmitter
-
-POS_INVOICE_RAW_DATA = {}
-COMPANY_DATA = {}
 
 
 def convert_datetime_to_utc_with_z_suffix(date_time: datetime) -> str:
@@ -30,31 +43,6 @@ def convert_datetime_to_utc_with_z_suffix(date_time: datetime) -> str:
     )
 
 
-def serialize(document_structure):
-    """
-    Serialize a document structure to a normalized string.
-    see https://sdk.preprod.invoicing.eta.gov.eg/document-serialization-approach/
-    """
-    if isinstance(document_structure, dict):
-        
-        serialized_string = ""
-
-        for name, value in document_structure.items():
-            if isinstance(value, list):
-                list_key = name
-                serialized_string += '"' + list_key.upper() + '"'
-                for item in value:
-                    serialized_string += '"' + name.upper() + '"'
-                    serialized_string += serialize(item)
-
-            else:
-                serialized_string += '"' + name.upper() + '"'
-                serialized_string += serialize(value)
-        return serialized_string
-    else:
-         return '"' + str(document_structure) + '"'
-
-
 class Beneficiary(BaseModel):
     amount: float = Field(default=0.0, description="Amount of the beneficiary.")
     rate: float = Field(default=0.0, description="Rate of the beneficiary.")
@@ -184,37 +172,6 @@ class ReceiptBuyer(BaseModel):
             raise ValueError(f"Invalid type. Allowed types are {allowed_types}")
         return value
 
-    @validator("id")
-    def validate_id(cls, value, values):
-        # TODO: P/F cases
-        customer = POS_INVOICE_RAW_DATA.get("customer")
-        customer_tax_id = frappe.db.get_value("Customer", customer, "tax_id") or ""
-
-        if values.get("type") == "B":
-            # Company Registration No. (RIN)
-            if not customer_tax_id or len(str(customer_tax_id)) != 14:
-                frappe.throw(
-                _("Customer {0} must have a valid 14-digit Tax ID for business receipts.").format(customer),
-                title=_("ETA Validation"),
-            )
-            return customer_tax_id
-        
-        if values.get("type") == "P" and POS_INVOICE_RAW_DATA.get('grand_total') >= 150000:
-            if not customer_tax_id or len(str(customer_tax_id)) != 14:
-                frappe.throw(
-                    _("Customer {0} must have a valid Tax ID (14 digits) for e-receipts with grand total equal or above 150,000 EGP.").format(customer),
-                    title=_("ETA Validation"),
-                )
-            return customer_tax_id
-
-        return customer_tax_id or ""
-
-
-    @validator("name")
-    def get_default_name(cls, value, values):
-        value = POS_INVOICE_RAW_DATA.get("customer_name") or "Walk-in Customer"
-        return value
-
 
 class BranchAddress(BaseModel):
     country: str = Field(default="EG", description="Country represented by ISO-3166-2 2 symbol code.")
@@ -264,12 +221,6 @@ class ReceiptHeader(BaseModel):
     grossWeight: float = Field(default=0.0, description="Total weight of the goods delivered. Unit: KG")
     netWeight: float = Field(default=0.0, description="Net weight of the goods delivered. . Unit: KG")
 
-    @validator("dateTimeIssued", pre=True, always=True)
-    def eta_datetime_format(cls, value):
-        seconds = POS_INVOICE_RAW_DATA.get("posting_time").seconds
-        return eta_datetime_issued_format(value, seconds)
-
-
     # @validator("exchangeRate")
     # def exchange_rate_required(cls, value, values):
     # 	# exchange rate is required if currency is not EGP.
@@ -287,14 +238,10 @@ class ReceiptHeader(BaseModel):
 
 # @validator("uuid", pre=True, always=True)
 def validate_and_generate_uuid(ereceipt):
-    # Serialize and normalize the receipt object
+    # Serialize and normalize the receipt object, hashing it with SHA256 as it is serialized
     document_structure = {key: value for key, value in ereceipt.items() if key != "uuid"}
-    serialized_text = serialize(document_structure)
-    
-    # Hash the normalized text using SHA256
-    hash_value = hashlib.sha256(serialized_text.encode("utf-8")).digest()
-    # Convert the hash value to a hexadecimal string of 64 characters
-    uuid = hash_value.hex()
+    # a hexadecimal string of 64 characters
+    uuid = canonical_sha256(document_structure)
 
     return uuid
 
@@ -336,18 +283,196 @@ class ItemWiseTaxDetails(BaseModel):
     data : Dict[str, List[float]]
 
 
+def get_item_tax_rates(taxes: List[Dict]) -> Dict[str, List[Optional[float]]]:
+    """
+    Index the `item_wise_tax_detail` of tax rows by item code.
+
+    Each row's JSON is decoded and validated once, so the line builders look up their rates instead of
+    parsing every tax row for every item.
+
+    Returns:
+        dict: item_code -> the item's rate in each of `taxes`, in the same order.
+    """
+    index = {}
+    for position, tax in enumerate(taxes):
+        details = ItemWiseTaxDetails(data=json.loads(tax.get("item_wise_tax_detail") or "{}"))
+        for item_code, item_tax_detail in details.data.items():
+            index.setdefault(item_code, [None] * len(taxes))[position] = item_tax_detail[0]
+    return index
+
+
+class ReceiptDataLoader:
+    """Read the master data an e-receipt is built from, one record per call."""
+
+    def get_invoice(self, docname: str, doctype: str) -> Dict:
+        return frappe.get_doc(doctype, docname).as_dict()
+
+    def get_issuer_profile(self, company: str) -> Dict:
+        return get_issuer_profile(company)
+
+    def get_customer(self, customer: str) -> Dict:
+        return frappe.get_doc("Customer", customer).as_dict()
+
+    def get_device_serial(self, pos_profile: str) -> str:
+        return frappe.db.get_value("ETA POS Connector", pos_profile, "serial_number")
+
+    def get_item_eta_code(self, item_code: str) -> str:
+        return frappe.get_value("Item", item_code, "eta_item_code")
+
+    def get_uom_eta(self, uom: str) -> str:
+        return get_uom_eta_code(uom)
+
+    def get_eta_setting(self, fieldname: str):
+        return get_eta_settings().get(fieldname)
+
+
+class BulkReceiptDataLoader(ReceiptDataLoader):
+    """
+    Prefetch the POS invoices of several e-receipts and their master data in a fixed number of queries.
+
+    Records that were not prefetched fall back to the per-record reads of `ReceiptDataLoader`.
+    """
+
+    INVOICE_CHILD_TABLES = {
+        "POS Invoice": (("POS Invoice Item", "items"), ("Sales Taxes and Charges", "taxes")),
+        "Sales Invoice": (("Sales Invoice Item", "items"), ("Sales Taxes and Charges", "taxes")),
+    }
+
+    def __init__(self, docnames: List[str], doctype: str):
+        self.doctype = doctype
+        self.invoices = self._get_all_by_name(doctype, docnames)
+        self._load_invoice_children()
+
+        self.customers = self._get_all_by_name("Customer", {i.customer for i in self.invoices.values()})
+        self.device_serials = self._get_values_by_name(
+            "ETA POS Connector", {i.pos_profile for i in self.invoices.values()}, "serial_number"
+        )
+
+        lines = [line for invoice in self.invoices.values() for line in invoice["items"]]
+        self.item_eta_codes = self._get_values_by_name("Item", {line.item_code for line in lines}, "eta_item_code")
+        self.eta_settings = get_eta_settings()
+
+    @staticmethod
+    def _get_all_by_name(doctype: str, names, fields=None) -> Dict:
+        names = [name for name in names if name]
+        if not names:
+            return {}
+        return {
+            row.name: row
+            for row in frappe.get_all(doctype, filters={"name": ["in", names]}, fields=fields or ["*"])
+        }
+
+    @classmethod
+    def _get_values_by_name(cls, doctype: str, names, fieldname: str) -> Dict:
+        rows = cls._get_all_by_name(doctype, names, fields=["name", fieldname])
+        return {name: row.get(fieldname) for name, row in rows.items()}
+
+    def _load_invoice_children(self):
+        for child_doctype, parentfield in self.INVOICE_CHILD_TABLES[self.doctype]:
+            for invoice in self.invoices.values():
+                invoice[parentfield] = []
+            if not self.invoices:
+                continue
+
+            rows = frappe.get_all(
+                child_doctype,
+                filters={
+                    "parenttype": self.doctype,
+                    "parentfield": parentfield,
+                    "parent": ["in", list(self.invoices)],
+                },
+                fields=["*"],
+                order_by="idx asc",
+            )
+            for row in rows:
+                self.invoices[row.parent][parentfield].append(row)
+
+    def get_invoice(self, docname: str, doctype: str) -> Dict:
+        if doctype == self.doctype and docname in self.invoices:
+            return self.invoices[docname]
+        return super().get_invoice(docname, doctype)
+
+    def get_customer(self, customer: str) -> Dict:
+        if customer in self.customers:
+            return self.customers[customer]
+        return super().get_customer(customer)
+
+    def get_device_serial(self, pos_profile: str) -> str:
+        if pos_profile in self.device_serials:
+            return self.device_serials[pos_profile]
+        return super().get_device_serial(pos_profile)
+
+    def get_item_eta_code(self, item_code: str) -> str:
+        if item_code in self.item_eta_codes:
+            return self.item_eta_codes[item_code]
+        return super().get_item_eta_code(item_code)
+
+    def get_eta_setting(self, fieldname: str):
+        return self.eta_settings.get(fieldname)
+
+
+class ReceiptBuildContext:
+    """
+    The state of a single e-receipt build.
+
+    The builders read the POS invoice and its company from the context they are given rather than
+    from module state, so several receipts can be built concurrently in one process.
+    """
+
+    def __init__(self, invoice: Dict, company: Dict, doctype: str = "POS Invoice", loader: ReceiptDataLoader = None):
+        self.invoice = invoice
+        self.company = company
+        self.doctype = doctype
+        self.loader = loader or ReceiptDataLoader()
+
+    @cached_property
+    def item_tax_rates(self) -> Dict[str, List[Optional[float]]]:
+        """item_code -> rate of the item in each tax row of the invoice."""
+        return get_item_tax_rates(self.invoice.get("taxes") or [])
+
+    @classmethod
+    def load(cls, docname: str, doctype: str, loader: ReceiptDataLoader = None):
+        """Load the POS invoice and the issuer profile of its company."""
+        loader = loader or ReceiptDataLoader()
+        invoice = loader.get_invoice(docname, doctype)
+        company = loader.get_issuer_profile(invoice.get("company"))
+        return cls(invoice, company, doctype, loader)
+
+
 @frappe.whitelist()
 def build_erceipt_json(docname: str, doctype: str):
     """Entry point for creating the POS E-Receipt json."""
+    ctx = ReceiptBuildContext.load(docname, doctype)
+    return ReceiptsResponse(receipts=[build_receipt(ctx)])
 
-    # Set the global raw data: POS_INVOICE_RAW_DATA, COMPANY_DATA
-    set_global_raw_data(docname, doctype)
 
-    header: ReceiptHeader = get_pos_ereceipt_header()
+def build_ereceipts_json(docnames: List[str], doctype: str) -> Iterator[Receipt]:
+    """
+    Build the e-receipts of several POS invoices, loading them and their master data in bulk.
+
+    Yields the receipts in the order of `docnames`, as `build_erceipt_json` would build them. The seller
+    block is built once per company and POS profile. Invoices that fail to build are logged and skipped.
+    """
+    loader = BulkReceiptDataLoader(docnames, doctype)
+    sellers = {}
+    for docname in docnames:
+        try:
+            ctx = ReceiptBuildContext.load(docname, doctype, loader)
+            seller_key = (ctx.invoice.get("company"), ctx.invoice.get("pos_profile"))
+            if seller_key not in sellers:
+                sellers[seller_key] = get_pos_receipt_seller(ctx)
+            yield build_receipt(ctx, seller=sellers[seller_key])
+        except Exception:
+            frappe.log_error(title="Build E-Receipt", reference_doctype=doctype, reference_name=docname)
+
+
+def build_receipt(ctx: ReceiptBuildContext, seller: ReceiptSeller = None) -> Receipt:
+    """Build the e-receipt of the POS invoice of a context, with its uuid."""
+    header: ReceiptHeader = get_pos_ereceipt_header(ctx)
     document_type: ReceiptDocumentType = ReceiptDocumentType()
-    seller: ReceiptSeller = get_pos_receipt_seller()
-    buyer: ReceiptBuyer = get_pos_receipt_buyer()
-    item_data: List[SingleItemData] = get_pos_receipt_item_data()
+    seller: ReceiptSeller = seller or get_pos_receipt_seller(ctx)
+    buyer: ReceiptBuyer = get_pos_receipt_buyer(ctx)
+    item_data: List[SingleItemData] = get_pos_receipt_item_data(ctx)
     total_sales: float = frappe.utils.flt(sum([item.totalSale for item in item_data]), 5)
     net_amount: float = frappe.utils.flt(sum([item.netSale for item in item_data]), 5)
     total_amount: float = sum([item.total for item in item_data])
@@ -366,7 +491,6 @@ def build_erceipt_json(docname: str, doctype: str):
     taxable_items_list = [item.taxableItems for item in item_data]
     taxable_items_list = [taxable_item for sublist in taxable_items_list for taxable_item in sublist]
     tax_totals: List[SingleTaxTotal] = get_pos_receipt_tax_totals(taxable_items_list)
-    receipts: List[Receipt] = []
     receipt = Receipt(
             header=header,
             documentType=document_type,
@@ -387,18 +511,11 @@ def build_erceipt_json(docname: str, doctype: str):
             beneficiary=beneficiary,
         )
     
-    seconds = POS_INVOICE_RAW_DATA.get("posting_time").seconds
-    date_formated = eta_datetime_issued_format(POS_INVOICE_RAW_DATA.get("posting_date"), seconds)
-    receipt.header.dateTimeIssued = date_formated
+    receipt.header.dateTimeIssued = _get_date_time_issued(ctx)
     uuid = validate_and_generate_uuid(receipt.model_dump())
     receipt.header.uuid = uuid
-    receipts.append(receipt)
     # signatures: List[SingleSignature] = [SingleSignature()]
-    receipts_response: ReceiptsResponse = ReceiptsResponse(receipts=receipts)
-
-    receipts_response: str = receipts_response
-    
-    return receipts_response
+    return receipt
 
 @frappe.whitelist()
 def download_ereceipt_json(docname, doctype):
@@ -421,20 +538,88 @@ def download_eta_ereceipt_json(docname, file_content):
 
 @frappe.whitelist()
 def submit_ereceipt(docname, pos_profile, doctype, raise_throw=True) -> None:
-    """Submit the POS E-Receipt to the API."""
+    """Submit the POS E-Receipt to the API, or queue it on the connector's spool when enabled."""
     try:
         ereceipt = build_erceipt_json(docname, doctype)
         connector = frappe.get_doc("ETA POS Connector", pos_profile)
-        if connector:
+        if connector and connector.enable_receipt_spool:
+            from erpnext_egypt_compliance.erpnext_eta.ereceipt_spool import (
+                spool_ereceipt,
+            )
+
+            spool_ereceipt(connector, ereceipt.receipts[0].model_dump(), doctype)
+        elif connector:
             eta_submitter = EReceiptSubmitter(connector)
-            processed_docs = eta_submitter.submit_ereceipt(ereceipt.model_dump(), doctype)
+            ereceipts = ereceipt.model_dump()
+            processed_docs = eta_submitter.submit_ereceipt(ereceipts, doctype)
+            if is_eta_unreachable(processed_docs):
+                # replayed from the outbox once the ETA is back
+                add_to_ereceipt_outbox(connector.name, ereceipts["receipts"], doctype, error=processed_docs.get("error"))
     except Exception as e:
         frappe.log_error(title="Submit E-Receipt", message=e, reference_doctype="POS Invoice", reference_name=docname)
         if raise_throw:
             frappe.throw(
                     _(e),
                     title=_("Submitting e-Receipt Failed"),)
-        
+
+
+def submit_ereceipts(docnames: List[str], doctype: str) -> None:
+    """
+    Submit the e-receipts of many POS invoices, e.g. the ones consolidated by a POS Closing Entry.
+
+    The receipts are built in bulk and queued on the spool of their POS profile's connector, or
+    submitted in concurrent batches when the connector has no spool.
+    """
+    from erpnext_egypt_compliance.erpnext_eta.ereceipt_spool import spool_ereceipt
+
+    pos_profiles = dict(
+        frappe.get_all(doctype, filters={"name": ["in", docnames]}, fields=["name", "pos_profile"], as_list=True)
+    )
+    connectors, unspooled = {}, collections.defaultdict(list)
+    for receipt in build_ereceipts_json(docnames, doctype):
+        docname = receipt.header.receiptNumber
+        pos_profile = pos_profiles.get(docname)
+        if pos_profile not in connectors:
+            connectors[pos_profile] = _get_pos_connector(pos_profile, doctype, docname)
+        connector = connectors[pos_profile]
+        if not connector:
+            continue
+
+        if connector.enable_receipt_spool:
+            try:
+                spool_ereceipt(connector, receipt.model_dump(), doctype)
+            except Exception:
+                frappe.log_error(
+                    title=f"Spool E-Receipt: {docname}", reference_doctype=doctype, reference_name=docname
+                )
+        else:
+            unspooled[pos_profile].append(receipt.model_dump())
+
+    for pos_profile, receipts in unspooled.items():
+        connector = connectors[pos_profile]
+        try:
+            batches = list(frappe.utils.create_batch(receipts, get_receipts_per_submission(connector)))
+            eta_responses = EReceiptSubmitter(connector).submit_ereceipt_batches(
+                [{"receipts": batch} for batch in batches], doctype
+            )
+            for batch, eta_response in zip(batches, eta_responses, strict=True):
+                if is_eta_unreachable(eta_response):
+                    add_to_ereceipt_outbox(connector.name, batch, doctype, error=eta_response.get("error"))
+        except Exception:
+            frappe.log_error(title=f"Submit E-Receipts: {pos_profile}")
+
+
+def _get_pos_connector(pos_profile, doctype, docname):
+    """The ETA POS Connector of a POS profile, None (and logged) when it has none."""
+    try:
+        return frappe.get_doc("ETA POS Connector", pos_profile)
+    except Exception:
+        frappe.log_error(
+            title=f"ETA POS Connector not found: {pos_profile}", reference_doctype=doctype, reference_name=docname
+        )
+        return None
+
+
 @frappe.whitelist()      
 def fetch_ereceipt_status(docname, raise_throw=True):
     try:
@@ -452,57 +637,39 @@ def fetch_ereceipt_status(docname, raise_throw=True):
                     title=_("Fetch e-Receipt Failed"),)
 
 
-def _pos_total_qty():
-    """Add _total_qty to the POS Invoice Item."""
-    total = collections.defaultdict(int)
-    for item in POS_INVOICE_RAW_DATA.get("items"):
-        total[item.get("item_code")] += item.get("qty")
-    POS_INVOICE_RAW_DATA["_total_qty"] = total
-
-
-def set_global_raw_data(docname: str, doctype: str) -> None:
-    """Get the raw POS data from the database."""
-    global POS_INVOICE_RAW_DATA
-    global COMPANY_DATA
-
-    # Set the global POS data
-    POS_INVOICE_RAW_DATA = frappe.get_doc(doctype, docname).as_dict()
-    _pos_total_qty()
+def _get_date_time_issued(ctx: ReceiptBuildContext) -> str:
+    seconds = ctx.invoice.get("posting_time").seconds
+    return eta_datetime_issued_format(ctx.invoice.get("posting_date"), seconds)
 
-    # Set the global company data
-    COMPANY_DATA = frappe.get_doc("Company", POS_INVOICE_RAW_DATA.get("company")).as_dict()
 
-
-def get_pos_ereceipt_header() -> ReceiptHeader:
+def get_pos_ereceipt_header(ctx: ReceiptBuildContext) -> ReceiptHeader:
     """Get the POS E-Receipt header."""
     header = ReceiptHeader(
-        dateTimeIssued=POS_INVOICE_RAW_DATA.get("posting_date"),
-        receiptNumber=POS_INVOICE_RAW_DATA.get("name"),
-        currency=POS_INVOICE_RAW_DATA.get("currency"),
+        dateTimeIssued=_get_date_time_issued(ctx),
+        receiptNumber=ctx.invoice.get("name"),
+        currency=ctx.invoice.get("currency"),
         uuid=""
     )
     return header
 
 
-def get_pos_receipt_seller() -> ReceiptSeller:
+def get_pos_receipt_seller(ctx: ReceiptBuildContext) -> ReceiptSeller:
     """Get the POS E-Receipt Seller."""
-    branch = frappe.get_doc("Branch", COMPANY_DATA.get("eta_default_branch")).as_dict()
-    branch_address = frappe.get_doc("Address", branch.get("eta_branch_address")).as_dict()
-    country_code = frappe.db.get_value("Country", branch_address.country, "code")
-    device_serial = str(frappe.db.get_value("ETA POS Connector", POS_INVOICE_RAW_DATA.get("pos_profile"), "serial_number"))
+    branch_data = ctx.company.get("branch_data")
+    device_serial = str(ctx.loader.get_device_serial(ctx.invoice.get("pos_profile")))
     seller = ReceiptSeller(
-        rin=COMPANY_DATA.get("eta_tax_id"),
-        companyTradeName=COMPANY_DATA.get("eta_issuer_name"),
-        branchCode=branch.get("eta_branch_id"),
+        rin=ctx.company.get("eta_tax_id"),
+        companyTradeName=ctx.company.get("eta_issuer_name"),
+        branchCode=branch_data.get("eta_branch_id"),
         deviceSerialNumber=device_serial,
         # syndicateLicenseNumber=company.get("company"),
-        activityCode=COMPANY_DATA.get("eta_default_activity_code"),
+        activityCode=ctx.company.get("eta_default_activity_code"),
         branchAddress=BranchAddress(
-            country=country_code,
-            governate=branch_address.get("state"),
-            regionCity=branch_address.get("city"),
-            street=branch_address.get("address_line1"),
-            buildingNumber=branch_address.get("building_number"),
+            country=branch_data.get("country_code"),
+            governate=branch_data.get("state"),
+            regionCity=branch_data.get("city"),
+            street=branch_data.get("address_line1"),
+            buildingNumber=branch_data.get("building_number"),
             # postalCode=company.get("company"),
             # floor=company.get("company"),
             # room=company.get("company"),
@@ -513,18 +680,44 @@ def get_pos_receipt_seller() -> ReceiptSeller:
     return seller
 
 
-def get_pos_receipt_buyer() -> ReceiptBuyer:
+def get_pos_receipt_buyer(ctx: ReceiptBuildContext) -> ReceiptBuyer:
     """Get the POS E-Receipt Buyer."""
-    customer = frappe.get_doc("Customer", POS_INVOICE_RAW_DATA.get("customer")).as_dict()
+    customer = ctx.loader.get_customer(ctx.invoice.get("customer"))
         
     buyer = ReceiptBuyer(
         type=customer.get("eta_receiver_type"),
-        id=customer.get("tax_id"),
-        name=customer.get("customer_name") or "Walk-in Customer"
+        id=_get_buyer_id(ctx, customer),
+        name=ctx.invoice.get("customer_name") or "Walk-in Customer"
     )
     return buyer
 
 
+def _get_buyer_id(ctx: ReceiptBuildContext, customer: dict) -> str:
+    """Validate the customer Tax ID against the buyer type and the receipt total."""
+    # TODO: P/F cases
+    customer_tax_id = customer.get("tax_id") or ""
+    buyer_type = customer.get("eta_receiver_type")
+
+    if buyer_type == "B":
+        # Company Registration No. (RIN)
+        if not customer_tax_id or len(str(customer_tax_id)) != 14:
+            frappe.throw(
+            _("Customer {0} must have a valid 14-digit Tax ID for business receipts.").format(customer.get("name")),
+            title=_("ETA Validation"),
+        )
+        return customer_tax_id
+
+    if buyer_type == "P" and ctx.invoice.get('grand_total') >= 150000:
+        if not customer_tax_id or len(str(customer_tax_id)) != 14:
+            frappe.throw(
+                _("Customer {0} must have a valid Tax ID (14 digits) for e-receipts with grand total equal or above 150,000 EGP.").format(customer.get("name")),
+                title=_("ETA Validation"),
+            )
+        return customer_tax_id
+
+    return customer_tax_id
+
+
 def _calculate_item_total(_item: dict, _net_sale: float, _taxable_items: List[SingleTaxableItems]) -> float:
     """Get the item total."""
     calculation_parts = [_net_sale]
@@ -537,30 +730,27 @@ def _get_tax_amount(item_tax_detail: float, net_rate: float, qty: float, _exchan
     return _eta_round(item_tax_detail * net_rate * qty * _exchange_rate)
 
 
-def _get_taxable_items(_item: dict) -> List[SingleTaxableItems]:
+def _get_taxable_items(ctx: ReceiptBuildContext, _item: dict) -> List[SingleTaxableItems]:
     """Get the item tax data."""
     taxable_items = []
-    if POS_INVOICE_RAW_DATA.get("taxes"):
-        for tax in POS_INVOICE_RAW_DATA.get("taxes"):
-            # TODO: Hardcoded, Type: T1, SubType: V009, amount=_get_tax_amount()
-            item_wise_tax_detail_asjson = json.loads(tax.item_wise_tax_detail)
-            items_tax_detail_list = ItemWiseTaxDetails(data=item_wise_tax_detail_asjson)
-
-            item_tax_detail = items_tax_detail_list.data.get(_item.get("item_code"))
-            amount = _get_tax_amount(
-                (item_tax_detail[0] / 100),
-                _item.get("net_rate"),
-                _item.get("qty"),
-                _item.get("_exchange_rate") or 1,
-            )
-            taxable_items.append(
-                SingleTaxableItems(
-                    taxType="T1",
-                    subType="V001",
-                    amount=amount,
-                    rate=item_tax_detail[0],
-                )
+    taxes = ctx.invoice.get("taxes") or []
+    rates = ctx.item_tax_rates.get(_item.get("item_code")) or [None] * len(taxes)
+    for rate in rates:
+        # TODO: Hardcoded, Type: T1, SubType: V009, amount=_get_tax_amount()
+        amount = _get_tax_amount(
+            (rate / 100),
+            _item.get("net_rate"),
+            _item.get("qty"),
+            _item.get("_exchange_rate") or 1,
+        )
+        taxable_items.append(
+            SingleTaxableItems(
+                taxType="T1",
+                subType="V001",
+                amount=amount,
+                rate=rate,
             )
+        )
 
     return taxable_items
 
@@ -583,7 +773,7 @@ def _get_unit_price(_item: dict) -> float:
     return _eta_round(unit_price)
 
 
-def _get_item_metrics(_item: dict) -> Dict:
+def _get_item_metrics(ctx: ReceiptBuildContext, _item: dict) -> Dict:
     unit_price = _get_unit_price(_item)
     exchange_rate = _item.get("_exchange_rate") or 1
 
@@ -595,14 +785,12 @@ def _get_item_metrics(_item: dict) -> Dict:
     item_tax_amount = net_sale * tax_rate
     item_total = _eta_round(net_sale + item_tax_amount)
 
-    taxable_items = _get_taxable_items(_item)
+    taxable_items = _get_taxable_items(ctx, _item)
 
-    item_unit_type = frappe.get_value("UOM", _item.get("uom"), "eta_uom") or frappe.get_value(
-        "ETA Settings", "ETA Settings", "eta_uom"
-    )
+    item_unit_type = ctx.loader.get_uom_eta(_item.get("uom")) or ctx.loader.get_eta_setting("eta_uom")
     item_code = (
         _item.get("eta_item_code")
-        or frappe.get_value("Item", _item.get("item_code"), "eta_item_code")
+        or ctx.loader.get_item_eta_code(_item.get("item_code"))
         or _item.get("item_code")
     )
     return {
@@ -617,11 +805,11 @@ def _get_item_metrics(_item: dict) -> Dict:
     }
 
 
-def get_pos_receipt_item_data() -> List[SingleItemData]:
+def get_pos_receipt_item_data(ctx: ReceiptBuildContext) -> List[SingleItemData]:
     """Get the POS E-Receipt ItemData."""
     item_data = []
-    for item in POS_INVOICE_RAW_DATA.get("items"):
-        item_metrics = _get_item_metrics(item)
+    for item in ctx.invoice.get("items"):
+        item_metrics = _get_item_metrics(ctx, item)
         item_data.append(
             SingleItemData(
                 internalCode=item.get("item_code"),
@@ -0,0 +1,151 @@
+import json
+import time
+from typing import Dict, List
+
+import frappe
+from frappe.utils import cint
+
+from erpnext_egypt_compliance.erpnext_eta.einvoice_submitter import (
+    ETA_MAX_SUBMISSION_BYTES,
+)
+from erpnext_egypt_compliance.erpnext_eta.ereceipt_outbox import (
+    add_to_ereceipt_outbox,
+    is_eta_unreachable,
+)
+from erpnext_egypt_compliance.erpnext_eta.ereceipt_submitter import (
+    EReceiptSubmitter,
+    get_receipts_per_submission,
+)
+from erpnext_egypt_compliance.erpnext_eta.utils import (
+    acquire_cache_lock,
+    extend_cache_lock,
+    release_cache_lock,
+)
+
+ERECEIPT_SPOOL_DOCTYPES = ("POS Invoice", "Sales Invoice")
+DEFAULT_SPOOL_MAX_AGE = 5 * 60
+ERECEIPT_SPOOL_LOCK_TIMEOUT = 10 * 60
+
+
+def spool_ereceipt(connector, ereceipt: Dict, doctype: str):
+    """
+    Queue a built e-receipt on its ETA POS Connector, to be submitted with the others of its batch.
+
+    The spool is flushed to `/receiptsubmissions` as soon as it holds `spool_max_receipts` receipts or
+    `ETA_MAX_SUBMISSION_BYTES` of them, and by `flush_due_ereceipt_spools` once its oldest receipt has
+    waited `spool_max_age` seconds.
+    """
+    data = json.dumps(ereceipt, ensure_ascii=False)
+    keys = _get_spool_keys(connector.name, doctype)
+
+    cache = frappe.cache()
+    pipeline = cache.pipeline()
+    pipeline.rpush(keys.receipts, data)
+    pipeline.incrby(keys.size, len(data.encode("utf8")))
+    pipeline.set(keys.since, time.time(), nx=True)
+    count, size, __ = pipeline.execute()
+
+    if count >= get_receipts_per_submission(connector) or size >= ETA_MAX_SUBMISSION_BYTES:
+        frappe.enqueue(
+            method="erpnext_egypt_compliance.erpnext_eta.ereceipt_spool.flush_ereceipt_spool",
+            queue="short",
+            pos_connector=connector.name,
+            doctype=doctype,
+            job_name=f"ereceipt_spool_{connector.name}_{doctype}",
+        )
+
+
+def flush_due_ereceipt_spools():
+    """Flush the spools whose oldest receipt has waited longer than the connector's `spool_max_age`."""
+    cache = frappe.cache()
+    for connector in frappe.get_all(
+        "ETA POS Connector", filters={"enable_receipt_spool": 1}, fields=["name", "spool_max_age"]
+    ):
+        max_age = cint(connector.spool_max_age) or DEFAULT_SPOOL_MAX_AGE
+        for doctype in ERECEIPT_SPOOL_DOCTYPES:
+            since = cache.get(_get_spool_keys(connector.name, doctype).since)
+            if since and time.time() - float(since) >= max_age:
+                flush_ereceipt_spool(connector.name, doctype)
+
+
+def flush_ereceipt_spool(pos_connector: str, doctype: str):
+    """
+    Submit the spooled receipts of a connector, one `/receiptsubmissions` call and one ETA Log per batch.
+
+    A single flush runs per spool at a time, receipts spooled meanwhile wait for the next batch. The
+    flush lock is renewed before each batch, and a flush that lost it stops, so no batch is taken twice.
+    A batch that does not reach the ETA is moved to the receipt outbox, see `replay_ereceipt_outbox`.
+    """
+    keys = _get_spool_keys(pos_connector, doctype)
+    lock_token = acquire_cache_lock(keys.lock, ERECEIPT_SPOOL_LOCK_TIMEOUT)
+    if not lock_token:
+        return
+
+    try:
+        connector = frappe.get_doc("ETA POS Connector", pos_connector)
+        submitter = EReceiptSubmitter(connector)
+        max_receipts = get_receipts_per_submission(connector)
+        while extend_cache_lock(keys.lock, lock_token, ERECEIPT_SPOOL_LOCK_TIMEOUT) and (
+            batch := _take_spool_batch(keys, max_receipts)
+        ):
+            try:
+                eta_response = submitter.submit_ereceipt({"receipts": batch}, doctype)
+            except Exception:
+                # the batch is no longer in the spool, keep it in the outbox rather than losing it
+                frappe.db.rollback()
+                frappe.log_error(title=f"Flush E-Receipt Spool: {pos_connector}")
+                eta_response = {"error": frappe.get_traceback(), "unreachable": True}
+
+            if is_eta_unreachable(eta_response):
+                # kept in the outbox until the ETA is back
+                add_to_ereceipt_outbox(pos_connector, batch, doctype, error=eta_response.get("error"))
+                frappe.db.commit()
+                break
+    finally:
+        release_cache_lock(keys.lock, lock_token)
+
+
+def _take_spool_batch(keys, max_receipts: int) -> List[Dict]:
+    """Remove the oldest receipts of a spool that fit in one submission."""
+    cache = frappe.cache()
+    (spooled,) = cache.pipeline().lrange(keys.receipts, 0, max_receipts - 1).execute()
+    if not spooled:
+        cache.delete(keys.since, keys.size)
+        (count,) = cache.pipeline().llen(keys.receipts).execute()
+        if count:
+            # spooled between the read and the reset
+            cache.set(keys.since, time.time(), nx=True)
+        return []
+
+    # the envelope and separators are negligible next to the limit, see `pack_submissions` for invoices
+    batch, size = [], 0
+    for data in spooled:
+        data_size = len(data)
+        if batch and size + data_size > ETA_MAX_SUBMISSION_BYTES:
+            break
+        batch.append(data)
+        size += data_size
+
+    pipeline = cache.pipeline()
+    pipeline.ltrim(keys.receipts, len(batch), -1)
+    pipeline.decrby(keys.size, size)
+    pipeline.set(keys.since, time.time())
+    pipeline.execute()
+    return [json.loads(data) for data in batch]
+
+
+def _get_spool_keys(pos_connector: str, doctype: str):
+    """
+    The redis keys of a spool, already prefixed with `make_key`.
+
+    They are only used with the raw redis commands (`get`, `set`, `delete` and pipelines), the list
+    helpers of frappe's `RedisWrapper` would prefix them a second time.
+    """
+    cache = frappe.cache()
+    prefix = f"ereceipt_spool:{pos_connector}:{doctype}"
+    return frappe._dict(
+        receipts=cache.make_key(prefix),
+        size=cache.make_key(f"{prefix}:size"),
+        since=cache.make_key(f"{prefix}:since"),
+        lock=cache.make_key(f"{prefix}:lock"),
+    )
@@ -1,9 +1,21 @@
+import math
+
 import frappe
-from erpnext_egypt_compliance.erpnext_eta.doctype.eta_pos_connector.eta_pos_connector import ETASession
 import json
+from frappe.utils import cint
 from erpnext_egypt_compliance.erpnext_eta.utils import create_eta_log
+from erpnext_egypt_compliance.erpnext_eta.eta_http import send_concurrently
 import requests
 
+ETA_RECEIPT_SUBMISSION_PAGE_SIZE = 100
+DEFAULT_RECEIPTS_PER_SUBMISSION = 100
+
+
+def get_receipts_per_submission(connector) -> int:
+    """The number of receipts an ETA POS Connector submits together, its `spool_max_receipts`."""
+    return cint(connector.get("spool_max_receipts")) or DEFAULT_RECEIPTS_PER_SUBMISSION
+
+
 class EReceiptSubmitter:
     """
     A class to submit e-receipts to the ETA portal.
@@ -29,33 +41,96 @@ class EReceiptSubmitter:
         Returns:
             dict: The response from the ETA portal.
         """
-        headers = self._get_headers()
-        url = self._get_submission_url()
-        data = self._prepare_data(ereceipts)
+        try:
+            headers = self._get_headers()
+            url = self._get_submission_url()
+            data = self._prepare_data(ereceipts)
+            response = self._send_submit_request(url, headers, data)
+        except Exception as e:
+            # nothing reached the ETA, the receipts can safely be submitted again
+            self._handle_exception(e)
+            return {"error": str(e), "unreachable": True}
 
         try:
-            eta_response = self._send_submit_request(url, headers, data)
+            eta_response = self._parse_submit_response(response)
             processed_response = self._process_response(eta_response, ereceipts, doctype)
             frappe.db.commit()
             return processed_response
         except Exception as e:
             self._handle_exception(e)
-            return {"error": str(e)}
+            return {"error": str(e), "status_code": response.status_code}
     
-    def get_receipt_submission(self, submission_id):
+    def submit_ereceipt_batches(self, batches, doctype):
+        """
+        Submit several batches of e-receipts concurrently, one ETA Log per batch.
+
+        Args:
+            batches (list): The e-receipts of each submission, as `{"receipts": [...]}`.
+            doctype (str): The document type of the receipts.
+
+        Returns:
+            list: The processed response of each batch in order, `{"error": ...}` for the batches that failed,
+                with `"unreachable": True` when the batch was never sent.
+        """
+        try:
+            headers = self._get_headers()
+            url = self._get_submission_url()
+        except Exception as e:
+            self._handle_exception(e)
+            return [{"error": str(e), "unreachable": True} for batch in batches]
+
+        responses = send_concurrently(
+            self.eta_connector.session,
+            {i: ("POST", url, {"headers": headers, "data": self._prepare_data(batch)}) for i, batch in enumerate(batches)},
+        )
+
+        processed_responses = []
+        for i, ereceipts in enumerate(batches):
+            if isinstance(responses[i], Exception):
+                self._handle_exception(responses[i])
+                processed_responses.append({"error": str(responses[i]), "unreachable": True})
+                continue
+
+            try:
+                eta_response = self._parse_submit_response(responses[i])
+                processed_responses.append(self._process_response(eta_response, ereceipts, doctype))
+            except Exception as e:
+                self._handle_exception(e)
+                processed_responses.append({"error": str(e), "status_code": responses[i].status_code})
+
+        frappe.db.commit()
+        return processed_responses
+
+    def get_receipt_submission(self, submission_id, page_size=ETA_RECEIPT_SUBMISSION_PAGE_SIZE):
         """
         Get the submission details from the ETA portal.
+
+        The first page gives the receipts count, the remaining pages are fetched concurrently and
+        their receipts appended to the first page's.
         """
         try:
-            access_token = self.eta_connector.get_access_token()
             headers = self._get_headers()
+            eta_session = self.eta_connector.session
 
-            url = f"{self.eta_connector.ETA_BASE}/receiptsubmissions/{submission_id}/details?PageNo=1&PageSize=100"
-            eta_session = ETASession().get_session()
-            eta_response = eta_session.get(url, headers=headers)
+            eta_response = eta_session.get(self._get_receipt_submission_url(submission_id, 1, page_size), headers=headers)
             eta_response.raise_for_status()
             eta_data = eta_response.json()
 
+            page_count = math.ceil((eta_data.get("receiptsCount") or 0) / page_size)
+            responses = send_concurrently(
+                eta_session,
+                {
+                    page_no: ("GET", self._get_receipt_submission_url(submission_id, page_no, page_size), {"headers": headers})
+                    for page_no in range(2, page_count + 1)
+                },
+            )
+            for page_no in sorted(responses):
+                response = responses[page_no]
+                if isinstance(response, Exception):
+                    raise response
+                response.raise_for_status()
+                eta_data.setdefault("receipts", []).extend(response.json().get("receipts") or [])
+
             return eta_data
 
         except requests.RequestException as e:
@@ -65,13 +140,16 @@ class EReceiptSubmitter:
         except Exception as e:
             frappe.log_error(title="Unexpected error in get_receipt_submission", message=str(e))
     
+    def _get_receipt_submission_url(self, submission_id, page_no, page_size):
+        return f"{self.eta_connector.ETA_BASE}/receiptsubmissions/{submission_id}/details?PageNo={page_no}&PageSize={page_size}"
+
     def get_receipt_status(self, uuid):
         try:
             access_token = self.eta_connector.get_access_token()
             headers = self._get_headers()
 
             url = f"{self.eta_connector.ETA_BASE}/receipts/{uuid}/raw/"
-            eta_session = ETASession().get_session()
+            eta_session = self.eta_connector.session
             eta_response = eta_session.get(url, headers=headers)
             eta_response.raise_for_status()
             eta_data = eta_response.json()
@@ -81,6 +159,29 @@ class EReceiptSubmitter:
             frappe.log_error(title="Get e-receipt Status", message=str(e))
             return f"Error when Get e-receipt status: {str(e)}"
 
+    def get_receipt_statuses(self, uuids):
+        """
+        Get several receipts from the ETA portal concurrently.
+
+        Returns:
+            dict: uuid -> the receipt data, for the receipts fetched successfully.
+        """
+        headers = self._get_headers()
+        eta_session = self.eta_connector.session
+        responses = send_concurrently(
+            eta_session,
+            {uuid: ("GET", f"{self.eta_connector.ETA_BASE}/receipts/{uuid}/raw/", {"headers": headers}) for uuid in uuids},
+        )
+
+        receipts = {}
+        for uuid, response in responses.items():
+            if isinstance(response, Exception) or not response.ok:
+                message = str(response) if isinstance(response, Exception) else f"HTTP {response.status_code}: {response.text}"
+                frappe.log_error(title="Get e-receipt Status", message=f"{uuid}: {message}")
+                continue
+            receipts[uuid] = response.json()
+        return receipts
+
     def _get_headers(self):
         """
         Get the headers required for the request.
@@ -118,11 +219,17 @@ class EReceiptSubmitter:
             data (bytes): The JSON-encoded data.
 
         Returns:
-            dict: The response from the ETA portal.
+            requests.Response: The HTTP response of the ETA portal.
         """
-        eta_session = ETASession().get_session()
-        response = eta_session.post(url, headers=headers, data=data)
-        _eta_response = frappe._dict(response.json())
+        eta_session = self.eta_connector.session
+        return eta_session.post(url, headers=headers, data=data)
+
+    def _parse_submit_response(self, response):
+        try:
+            _eta_response = frappe._dict(response.json())
+        except ValueError:
+            # e.g. the HTML page of a gateway error
+            _eta_response = frappe._dict(error=response.text)
         _eta_response["status_code"] = response.status_code or None
         return _eta_response
 
@@ -155,6 +262,7 @@ class EReceiptSubmitter:
         if eta_response.get("error"):
             self._handle_error_response(eta_response, initial_eta_log)
 
+        eta_response["eta_log"] = initial_eta_log.name
         return eta_response
 
     def _handle_success_response(self, eta_response, ereceipts, eta_log, doctype):
@@ -179,8 +287,8 @@ class EReceiptSubmitter:
         eta_log.submission_id = eta_response.get("submissionId")
         eta_log.submission_summary = summary_message
         eta_log.submission_status = submission_status
+        eta_log.process_documents(eta_response)
         eta_log.save()
-        eta_log.process_documents(eta_response, doctype, eta_log)
 
     def _handle_error_response(self, eta_response, initial_eta_log):
         """
@@ -0,0 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, Tuple
+
+from frappe.utils import cint
+
+from erpnext_egypt_compliance.erpnext_eta.master_data import get_eta_settings
+
+DEFAULT_ETA_HTTP_CONCURRENCY = 16
+
+
+def get_eta_http_concurrency() -> int:
+    """The maximum number of ETA API requests in flight, from `ETA Settings.eta_http_concurrency`."""
+    return cint(get_eta_settings().eta_http_concurrency) or DEFAULT_ETA_HTTP_CONCURRENCY
+
+
+def send_concurrently(session, requests_by_key: Dict[str, Tuple[str, str, Dict]], concurrency: int = None) -> Dict:
+    """
+    Send ETA API requests concurrently over a shared session.
+
+    Only the HTTP exchange runs in the worker threads. Callers read what they need from the database
+    before and write the results after, as the frappe database connection is local to the calling thread.
+
+    Args:
+        session (requests.Session): The session to send the requests with.
+        requests_by_key (dict): key -> (method, url, request kwargs).
+        concurrency (int): The maximum number of requests in flight, see `get_eta_http_concurrency`.
+
+    Returns:
+        dict: key -> the `requests.Response`, or the exception raised while sending the request.
+    """
+    return dict(iter_concurrently(session, requests_by_key, concurrency))
+
+
+def iter_concurrently(
+    session, requests_by_key: Dict[str, Tuple[str, str, Dict]], concurrency: int = None
+) -> Iterator[Tuple[str, object]]:
+    """Like `send_concurrently`, but yield each (key, response) as soon as its request completes."""
+    if not requests_by_key:
+        return
+
+    concurrency = concurrency or get_eta_http_concurrency()
+
+    def _send(request):
+        method, url, kwargs = request
+        try:
+            return session.request(method, url, **kwargs)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(requests_by_key))) as executor:
+        futures = {executor.submit(_send, request): key for key, request in requests_by_key.items()}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
@@ -1,6 +1,6 @@
 
 import frappe
-from erpnext_egypt_compliance.erpnext_eta.ereceipt_schema import submit_ereceipt
+from erpnext_egypt_compliance.erpnext_eta.ereceipt_schema import submit_ereceipts
 
 def submit_bulk_ereceipts(doctype: str, filters: dict):
 	args = frappe._dict(filters)
@@ -9,7 +9,6 @@ def submit_bulk_ereceipts(doctype: str, filters: dict):
 		filters=args,
 		fields=["name", "pos_profile"]
 	)
-	for doc in douments:
-		print(f"Proccess {doc.name}")
-		submit_ereceipt(doc.name, doc.get("pos_profile"), doctype, False)
-	print("Done :)")
\ No newline at end of file
+	frappe.logger("eta").info(f"Submitting the e-receipts of {len(douments)} {doctype} document(s)")
+	submit_ereceipts([doc.name for doc in douments], doctype)
+	frappe.logger("eta").info(f"Submitted the e-receipts of {len(douments)} {doctype} document(s)")
\ No newline at end of file
@@ -3,44 +3,187 @@
 
 import frappe
 import json
+from collections import defaultdict
+from frappe import _
+from frappe.utils import cint
 from datetime import datetime
 from erpnext_egypt_compliance.erpnext_eta.utils import (
+    bulk_set_values,
     get_company_eta_connector,
 )
 
 # from erpnext_eta.erpnext_eta.utils import get_eta_invoice
-from erpnext_egypt_compliance.erpnext_eta.einvoice_schema import get_invoice_asjson
+from erpnext_egypt_compliance.erpnext_eta.einvoice_schema import (
+    build_invoices_asjson,
+    get_invoice_asjson,
+    get_invoice_hash,
+    get_signable_invoice,
+)
 import base64
 
+# the most documents handed out or accepted by one call of the batch signer endpoints
+SIGNER_MAX_BATCH_SIZE = 500
+SIGNING_QUEUE_PAGE_SIZE = 500
+# seconds an invoice claimed by a signer is hidden from the other signers
+SIGNING_LEASE_TIMEOUT = 10 * 60
+CLAIMED_BY_ANOTHER_SIGNER = "Invoice is claimed by another signer"
+
+@frappe.whitelist()
+def get_invoice_names_to_sign(company, page_size=SIGNING_QUEUE_PAGE_SIZE, after=None):
+    """
+    A page of the invoices waiting for a signature, oldest first, without the ones claimed by a signer.
+
+    Args:
+        after (list): The `[posting_date, name]` of the last invoice of the previous page.
+
+    Returns:
+        list: `{"name", "posting_date"}` per invoice, empty once the end of the queue is reached.
+    """
+    page_size = cint(page_size) or SIGNING_QUEUE_PAGE_SIZE
+    cursor = frappe.parse_json(after) if after else None
+
+    unclaimed = []
+    while len(unclaimed) < page_size:
+        invoices = _get_invoices_to_sign(company, cursor, page_size - len(unclaimed))
+        if not invoices:
+            break
+
+        leased = _get_leased_invoices([invoice.name for invoice in invoices])
+        unclaimed += [
+            {"name": invoice.name, "posting_date": str(invoice.posting_date)}
+            for invoice in invoices
+            if invoice.name not in leased
+        ]
+        cursor = [str(invoices[-1].posting_date), invoices[-1].name]
+
+    return unclaimed
+
+
 @frappe.whitelist()
-def get_invoice_names_to_sign(company):
+def claim_invoices_to_sign(company, page_size=100, after=None):
+    """
+    Claim a page of the invoices waiting for a signature, so that several signers can work the queue.
+
+    Each claimed invoice is leased to the caller for `SIGNING_LEASE_TIMEOUT` seconds, during which the
+    other signers skip it. The lease ends when the signature is saved or the invoice is released, and
+    an invoice left unsigned is handed out again once its lease expires.
+
+    Args:
+        page_size (int): The number of invoices to claim, at most `SIGNER_MAX_BATCH_SIZE`.
+        after (list): The `next` cursor of the previous call, to continue from there.
+
+    Returns:
+        dict: The claimed `invoices`, the `lease` to fetch and release them with, and the `next` cursor,
+            which is empty once the end of the queue is reached.
+    """
+    page_size = min(cint(page_size) or SIGNING_QUEUE_PAGE_SIZE, SIGNER_MAX_BATCH_SIZE)
+    cursor = frappe.parse_json(after) if after else None
+    lease = frappe.generate_hash(length=16)
+    cache = frappe.cache()
+
+    claimed = []
+    while len(claimed) < page_size:
+        invoices = _get_invoices_to_sign(company, cursor, page_size - len(claimed))
+        if not invoices:
+            cursor = None
+            break
+
+        pipeline = cache.pipeline()
+        for invoice in invoices:
+            pipeline.set(_get_signing_lease_key(invoice.name), lease, nx=True, ex=SIGNING_LEASE_TIMEOUT)
+        claimed += [invoice.name for invoice, is_claimed in zip(invoices, pipeline.execute(), strict=True) if is_claimed]
+        cursor = [str(invoices[-1].posting_date), invoices[-1].name]
+
+    return {"invoices": claimed, "lease": lease, "next": cursor}
+
+
+@frappe.whitelist()
+def release_invoices_to_sign(docnames, lease):
+    """Give back claimed invoices that will not be signed under this lease."""
+    docnames = frappe.parse_json(docnames)
+    cache = frappe.cache()
+    keys = [_get_signing_lease_key(docname) for docname in docnames]
+    held = [key for key, value in zip(keys, cache.mget(keys), strict=True) if frappe.safe_decode(value) == lease]
+    if held:
+        cache.delete(*held)
+
+
+def _release_signing_leases(docnames):
+    if docnames:
+        frappe.cache().delete(*[_get_signing_lease_key(docname) for docname in docnames])
+
+
+def _get_leased_invoices(docnames, lease=None):
+    """The invoices among `docnames` claimed by a signer, other than the holder of `lease`."""
+    if not docnames:
+        return set()
+
+    keys = [_get_signing_lease_key(docname) for docname in docnames]
+    return {
+        docname
+        for docname, value in zip(docnames, frappe.cache().mget(keys), strict=True)
+        if value and frappe.safe_decode(value) != lease
+    }
+
+
+def _get_signing_lease_key(docname):
+    return frappe.cache().make_key(f"eta_signing_lease:{docname}")
+
+
+def _get_invoices_to_sign(company, after, page_size):
+    """Unsigned invoices of a company in (posting_date, name) order, starting after the `after` key."""
     connector = get_company_eta_connector(company)
     docstatus = ["1"]
     if connector.get("all_docstatus"):
         docstatus = ["0", "1"]
-    invoice_names = frappe.get_list(
+    filters = [
+        ["docstatus", "in", docstatus],
+        ["company", "=", company],
+        ["posting_date", ">=", connector.signature_start_date],
+        ["eta_signature", "=", ""],
+    ]
+    or_filters = None
+    if after:
+        posting_date, name = after
+        # (posting_date, name) > after
+        filters.append(["posting_date", ">=", posting_date])
+        or_filters = [["posting_date", ">", posting_date], ["name", ">", name]]
+
+    return frappe.get_list(
         "Sales Invoice",
-        filters=[
-            ["docstatus", "in", docstatus],
-            ["company", "=", company],
-            ["posting_date", ">=", connector.signature_start_date],
-            ["eta_signature", "=", ""],
-        ],
-        order_by="posting_date",
+        fields=["name", "posting_date"],
+        filters=filters,
+        or_filters=or_filters,
+        order_by="posting_date asc, name asc",
+        limit_page_length=page_size,
     )
-    return invoice_names if invoice_names else []
 
 
 @frappe.whitelist()
-def get_eta_invoice_for_signer(docname):
+def get_eta_invoice_for_signer(docname, include_hash=0, lease=None):
+    """
+    The document to sign for a Sales Invoice.
+
+    Its canonical SHA-256 is computed here and kept in `eta_document_hash`, so the submission can
+    tell whether the invoice changed since it was signed. With `include_hash`, the signer gets
+    `{"document": ..., "sha256": ...}` and can sign the digest without serializing the document again.
+    An invoice claimed by another signer is not handed out, pass the `lease` it was claimed with.
+    """
+    if _get_leased_invoices([docname], lease):
+        return {"error": CLAIMED_BY_ANOTHER_SIGNER}
+
     try:
         frappe.set_value("Sales Invoice", docname, "eta_signature_date", datetime.today())
         frappe.set_value("Sales Invoice", docname, "eta_signature_time", datetime.now())
         frappe.db.commit()
 
-        inv = get_invoice_asjson(docname, as_dict=True)
-        inv.pop("signatures")
-        inv["documentTypeVersion"] = "1.0"
+        inv = get_signable_invoice(get_invoice_asjson(docname, as_dict=True))
+        document_hash = get_invoice_hash(inv)
+        frappe.db.set_value("Sales Invoice", docname, "eta_document_hash", document_hash, update_modified=False)
+        frappe.db.commit()
+
+        if cint(include_hash):
+            return {"document": inv, "sha256": document_hash}
         return inv
     except Exception as e:
         trace = frappe.get_traceback()
@@ -51,10 +194,165 @@ def get_eta_invoice_for_signer(docname):
         return {"error": f"Failed to get ETA Invoice {str(e)}"}
 
 
+@frappe.whitelist()
+def get_eta_invoices_for_signer(docnames, lease=None):
+    """
+    The documents to sign for several Sales Invoices, built in bulk.
+
+    The signature date, time and document hash of every invoice are written in one transaction.
+    Invoices claimed by another signer are skipped, pass the `lease` they were claimed with.
+
+    Returns:
+        list: `{"docname", "document", "sha256"}` per invoice, or `{"docname", "error"}` if it failed to build,
+            cannot be written by the session user or is claimed by another signer.
+    """
+    docnames = _parse_signer_batch(docnames)
+    now = datetime.now()
+
+    signer_payloads, values_by_name = [], {}
+    leased = _get_leased_invoices(docnames, lease)
+    signer_payloads += [{"docname": docname, "error": CLAIMED_BY_ANOTHER_SIGNER} for docname in docnames if docname in leased]
+    docnames = [docname for docname in docnames if docname not in leased]
+
+    writable, errors = _get_writable_invoices(
+        docnames, ["eta_signature_date", "eta_signature_time", "eta_document_hash"]
+    )
+    signer_payloads += [{"docname": docname, "error": error} for docname, error in errors.items()]
+    docnames = [docname for docname in docnames if docname in writable]
+
+    for docname, einvoice in _build_einvoices_for_signer(docnames).items():
+        if isinstance(einvoice, Exception):
+            signer_payloads.append({"docname": docname, "error": f"Failed to get ETA Invoice {str(einvoice)}"})
+            continue
+
+        inv = get_signable_invoice(einvoice)
+        document_hash = get_invoice_hash(inv)
+        signer_payloads.append({"docname": docname, "document": inv, "sha256": document_hash})
+        values_by_name[docname] = {
+            "eta_signature_date": now.date(),
+            "eta_signature_time": now.time(),
+            "eta_document_hash": document_hash,
+        }
+
+    bulk_set_values("Sales Invoice", values_by_name)
+    frappe.db.commit()
+    return signer_payloads
+
+
+def _build_einvoices_for_signer(docnames):
+    """docname -> the e-invoice, or the exception raised while building it."""
+    if not docnames:
+        return {}
+    try:
+        return dict(zip(docnames, build_invoices_asjson(docnames, as_dict=True), strict=True))
+    except Exception:
+        # build one by one to tell which invoices fail
+        einvoices = {}
+        for docname in docnames:
+            try:
+                einvoices[docname] = get_invoice_asjson(docname, as_dict=True)
+            except Exception as e:
+                frappe.log_error(title=f"Failed to get ETA Invoice for signer {docname}", message=frappe.get_traceback())
+                einvoices[docname] = e
+        return einvoices
+
+
+@frappe.whitelist()
+def set_invoice_signatures(signatures):
+    """
+    Save the signatures of several Sales Invoices in one transaction.
+
+    Live submission is enqueued once per company for the whole batch.
+
+    Args:
+        signatures (list): `{"docname", "signature"}` per invoice.
+
+    Returns:
+        dict: docname -> "Signature Received", or the reason the signature was rejected.
+    """
+    signatures = _parse_signer_batch(signatures)
+
+    results, values_by_name = {}, {}
+    for row in signatures:
+        docname, signature = row.get("docname"), row.get("signature")
+        try:
+            is_valid_base64(signature)
+        except Exception:
+            results[docname] = "Invalid Signature"
+            continue
+        values_by_name[docname] = {"eta_signature": signature}
+
+    writable, errors = _get_writable_invoices(list(values_by_name), ["eta_signature"])
+    results.update(errors)
+    values_by_name = {docname: values for docname, values in values_by_name.items() if docname in writable}
+
+    docnames_by_company = defaultdict(list)
+    for docname in values_by_name:
+        docnames_by_company[writable[docname].company].append(docname)
+        results[docname] = "Signature Received"
+
+    bulk_set_values("Sales Invoice", values_by_name)
+    frappe.db.commit()
+    _release_signing_leases(list(values_by_name))
+
+    for company, docnames in docnames_by_company.items():
+        connector = get_company_eta_connector(company)
+        if connector and connector.submission_mode == "Live":
+            enqueue_invoices_live_submission(docnames, connector)
+
+    return results
+
+
+def _get_writable_invoices(docnames, fieldnames):
+    """
+    The Sales Invoices whose `fieldnames` the session user may write.
+
+    The batch endpoints write with `bulk_set_values`, so they check what `frappe.set_value` would:
+    write permission on the invoice, and `allow_on_submit` on the fields of a submitted invoice.
+
+    Returns:
+        tuple: name -> `{"name", "company"}` of the writable invoices, and docname -> the reason for the others.
+    """
+    if not docnames:
+        return {}, {}
+
+    meta = frappe.get_meta("Sales Invoice")
+    locked_on_submit = any(
+        meta.get_field(fieldname) and not meta.get_field(fieldname).allow_on_submit for fieldname in fieldnames
+    )
+    invoices = {
+        invoice.name: invoice
+        for invoice in frappe.get_all(
+            "Sales Invoice", filters={"name": ["in", docnames]}, fields=["name", "company", "docstatus"]
+        )
+    }
+
+    writable, errors = {}, {}
+    for docname in docnames:
+        invoice = invoices.get(docname)
+        if not invoice:
+            errors[docname] = "Invoice Not Found"
+        elif not frappe.has_permission("Sales Invoice", "write", doc=docname):
+            errors[docname] = "Not Permitted"
+        elif invoice.docstatus == 2 or (invoice.docstatus == 1 and locked_on_submit):
+            errors[docname] = "Cannot Update After Submit"
+        else:
+            writable[docname] = invoice
+    return writable, errors
+
+
+def _parse_signer_batch(rows):
+    rows = frappe.parse_json(rows) or []
+    if len(rows) > SIGNER_MAX_BATCH_SIZE:
+        frappe.throw(_("At most {0} documents can be signed per batch").format(SIGNER_MAX_BATCH_SIZE))
+    return rows
+
+
 @frappe.whitelist()
 def set_invoice_signature(docname, signature, doctype="Sales Invoice"):
     is_valid_base64(signature)
     frappe.set_value(doctype, docname, "eta_signature", signature)
+    _release_signing_leases([docname])
     
     company = frappe.get_value("Sales Invoice", docname, "company")
     connector = get_company_eta_connector(company)
@@ -83,5 +381,19 @@ def enqueue_invoice_live_submission(docname , connector):
 
 
 
+def enqueue_invoices_live_submission(docnames, connector):
+    """Enqueue one background submission for a batch of freshly signed invoices"""
+    try:
+        frappe.enqueue(
+            method="erpnext_egypt_compliance.erpnext_eta.main.autosubmit_eta_live_batch_submission",
+            queue="short",
+            docnames=docnames,
+            connector=connector,
+            job_name=f"eta_submission_{docnames[0]}_{len(docnames)}",
+        )
+    except Exception as e:
+        frappe.log_error(f"Failed to enqueue {len(docnames)} invoice(s) for submission: {str(e)}")
+
+
 def is_valid_base64(signature):
   base64.b64decode(signature, validate=True)
@@ -3,6 +3,12 @@ import json
 from datetime import datetime
 from frappe.utils import add_to_date
 from erpnext_egypt_compliance.erpnext_eta.utils import get_company_eta_connector
+from erpnext_egypt_compliance.erpnext_eta.master_data import (
+    get_eta_settings,
+    get_issuer_profile,
+    get_item_eta_codes,
+    get_uom_eta_code,
+)
 import pytz
 
 
@@ -10,6 +16,11 @@ import pytz
 def get_eta_inv_datetime_diff(invname):
     inv_posting_date = frappe.get_value("Sales Invoice", invname, "posting_date")
     inv_posting_time = frappe.get_value("Sales Invoice", invname, "posting_time")
+    return get_eta_datetime_diff(inv_posting_date, inv_posting_time)
+
+
+def get_eta_datetime_diff(inv_posting_date, inv_posting_time):
+    """Hours elapsed since the given invoice posting date and time (Cairo time)."""
     inv_naive_datetime = add_to_date(inv_posting_date, seconds=inv_posting_time.seconds)
     inv_utc_datetime = pytz.timezone("Africa/Cairo").localize(inv_naive_datetime, is_dst=None).astimezone(pytz.utc)
     now_utc = pytz.timezone("Africa/Cairo").localize(datetime.now(), is_dst=None).astimezone(pytz.utc)
@@ -48,14 +59,12 @@ def _get_inv_tax_total(inv, eta_invoice):
 
 def _get_eta_item(item, inv):
     eta_inv_item = _get_maped_dict(item, get_eta_sales_invoice_line_item_map())
-    item_doc = frappe.get_doc("Item", item.item_code)
+    item_eta_code = get_item_eta_codes([item.item_code]).get(item.item_code) or {}
     eta_inv_item = frappe._dict(eta_inv_item)
 
-    _get_item_code(eta_inv_item, item_doc)
+    _get_item_code(eta_inv_item, item_eta_code)
 
-    eta_inv_item.unitType = frappe.get_value("UOM", item.uom, "eta_uom") or frappe.get_value(
-        "ETA Settings", "ETA Settings", "eta_uom"
-    )
+    eta_inv_item.unitType = get_uom_eta_code(item.uom) or get_eta_settings().eta_uom
     if inv._foreign_company_currency:
         eta_inv_item.salesTotal = _eta_round(
             item.base_amount * (inv._exchange_rate),
@@ -86,18 +95,13 @@ def _get_eta_item(item, inv):
     return eta_inv_item
 
 
-def _get_item_code(eta_inv_item, item_doc):
-    if item_doc.get("eta_inherit_brand"):
-        eta_inv_item.itemType = frappe.get_value("Brand", item_doc.get("brand"), "eta_code_type")
-        eta_inv_item.itemCode = frappe.get_value("Brand", item_doc.get("brand"), "eta_item_code")
-    elif item_doc.get("eta_inherit_item_group"):
-        eta_inv_item.itemType = frappe.get_value("Item Group", item_doc.get("item_group"), "eta_code_type")
-        eta_inv_item.itemCode = frappe.get_value("Item Group", item_doc.get("item_group"), "eta_item_code")
+def _get_item_code(eta_inv_item, item_eta_code):
+    if item_eta_code.get("inherited"):
+        eta_inv_item.itemType = item_eta_code.get("item_type")
+        eta_inv_item.itemCode = item_eta_code.get("item_code")
     else:
-        eta_inv_item.itemType = item_doc.eta_code_type or "EGS"
-        eta_inv_item.itemCode = item_doc.eta_item_code or frappe.get_value(
-            "ETA Settings", "ETA Settings", "eta_item_code"
-        )
+        eta_inv_item.itemType = item_eta_code.get("item_type") or "EGS"
+        eta_inv_item.itemCode = item_eta_code.get("item_code") or get_eta_settings().eta_item_code
 
 
 def _abs_taxableItems(_eta_inv_item, inv):
@@ -143,20 +147,18 @@ def get_eta_sales_invoice_line_item_map():
 
 def get_eta_inv_issuer(invoice):
     eta_issuer = frappe._dict()
-    company = frappe.get_doc("Company", invoice.company)
+    company = get_issuer_profile(invoice.company)
     eta_issuer.type = company.eta_issuer_type
     eta_issuer.id = company.eta_tax_id
     eta_issuer.name = company.eta_issuer_name
-    branch = frappe.get_doc("Branch", company.eta_default_branch)
-    branch_address = frappe.get_doc("Address", branch.eta_branch_address)
-    country_code = frappe.db.get_value("Country", branch_address.country, "code")
+    branch_data = company.branch_data
     eta_issuer.address = {
-        "branchID": branch.eta_branch_id,
-        "country": country_code,
-        "governate": branch_address.state,
-        "regionCity": branch_address.city,
-        "street": branch_address.address_line1,
-        "buildingNumber": branch_address.building_number,
+        "branchID": branch_data.eta_branch_id,
+        "country": branch_data.country_code,
+        "governate": branch_data.state,
+        "regionCity": branch_data.city,
+        "street": branch_data.address_line1,
+        "buildingNumber": branch_data.building_number,
     }
     return eta_issuer
 
@@ -2,18 +2,27 @@ import json
 
 import frappe
 from frappe import _
-from erpnext_egypt_compliance.erpnext_eta.einvoice_schema import get_invoice_asjson
+from erpnext_egypt_compliance.erpnext_eta.einvoice_schema import get_invoice_asjson, build_invoices_asjson
 
 from erpnext_egypt_compliance.erpnext_eta.legacy_einvoice import (
-    get_eta_inv_datetime_diff )
+    get_eta_datetime_diff )
 
 from erpnext_egypt_compliance.erpnext_eta.utils import (
     download_eta_invoice_json, update_eta_docstatus
 )
 from erpnext_egypt_compliance.erpnext_eta.doctype.eta_log.einvoice_logging_utils import submit_einvoice_feedback_logger, submit_einvoice_background_logger
-from erpnext_egypt_compliance.erpnext_eta.utils import get_company_eta_connector
-from erpnext_egypt_compliance.erpnext_eta.einvoice_submitter import EInvoiceSubmitter
-from frappe.utils import nowdate
+from erpnext_egypt_compliance.erpnext_eta.utils import (
+    acquire_cache_lock,
+    extend_cache_lock,
+    get_company_eta_connector,
+    release_cache_lock,
+)
+from erpnext_egypt_compliance.erpnext_eta.einvoice_submitter import EInvoiceSubmitter, ETA_MAX_DOCUMENTS_PER_SUBMISSION
+from erpnext_egypt_compliance.erpnext_eta.master_data import get_eta_settings
+from frappe.utils import cint, nowdate
+
+ETA_BATCH_COMPANIES_KEY = "eta_batch_submission_companies"
+ETA_BATCH_LOCK_TIMEOUT = 60 * 60
 
 @frappe.whitelist()
 def download_eta_inv_json(docname):
@@ -42,6 +51,41 @@ def get_eta_pdf(docname):
         frappe.log_error(f"ETA PDF Download Error for invoice {docname}: {str(e)}")
         frappe.throw(f"Error downloading PDF: {str(e)}")
 
+@frappe.whitelist()
+def download_eta_pdfs(docnames):
+    """Download the ETA PDFs of several Sales Invoices of one company as a zip file."""
+    import io
+    import zipfile
+
+    docnames = frappe.parse_json(docnames)
+    invoices = frappe.get_list(
+        "Sales Invoice", filters={"name": ["in", docnames]}, fields=["name", "company"], limit_page_length=0
+    )
+    not_permitted = set(docnames) - {invoice.name for invoice in invoices}
+    if not_permitted:
+        frappe.throw(
+            _("Not permitted to read Sales Invoice {0}").format(", ".join(sorted(not_permitted))),
+            frappe.PermissionError,
+        )
+
+    companies = {invoice.company for invoice in invoices}
+    if len(companies) != 1:
+        frappe.throw(_("Select Sales Invoices of a single company"))
+
+    connector = get_company_eta_connector(companies.pop())
+    pdfs = EInvoiceSubmitter(connector).get_eta_pdfs(docnames)
+    if not pdfs:
+        frappe.throw(_("Failed to download the ETA PDFs"))
+
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, "w", zipfile.ZIP_DEFLATED) as archive:
+        for docname, pdf in pdfs.items():
+            archive.writestr(f"eta_invoice_{docname}.pdf", pdf)
+
+    frappe.local.response.filename = "eta_invoices.zip"
+    frappe.local.response.filecontent = content.getvalue()
+    frappe.local.response.type = "download"
+
 @frappe.whitelist()
 def fetch_eta_status(docname):
     
@@ -50,43 +94,29 @@ def fetch_eta_status(docname):
     return update_eta_docstatus(connector, docname)
     
 
-def get_batch_invoices(company):
+def get_batch_invoices(company, lock=None):
     try:
         
-        einvoices=[]
         connector = get_company_eta_connector(company)
         
         if connector.submission_mode=="Manual":
             return
 
+        if connector.submission_mode == "Continuous":
+            return drain_eta_submission_queue(company, connector, lock)
+
         batch_size=connector.eta_batch_size or 10
         docs = frappe.get_all(
             "Sales Invoice",
-            filters=[
-                ["eta_signature", "!=", ""],
-                ["docstatus", "=", 1],
-                ["eta_status", "=", ""],
-                ["eta_submission_id", "=", ""],
+            filters=_get_pending_invoice_filters(company) + [
                 ["posting_date", "=", nowdate()],  # ✅ only today's invoices
             ],
-            pluck="name",
+            fields=["name", "posting_date", "posting_time"],
             limit=batch_size,
         )
 
-        for docname in docs:
-            submit_inv = True
-            time_diff = get_eta_inv_datetime_diff(docname)
-            
-            if connector.delay_in_hours > 0:
-                if time_diff < connector.delay_in_hours:
-                    submit_inv = False
-
-            # if connector.enable_eta_grace_period_validation and time_diff > connector.einvoice_submission_grace_period:
-            #     submit_inv = False
-
-            if submit_inv:
-                inv = get_invoice_asjson(docname, as_dict=True)
-                einvoices.append(inv)
+        docnames = _get_due_invoices(docs, connector)
+        einvoices = build_invoices_asjson(docnames, as_dict=True) if docnames else []
 
         if not einvoices:
             frappe.logger().error(f"No invoices to submit for {company}")
@@ -96,17 +126,158 @@ def get_batch_invoices(company):
                
                  
     except Exception as e:
-        frappe.log_error("Auto Submission Error", f"Failed to submit e-invoice  {0}").format(str(e))
-        
+        frappe.log_error("Auto Submission Error", f"Failed to submit e-invoices for {company}: {str(e)}")
+
+
+def drain_eta_submission_queue(company, connector, lock=None):
+    """
+    Submit the signed but unsubmitted invoices of a company in successive batches until none are due.
+
+    Invoices are taken oldest first, `ETA_MAX_DOCUMENTS_PER_SUBMISSION` at a time, and only once
+    `delay_in_hours` has elapsed since their posting. Each cycle logs the remaining backlog.
+    Submitted invoices leave the queue through their `eta_submission_id`, only the ones that failed
+    to build or submit are excluded from the next cycles, and a batch that fails as a whole stops
+    the drain until the next run.
+
+    Args:
+        lock (tuple): The `(key, token)` of the company's batch submission lock, extended after each batch.
+            The drain stops if the lock was lost, as another lane is then submitting the same invoices.
+    """
+    failed = set()
+    while True:
+        if lock and not extend_cache_lock(*lock, ETA_BATCH_LOCK_TIMEOUT):
+            frappe.log_error(title=f"ETA Submission Drain Stopped: {company}", message="The batch submission lock was lost")
+            return
+
+        filters = _get_pending_invoice_filters(company, exclude=failed)
+        backlog = frappe.db.count("Sales Invoice", filters=filters)
+        frappe.logger("eta").info(f"ETA submission backlog for {company}: {backlog} invoice(s)")
+        if not backlog:
+            return
+
+        docs = frappe.get_all(
+            "Sales Invoice",
+            filters=filters,
+            fields=["name", "posting_date", "posting_time"],
+            order_by="posting_date asc, posting_time asc, name asc",
+            limit=ETA_MAX_DOCUMENTS_PER_SUBMISSION,
+        )
+        docnames = _get_due_invoices(docs, connector)
+        if not docnames:
+            # the oldest pending invoice is still within the delay, so are the rest
+            return
+
+        einvoices = _build_einvoices(docnames)
+        built = [einvoice["internalID"] for einvoice in einvoices]
+        # rejected or failed invoices are not retried within the same drain
+        failed.update(set(docnames) - set(built))
+        if not einvoices:
+            continue
+
+        submit_einvoice_background_logger(einvoices, connector, submitted_by="Agent")
+        frappe.db.commit()
+
+        unsubmitted = frappe.get_all(
+            "Sales Invoice", filters=_get_pending_invoice_filters(company) + [["name", "in", built]], pluck="name"
+        )
+        if len(unsubmitted) == len(built):
+            # nothing went through, e.g. the ETA is unreachable
+            return
+        failed.update(unsubmitted)
+
+
+def _get_pending_invoice_filters(company, exclude=None):
+    """Filters of the signed Sales Invoices of a company that were not submitted to the ETA yet."""
+    filters = [
+        ["company", "=", company],
+        ["eta_signature", "!=", ""],
+        ["docstatus", "=", 1],
+        ["eta_status", "=", ""],
+        ["eta_submission_id", "=", ""],
+    ]
+    if exclude:
+        filters.append(["name", "not in", list(exclude)])
+    return filters
+
+
+def _get_due_invoices(docs, connector):
+    """Names of the invoices whose `delay_in_hours` since posting has elapsed, in the given order."""
+    docnames = []
+    for doc in docs:
+        time_diff = get_eta_datetime_diff(doc.posting_date, doc.posting_time)
+        if connector.delay_in_hours > 0 and time_diff < connector.delay_in_hours:
+            continue
+
+        # if connector.enable_eta_grace_period_validation and time_diff > connector.einvoice_submission_grace_period:
+        #     continue
+
+        docnames.append(doc.name)
+    return docnames
+
+
+def _build_einvoices(docnames):
+    """Build the e-invoices of a batch, dropping (and logging) the invoices that fail validation."""
+    try:
+        return build_invoices_asjson(docnames, as_dict=True)
+    except Exception:
+        einvoices = []
+        for docname in docnames:
+            try:
+                einvoices.append(get_invoice_asjson(docname, as_dict=True))
+            except Exception:
+                frappe.log_error(title=f"ETA Validation Error: {docname}")
+        return einvoices
+
 
 def autosubmit_eta_batch_process():
-    
-    companies = frappe.get_all("Company", pluck="name")
+    """
+    Fan the batch submission of every company out to background lanes.
+
+    The companies are queued in redis and drained by up to `ETA Settings.batch_submission_concurrency`
+    lane jobs, so a slow ETA response for one company does not hold up the others.
+    """
+    companies = frappe.get_all(
+        "ETA Connector",
+        filters={"is_default": 1, "submission_mode": ["!=", "Manual"]},
+        pluck="company",
+        distinct=True,
+    )
+    if not companies:
+        return
+
+    cache = frappe.cache()
+    cache.delete_value(ETA_BATCH_COMPANIES_KEY)
     for company in companies:
+        cache.rpush(ETA_BATCH_COMPANIES_KEY, company)
+
+    concurrency = cint(get_eta_settings().batch_submission_concurrency) or 1
+    for lane in range(min(concurrency, len(companies))):
+        frappe.enqueue(
+            method="erpnext_egypt_compliance.erpnext_eta.main.drain_eta_batch_companies",
+            queue="long",
+            job_name=f"eta_batch_submission_lane_{lane}",
+        )
+
+
+def drain_eta_batch_companies():
+    """Submit the batch of each queued company until the queue is empty, isolating failures per company."""
+    cache = frappe.cache()
+    while company := cache.lpop(ETA_BATCH_COMPANIES_KEY):
+        company = frappe.safe_decode(company)
+        # a lane of the previous cycle may still be submitting this company
+        lock_key = cache.make_key(f"eta_batch_submission_lock:{company}")
+        lock_token = acquire_cache_lock(lock_key, ETA_BATCH_LOCK_TIMEOUT)
+        if not lock_token:
+            continue
+
         try:
-            get_batch_invoices(company)
-        except Exception as e:
-            frappe.log_error("Auto Submission Error").format(str(e))
+            get_batch_invoices(company, lock=(lock_key, lock_token))
+            frappe.db.commit()
+        except Exception:
+            frappe.db.rollback()
+            frappe.log_error(title=f"Auto Submission Error: {company}")
+        finally:
+            release_cache_lock(lock_key, lock_token)
 
 
 def autosubmit_eta_live_submission(docname, connector):
@@ -114,6 +285,13 @@ def autosubmit_eta_live_submission(docname, connector):
     submit_einvoice_background_logger(inv, connector, submitted_by="Agent")
 
 
+def autosubmit_eta_live_batch_submission(docnames, connector):
+    """Submit a batch of invoices signed together, dropping (and logging) the ones that fail validation."""
+    einvoices = _build_einvoices(docnames)
+    if einvoices:
+        submit_einvoice_background_logger(einvoices, connector, submitted_by="Agent")
+
+
 @frappe.whitelist()
 def submit_eta_invoice(docname, submission_reason=None):
     try:
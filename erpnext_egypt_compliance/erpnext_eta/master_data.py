@@ -0,0 +1,242 @@
+import pickle
+from typing import Dict, List
+
+import frappe
+import redis
+
+ISSUER_PROFILE_CACHE_KEY = "eta_issuer_profile"
+ITEM_ETA_CODES_CACHE_KEY = "eta_item_codes"
+ETA_SETTINGS_CACHE_KEY = "eta_settings"
+UOM_ETA_CODES_CACHE_KEY = "eta_uom_codes"
+
+ISSUER_COMPANY_FIELDS = (
+    "eta_issuer_type",
+    "eta_tax_id",
+    "eta_issuer_name",
+    "eta_default_branch",
+    "eta_default_activity_code",
+    "country",
+    "postal_code",
+    "floor",
+    "room",
+    "landmark",
+    "additional_information",
+)
+
+ISSUER_BRANCH_ADDRESS_FIELDS = (
+    "state",
+    "city",
+    "address_line1",
+    "building_number",
+    "country",
+)
+
+ITEM_ETA_FIELDS = (
+    "brand",
+    "item_group",
+    "eta_item_code",
+    "eta_code_type",
+    "eta_inherit_brand",
+    "eta_inherit_item_group",
+)
+
+# (doctype, Item link field, Item inherit flag)
+ITEM_ETA_CODE_SOURCES = (
+    ("Brand", "brand", "eta_inherit_brand"),
+    ("Item Group", "item_group", "eta_inherit_item_group"),
+)
+
+
+def get_issuer_profile(company: str) -> frappe._dict:
+    """
+    Get the ETA issuer profile of a company.
+
+    The profile holds the company ETA fields, its default ETA branch and that branch's address.
+    Profiles are cached site-wide and cleared when a Company, Branch or ETA branch Address is updated.
+    """
+    return frappe.cache().hget(ISSUER_PROFILE_CACHE_KEY, company, generator=lambda: _build_issuer_profile(company))
+
+
+def _build_issuer_profile(company: str) -> frappe._dict:
+    company_doc = frappe.get_doc("Company", company)
+    branch = frappe.get_doc("Branch", company_doc.get("eta_default_branch"))
+    branch_address = frappe.get_doc("Address", branch.get("eta_branch_address"))
+
+    profile = frappe._dict({field: company_doc.get(field) for field in ISSUER_COMPANY_FIELDS})
+    profile.name = company_doc.name
+    profile.country_code = frappe.db.get_value("Country", company_doc.get("country"), "code")
+
+    profile.branch_data = frappe._dict({field: branch_address.get(field) for field in ISSUER_BRANCH_ADDRESS_FIELDS})
+    profile.branch_data.eta_branch_id = branch.get("eta_branch_id")
+    profile.branch_data.country_code = frappe.db.get_value("Country", branch_address.get("country"), "code")
+    return profile
+
+
+def clear_issuer_profile_cache(doc=None, method=None):
+    """Clear the cached issuer profiles, on update of a Company, Branch or ETA branch Address."""
+    if doc and doc.doctype == "Address" and not frappe.db.exists("Branch", {"eta_branch_address": doc.name}):
+        return
+    frappe.cache().delete_value(ISSUER_PROFILE_CACHE_KEY)
+
+
+def get_eta_settings() -> frappe._dict:
+    """
+    Get a snapshot of the ETA Settings, such as the default `eta_item_code` and `eta_uom` of the builders.
+
+    The snapshot is cached site-wide and cleared when the ETA Settings are saved.
+    """
+    return frappe.cache().get_value(ETA_SETTINGS_CACHE_KEY, generator=lambda: frappe.db.get_singles_dict("ETA Settings"))
+
+
+def clear_eta_settings_cache():
+    frappe.cache().delete_value(ETA_SETTINGS_CACHE_KEY)
+
+
+def get_uom_eta_codes(uoms: List[str]) -> Dict[str, str]:
+    """
+    Resolve the ETA unit type of several UOMs, see `get_uom_eta_code`.
+
+    Returns:
+        dict: uom -> ETA unit type, for the UOMs that map to one.
+    """
+    uom_eta_codes = _get_uom_eta_codes()
+    return {uom: uom_eta_codes[uom] for uom in uoms if uom in uom_eta_codes}
+
+
+def get_uom_eta_code(uom: str) -> str:
+    """
+    Get the ETA unit type of a UOM: its `eta_uom`, or the UOM itself when it is named after an ETA UOM code.
+
+    The UOM -> ETA code map is built once and cached site-wide, it is cleared when a UOM or ETA UOM changes.
+    """
+    return _get_uom_eta_codes().get(uom)
+
+
+def _get_uom_eta_codes() -> Dict[str, str]:
+    return frappe.cache().get_value(UOM_ETA_CODES_CACHE_KEY, generator=_build_uom_eta_codes)
+
+
+def _build_uom_eta_codes() -> Dict[str, str]:
+    uom_eta_codes = {code: code for code in frappe.get_all("ETA UOM", pluck="name")}
+    uom_eta_codes.update(
+        frappe.get_all("UOM", filters={"eta_uom": ["is", "set"]}, fields=["name", "eta_uom"], as_list=True)
+    )
+    return uom_eta_codes
+
+
+def clear_uom_eta_codes_cache(doc=None, method=None):
+    """Clear the cached UOM -> ETA code map, on update, rename or deletion of a UOM or ETA UOM."""
+    frappe.cache().delete_value(UOM_ETA_CODES_CACHE_KEY)
+
+
+def get_item_eta_codes(item_codes: List[str]) -> Dict[str, frappe._dict]:
+    """
+    Resolve the ETA item code and code type of several items in one lookup.
+
+    Items inherit the code of their Brand or Item Group when `eta_inherit_brand` / `eta_inherit_item_group`
+    is set. Resolutions are kept in a site-wide index that is filled on first use and updated when the
+    ETA fields of an Item, Brand or Item Group change.
+
+    Returns:
+        dict: item_code -> {"item_code", "item_type", "inherited"}, for the items that exist.
+    """
+    item_codes = list({code for code in item_codes if code})
+    if not item_codes:
+        return {}
+
+    resolved = _get_cached_item_eta_codes(item_codes)
+    missing = [code for code in item_codes if code not in resolved]
+    if missing:
+        computed = _compute_item_eta_codes(missing)
+        _set_cached_item_eta_codes(computed)
+        resolved.update(computed)
+    return resolved
+
+
+def resolve_item_eta_code(item: Dict, eta_codes: Dict) -> frappe._dict:
+    """
+    Resolve the ETA code of an item from its own fields or from the Brand / Item Group it inherits from.
+
+    Args:
+        item (dict): The item ETA fields.
+        eta_codes (dict): (doctype, name) -> Brand / Item Group ETA fields.
+    """
+    source = item
+    for doctype, fieldname, inherit_field in ITEM_ETA_CODE_SOURCES:
+        if item.get(inherit_field):
+            source = eta_codes.get((doctype, item.get(fieldname))) or {}
+            break
+
+    return frappe._dict(
+        item_code=source.get("eta_item_code"),
+        item_type=source.get("eta_code_type"),
+        inherited=source is not item,
+    )
+
+
+def _compute_item_eta_codes(item_codes: List[str]) -> Dict[str, frappe._dict]:
+    items = frappe.get_all("Item", filters={"name": ["in", item_codes]}, fields=["name", *ITEM_ETA_FIELDS])
+
+    eta_codes = {}
+    for doctype, fieldname, inherit_field in ITEM_ETA_CODE_SOURCES:
+        names = {item.get(fieldname) for item in items if item.get(inherit_field) and item.get(fieldname)}
+        if not names:
+            continue
+        rows = frappe.get_all(
+            doctype, filters={"name": ["in", list(names)]}, fields=["name", "eta_item_code", "eta_code_type"]
+        )
+        eta_codes.update({(doctype, row.name): row for row in rows})
+
+    return {item.name: resolve_item_eta_code(item, eta_codes) for item in items}
+
+
+def _get_cached_item_eta_codes(item_codes: List[str]) -> Dict[str, frappe._dict]:
+    cache = frappe.cache()
+    try:
+        values = cache.hmget(cache.make_key(ITEM_ETA_CODES_CACHE_KEY), item_codes)
+    except redis.exceptions.ConnectionError:
+        return {}
+    return {code: pickle.loads(value) for code, value in zip(item_codes, values, strict=True) if value is not None}
+
+
+def _set_cached_item_eta_codes(resolved: Dict[str, frappe._dict]):
+    if not resolved:
+        return
+    cache = frappe.cache()
+    key = cache.make_key(ITEM_ETA_CODES_CACHE_KEY)
+    try:
+        pipeline = cache.pipeline()
+        for item_code, value in resolved.items():
+            pipeline.hset(key, item_code, pickle.dumps(value))
+        pipeline.execute()
+    except redis.exceptions.ConnectionError:
+        pass
+
+
+def _delete_cached_item_eta_codes(item_codes: List[str]):
+    if not item_codes:
+        return
+    cache = frappe.cache()
+    try:
+        cache.pipeline().hdel(cache.make_key(ITEM_ETA_CODES_CACHE_KEY), *item_codes).execute()
+    except redis.exceptions.ConnectionError:
+        pass
+
+
+def update_item_eta_code_index(doc, method=None):
+    """Re-resolve the items affected by a change to the ETA fields of an Item, Brand or Item Group."""
+    if doc.doctype == "Item":
+        if method == "on_trash":
+            _delete_cached_item_eta_codes([doc.name])
+        elif any(doc.has_value_changed(field) for field in ITEM_ETA_FIELDS):
+            _set_cached_item_eta_codes(_compute_item_eta_codes([doc.name]))
+        return
+
+    if not (doc.has_value_changed("eta_item_code") or doc.has_value_changed("eta_code_type")):
+        return
+
+    for doctype, fieldname, inherit_field in ITEM_ETA_CODE_SOURCES:
+        if doctype == doc.doctype:
+            item_codes = frappe.get_all("Item", filters={fieldname: doc.name, inherit_field: 1}, pluck="name")
+            if item_codes:
+                _set_cached_item_eta_codes(_compute_item_eta_codes(item_codes))
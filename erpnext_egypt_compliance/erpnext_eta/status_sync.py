@@ -0,0 +1,116 @@
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, List
+
+import frappe
+from frappe.utils import now_datetime
+
+from erpnext_egypt_compliance.erpnext_eta.einvoice_submitter import EInvoiceSubmitter
+from erpnext_egypt_compliance.erpnext_eta.utils import (
+    get_company_eta_connector,
+    set_eta_statuses,
+    update_eta_docstatuses,
+)
+
+# a submitted invoice is first polled this long after its submission, the interval then doubles per attempt
+ETA_STATUS_POLL_INTERVAL = timedelta(minutes=10)
+ETA_STATUS_POLL_MAX_INTERVAL = timedelta(hours=12)
+# ETA settles the status of a document within this window, invoices are not polled beyond it
+ETA_STATUS_POLL_WINDOW = timedelta(days=3)
+
+
+def get_status_poll_interval(attempts: int) -> timedelta:
+    """The time to wait after the last status poll of an invoice polled `attempts` times."""
+    return min(ETA_STATUS_POLL_INTERVAL * 2 ** min(attempts, 16), ETA_STATUS_POLL_MAX_INTERVAL)
+
+
+def _get_max_status_poll_attempts() -> int:
+    attempts, elapsed = 0, timedelta()
+    while elapsed < ETA_STATUS_POLL_WINDOW:
+        elapsed += get_status_poll_interval(attempts)
+        attempts += 1
+    return attempts
+
+
+ETA_STATUS_POLL_MAX_ATTEMPTS = _get_max_status_poll_attempts()
+
+
+def poll_eta_statuses(company: str):
+    """
+    Sync the status of the company's submitted invoices that are due for a poll.
+
+    Each invoice records when its status was last checked and how many times. Young submissions are
+    polled every few minutes, older ones with exponential backoff, and none after `ETA_STATUS_POLL_WINDOW`,
+    so the poll set stays small as history grows.
+    """
+    invoices = frappe.get_all(
+        "Sales Invoice",
+        filters=[
+            ["company", "=", company],
+            ["eta_status", "=", "Submitted"],
+            ["eta_status_attempts", "<", ETA_STATUS_POLL_MAX_ATTEMPTS],
+        ],
+        fields=["name", "eta_status_checked_at", "eta_status_attempts"],
+    )
+    now = now_datetime()
+    due = [
+        invoice.name
+        for invoice in invoices
+        if not invoice.eta_status_checked_at
+        or invoice.eta_status_checked_at + get_status_poll_interval(invoice.eta_status_attempts) <= now
+    ]
+    if not due:
+        return
+
+    sync_eta_statuses(get_company_eta_connector(company), due)
+
+    SalesInvoice = frappe.qb.DocType("Sales Invoice")
+    for batch in frappe.utils.create_batch(due, 1000):
+        (
+            frappe.qb.update(SalesInvoice)
+            .set(SalesInvoice.eta_status_checked_at, now)
+            .set(SalesInvoice.eta_status_attempts, SalesInvoice.eta_status_attempts + 1)
+            .where(SalesInvoice.name.isin(batch))
+        ).run()
+
+
+def sync_eta_statuses(connector, docnames: List[str]) -> Dict[str, str]:
+    """
+    Update the ETA status of Sales Invoices from the summaries of the submissions they were sent in.
+
+    One paginated `/documentSubmissions/{id}` call covers every invoice of a submission, and the
+    statuses are written with one UPDATE per status. Invoices without a submission ID fall back to
+    fetching their raw document.
+
+    Returns:
+        dict: docname -> ETA status, for the invoices whose status changed.
+    """
+    invoices = frappe.get_all(
+        "Sales Invoice",
+        filters={"name": ["in", docnames]},
+        fields=["name", "eta_status", "eta_submission_id", "eta_uuid"],
+    )
+
+    # the summaries are matched on the ETA uuid, their internalId is not always the invoice name
+    by_submission = defaultdict(dict)
+    without_submission = []
+    for invoice in invoices:
+        if invoice.eta_submission_id and invoice.eta_uuid:
+            by_submission[invoice.eta_submission_id][invoice.eta_uuid] = invoice
+        else:
+            without_submission.append(invoice.name)
+
+    submitter = EInvoiceSubmitter(connector)
+    changed = {}
+    for submission_id, invoices_by_uuid in by_submission.items():
+        for summary in submitter.iter_submission_documents(submission_id):
+            invoice = invoices_by_uuid.get(summary.get("uuid"))
+            status = summary.get("status")
+            if invoice and status and status != invoice.eta_status:
+                changed[invoice.name] = status
+
+    set_eta_statuses(changed)
+
+    if without_submission:
+        changed.update(update_eta_docstatuses(connector, without_submission))
+    return changed
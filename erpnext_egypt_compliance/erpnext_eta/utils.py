@@ -1,3 +1,4 @@
+from collections import defaultdict
 from datetime import datetime, timedelta
 import pytz
 
@@ -5,6 +6,8 @@ import frappe
 import requests
 import json
 
+from erpnext_egypt_compliance.erpnext_eta.eta_http import send_concurrently
+
 
 
 def download_eta_invoice_json(docname, file_content):
@@ -70,11 +73,14 @@ def get_company_eta_connector(company, throw_if_no_connector=True):
 
 
 def autofetch_eta_status(company):
+	from erpnext_egypt_compliance.erpnext_eta.status_sync import sync_eta_statuses
+
 	connector = get_company_eta_connector(company)
 	# get list of submitted invoices:
-	docs = frappe.get_all("Sales Invoice", filters=[["eta_status", "=", "Submitted"]], pluck="name")
-	for docname in docs:
-		update_eta_docstatus(connector,docname)
+	docs = frappe.get_all(
+		"Sales Invoice", filters=[["eta_status", "=", "Submitted"], ["company", "=", company]], pluck="name"
+	)
+	sync_eta_statuses(connector, docs)
 	frappe.db.commit()
 
 def update_eta_docstatus(connector, docname):
@@ -91,13 +97,119 @@ def update_eta_docstatus(connector, docname):
         return "Didn't update Status"
 
 
+def update_eta_docstatuses(connector, docnames):
+	"""
+	Fetch the ETA status of several Sales Invoices concurrently and update them.
+
+	Returns:
+		dict: docname -> ETA status, for the invoices whose status was fetched.
+	"""
+	statuses = {}
+	# fresh headers per batch, the access token may expire during a long run
+	for batch in frappe.utils.create_batch(docnames, 500):
+		headers = connector.get_headers()
+		uuids = frappe.get_all(
+			"Sales Invoice",
+			filters={"name": ["in", batch], "eta_uuid": ["is", "set"]},
+			fields=["name", "eta_uuid"],
+			as_list=True,
+		)
+		responses = send_concurrently(
+			connector.session,
+			{
+				docname: ("GET", connector.ETA_BASE + f"/documents/{uuid}/raw", {"headers": headers})
+				for docname, uuid in uuids
+			},
+		)
+		for docname, response in responses.items():
+			if isinstance(response, Exception) or not response.ok:
+				continue
+			if status := response.json().get("status"):
+				statuses[docname] = status
+
+	set_eta_statuses(statuses)
+	return statuses
+
+
 def autofetch_eta_status_process():
-	companies = frappe.get_all("Company", pluck="name")
+	from erpnext_egypt_compliance.erpnext_eta.status_sync import poll_eta_statuses
+
+	companies = frappe.get_all("ETA Connector", filters={"is_default": 1}, pluck="company", distinct=True)
 	for company in companies:
 		try:
-			autofetch_eta_status(company)
-		except:
-			print("An exception occurred")  # TODO handle error properly.
+			poll_eta_statuses(company)
+			frappe.db.commit()
+		except Exception:
+			frappe.db.rollback()
+			frappe.log_error(title=f"ETA Status Polling Error: {company}")
+
+
+def bulk_set_values(doctype, values_by_name, chunk_size=500):
+	"""
+	Set different field values on many documents with one UPDATE statement per chunk.
+
+	Args:
+		doctype (str): The doctype of the documents.
+		values_by_name (dict): docname -> {fieldname: value}, fields missing for a document are left as is.
+	"""
+	from frappe.query_builder import Case
+
+	table = frappe.qb.DocType(doctype)
+	modified = frappe.utils.now()
+	for chunk in frappe.utils.create_batch(list(values_by_name), chunk_size):
+		query = (
+			frappe.qb.update(table)
+			.set(table.modified, modified)
+			.set(table.modified_by, frappe.session.user)
+			.where(table.name.isin(chunk))
+		)
+		fieldnames = {fieldname for name in chunk for fieldname in values_by_name[name]}
+		for fieldname in fieldnames:
+			case = Case()
+			for name in chunk:
+				if fieldname in values_by_name[name]:
+					case = case.when(table.name == name, values_by_name[name][fieldname])
+			query = query.set(table[fieldname], case.else_(table[fieldname]))
+		query.run()
+
+
+def set_eta_statuses(statuses):
+	"""Set the `eta_status` of Sales Invoices with one UPDATE per status, given docname -> status."""
+	docnames_by_status = defaultdict(list)
+	for docname, status in statuses.items():
+		docnames_by_status[status].append(docname)
+
+	for status, docnames in docnames_by_status.items():
+		for batch in frappe.utils.create_batch(docnames, 1000):
+			frappe.db.set_value("Sales Invoice", {"name": ["in", batch]}, "eta_status", status)
+
+
+def acquire_cache_lock(key, timeout):
+	"""
+	Take a redis lock shared by all the workers of the site, returns its token, or None if it is held.
+
+	`key` is a raw redis key, see `frappe.cache().make_key`. The token is needed to extend or release
+	the lock, so a holder that outlived `timeout` cannot release the lock of the next holder.
+	"""
+	token = frappe.generate_hash(length=16)
+	if frappe.cache().set(key, token, nx=True, ex=timeout):
+		return token
+
+
+def extend_cache_lock(key, token, timeout):
+	"""Restart the timeout of a lock still held with `token`, returns whether it is still held."""
+	cache = frappe.cache()
+	if frappe.safe_decode(cache.get(key)) != token:
+		return False
+	cache.expire(key, timeout)
+	return True
+
+
+def release_cache_lock(key, token):
+	"""Release a lock, unless it expired and was taken by another holder meanwhile."""
+	cache = frappe.cache()
+	if frappe.safe_decode(cache.get(key)) == token:
+		cache.delete(key)
 
 
 def create_eta_log(
@@ -21,6 +21,30 @@ doc_events = {
     "Sales Invoice": {
         "before_submit": "erpnext_egypt_compliance.erpnext_eta.pre_validation.validate_eta_before_submit",
     },
+    "Company": {
+        "on_update": "erpnext_egypt_compliance.erpnext_eta.master_data.clear_issuer_profile_cache",
+    },
+    "Branch": {
+        "on_update": "erpnext_egypt_compliance.erpnext_eta.master_data.clear_issuer_profile_cache",
+    },
+    "Address": {
+        "on_update": "erpnext_egypt_compliance.erpnext_eta.master_data.clear_issuer_profile_cache",
+    },
+    "Item": {
+        "on_update": "erpnext_egypt_compliance.erpnext_eta.master_data.update_item_eta_code_index",
+        "on_trash": "erpnext_egypt_compliance.erpnext_eta.master_data.update_item_eta_code_index",
+    },
+    "Brand": {
+        "on_update": "erpnext_egypt_compliance.erpnext_eta.master_data.update_item_eta_code_index",
+    },
+    "Item Group": {
+        "on_update": "erpnext_egypt_compliance.erpnext_eta.master_data.update_item_eta_code_index",
+    },
+    "UOM": {
+        "on_update": "erpnext_egypt_compliance.erpnext_eta.master_data.clear_uom_eta_codes_cache",
+        "on_trash": "erpnext_egypt_compliance.erpnext_eta.master_data.clear_uom_eta_codes_cache",
+        "after_rename": "erpnext_egypt_compliance.erpnext_eta.master_data.clear_uom_eta_codes_cache",
+    },
 }
 
 after_migrate = "erpnext_egypt_compliance.migrate.after_migrate"
@@ -49,9 +73,17 @@ user_data_fields = [
 ]
 
 scheduler_events = {
+    "cron": {
+        "*/10 * * * *": [
+            "erpnext_egypt_compliance.erpnext_eta.utils.autofetch_eta_status_process",
+        ],
+        "* * * * *": [
+            "erpnext_egypt_compliance.erpnext_eta.ereceipt_spool.flush_due_ereceipt_spools",
+            "erpnext_egypt_compliance.erpnext_eta.ereceipt_outbox.replay_ereceipt_outbox",
+        ],
+    },
     "hourly_long": [
         "erpnext_egypt_compliance.erpnext_eta.main.autosubmit_eta_batch_process",
-        "erpnext_egypt_compliance.erpnext_eta.utils.autofetch_eta_status_process",
         "erpnext_egypt_compliance.erpnext_eta.utils.check_unsigned_invoices_and_notify",
         "erpnext_egypt_compliance.erpnext_eta.utils.check_not_submitted_invoices_and_notify",
     ],
@@ -104,6 +136,9 @@ fixtures = [
                     "Sales Invoice-eta_signature",
                     "Sales Invoice-eta_exchange_rate",
                     "Sales Invoice-eta_cancellation_reason",
+                    "Sales Invoice-eta_status_checked_at",
+                    "Sales Invoice-eta_status_attempts",
+                    "Sales Invoice-eta_document_hash",
 					"Sales Invoice-custom_eta_more_details",
                     "Company-eta_details",
                     "Company-eta_issuer_type",
@@ -0,0 +1,64 @@
+import frappe
+import pytest
+
+from erpnext_egypt_compliance.erpnext_eta.access_token import (
+    clear_access_token,
+    get_access_token,
+)
+
+
+class _IdentityServer:
+    def __init__(self, expires_in=3600):
+        self.expires_in = expires_in
+        self.requests = 0
+
+    def __call__(self):
+        self.requests += 1
+        return {"access_token": f"token-{self.requests}", "expires_in": self.expires_in}
+
+
+def _connector(name):
+    return frappe._dict(doctype="ETA Connector", name=name)
+
+
+@pytest.fixture
+def connector_name():
+    name = f"_Test Connector {frappe.generate_hash(length=8)}"
+    yield name
+    clear_access_token(_connector(name))
+
+
+def test_access_token_is_shared_across_workers(connector_name, db_transaction):
+    identity_server = _IdentityServer()
+
+    assert get_access_token(_connector(connector_name), identity_server) == "token-1"
+    # another worker, with its own connector instance, reuses the cached token
+    assert get_access_token(_connector(connector_name), identity_server) == "token-1"
+    assert identity_server.requests == 1
+
+    assert get_access_token(_connector(connector_name), identity_server, force_refresh=True) == "token-2"
+    assert get_access_token(_connector(connector_name), identity_server) == "token-2"
+    assert identity_server.requests == 2
+
+
+def test_short_lived_access_token_is_not_cached(connector_name, db_transaction):
+    identity_server = _IdentityServer(expires_in=60)
+
+    assert get_access_token(_connector(connector_name), identity_server) == "token-1"
+    assert get_access_token(_connector(connector_name), identity_server) == "token-2"
+
+
+def test_refresh_keeps_a_lock_taken_over_by_another_worker(connector_name, db_transaction):
+    cache = frappe.cache()
+    lock_key = cache.make_key(f"eta_access_token_lock:ETA Connector::{connector_name}")
+
+    def slow_identity_server():
+        # the lock expired during the request and another worker took it
+        cache.set(lock_key, "another worker")
+        return {"access_token": "token-1", "expires_in": 3600}
+
+    try:
+        assert get_access_token(_connector(connector_name), slow_identity_server) == "token-1"
+        assert frappe.safe_decode(cache.get(lock_key)) == "another worker"
+    finally:
+        cache.delete(lock_key)
@@ -0,0 +1,46 @@
+import hashlib
+
+from erpnext_egypt_compliance.erpnext_eta.canonical import canonical_sha256, serialize
+
+DOCUMENT = {
+    "header": {"dateTimeIssued": "2024-01-01T10:00:00Z", "receiptNumber": "POS-0001"},
+    "itemData": [
+        {"internalCode": "ITM-1", "quantity": 2, "taxableItems": [{"taxType": "T1", "rate": 14.0}]},
+        {"internalCode": "ITM-2", "quantity": 1.5, "taxableItems": []},
+    ],
+    "totalAmount": 114.0,
+    "contractor": None,
+}
+
+
+def test_serialize():
+    assert serialize(DOCUMENT) == (
+        '"HEADER""DATETIMEISSUED""2024-01-01T10:00:00Z""RECEIPTNUMBER""POS-0001"'
+        '"ITEMDATA"'
+        '"ITEMDATA""INTERNALCODE""ITM-1""QUANTITY""2""TAXABLEITEMS""TAXABLEITEMS""TAXTYPE""T1""RATE""14.0"'
+        '"ITEMDATA""INTERNALCODE""ITM-2""QUANTITY""1.5""TAXABLEITEMS"'
+        '"TOTALAMOUNT""114.0"'
+        '"CONTRACTOR""None"'
+    )
+
+
+def test_canonical_sha256_matches_serialized_hash():
+    document = dict(DOCUMENT, itemData=DOCUMENT["itemData"] * 5000, description="وصف")
+    expected = hashlib.sha256(serialize(document).encode("utf-8")).hexdigest()
+
+    assert canonical_sha256(document) == expected
+    assert canonical_sha256(document, buffer_size=1) == expected
+
+
+def test_invoice_hash_covers_the_signable_document(db_transaction):
+    from erpnext_egypt_compliance.erpnext_eta.einvoice_schema import (
+        get_invoice_hash,
+        get_signable_invoice,
+    )
+
+    unsigned = {"internalID": "SINV-0001", "documentTypeVersion": "0.9", "totalAmount": 114.0, "signatures": [{"signatureType": "I", "value": "ANY"}]}
+    signed = dict(unsigned, documentTypeVersion="1.0", signatures=[{"signatureType": "I", "value": "c2lnbmF0dXJl"}])
+
+    assert get_signable_invoice(signed) == {"internalID": "SINV-0001", "documentTypeVersion": "1.0", "totalAmount": 114.0}
+    assert get_invoice_hash(unsigned) == get_invoice_hash(signed) == canonical_sha256(get_signable_invoice(signed))
+    assert get_invoice_hash(dict(signed, totalAmount=115.0)) != get_invoice_hash(signed)
@@ -0,0 +1,42 @@
+import pytest
+
+from erpnext_egypt_compliance.erpnext_eta.einvoice_submitter import (
+    EInvoiceSubmitter,
+    pack_submissions,
+)
+
+
+def _einvoice(internal_id, size):
+    return {"internalID": internal_id, "description": "x" * size}
+
+
+@pytest.mark.parametrize(
+    "sizes, max_bytes, max_documents, expected_submissions, expected_oversized",
+    [
+        ([10, 10, 10], 1000, 500, [["0", "1", "2"]], []),
+        ([10, 10, 10], 1000, 2, [["0", "1"], ["2"]], []),
+        ([100, 100, 100], 300, 500, [["0", "1"], ["2"]], []),
+        ([100, 1000, 100], 300, 500, [["0", "2"]], ["1"]),
+        ([], 300, 500, [], []),
+    ],
+)
+def test_pack_submissions(sizes, max_bytes, max_documents, expected_submissions, expected_oversized, db_transaction):
+    einvoices = [_einvoice(str(i), size) for i, size in enumerate(sizes)]
+
+    submissions, oversized = pack_submissions(einvoices, max_bytes=max_bytes, max_documents=max_documents)
+
+    assert [[e["internalID"] for e in submission] for submission in submissions] == expected_submissions
+    assert [e["internalID"] for e in oversized] == expected_oversized
+    for submission in submissions:
+        assert len(EInvoiceSubmitter(None)._prepare_data(submission)) <= max_bytes
+
+
+def test_pack_submissions_fills_to_the_byte(db_transaction):
+    einvoices = [_einvoice(str(i), 50) for i in range(2)]
+    exact_size = len(EInvoiceSubmitter(None)._prepare_data(einvoices))
+
+    submissions, _ = pack_submissions(einvoices, max_bytes=exact_size)
+    assert len(submissions) == 1
+
+    submissions, _ = pack_submissions(einvoices, max_bytes=exact_size - 1)
+    assert len(submissions) == 2
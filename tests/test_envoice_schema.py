@@ -3,9 +3,12 @@ import pytest
 import frappe
 
 from erpnext_egypt_compliance.erpnext_eta.utils import eta_round
-import erpnext_egypt_compliance.erpnext_eta.einvoice_schema as einvoice_schema
+from erpnext_egypt_compliance.erpnext_eta import einvoice_schema
+from erpnext_egypt_compliance.erpnext_eta.master_data import resolve_item_eta_code
 from erpnext_egypt_compliance.erpnext_eta.einvoice_schema import (
+    InvoiceBuildContext,
     _get_item_code_and_type,
+    _get_item_taxable_items,
     _get_item_unit_value,
     _get_sales_and_net_totals,
     get_net_total_amount,
@@ -66,19 +69,15 @@ def test_eta_round(db_transaction):
     ],
 )
 def test_get_item_code_and_type(monkeypatch, item_data, expected, db_transaction):
-    mock_values = {
-        ("ETA Settings", "ETA Settings", "eta_item_code"): "456",
-        ("Brand", None, "eta_item_code"): "Brand_code",
-        ("Brand", None, "eta_code_type"): "Brand_type",
-        ("Item Group", None, "eta_item_code"): "Item_group_code",
-        ("Item Group", None, "eta_code_type"): "Item_group_type",
+    eta_codes = {
+        ("Brand", None): {"eta_item_code": "Brand_code", "eta_code_type": "Brand_type"},
+        ("Item Group", None): {"eta_item_code": "Item_group_code", "eta_code_type": "Item_group_type"},
     }
 
-    def _mocked_get_value(*args, **kwargs):
-        return mock_values.get(args)
-
-    monkeypatch.setattr(frappe, "get_value", _mocked_get_value)
-    assert _get_item_code_and_type(item_data) == expected
+    monkeypatch.setattr(einvoice_schema, "get_eta_settings", lambda: frappe._dict(eta_item_code="456"))
+    ctx = InvoiceBuildContext(invoice={}, company={})
+    ctx.item_eta_codes = {"ITEM-1": resolve_item_eta_code(item_data, eta_codes)}
+    assert _get_item_code_and_type(ctx, {"item_code": "ITEM-1"}) == expected
 
 
 @pytest.mark.parametrize(
@@ -106,10 +105,10 @@ def test_get_item_code_and_type(monkeypatch, item_data, expected, db_transaction
         ),
     ],
 )
-def test_get_item_unit_value(monkeypatch, item_data, expected, invoice_data, db_transaction):
-    monkeypatch.setattr(einvoice_schema, "INVOICE_RAW_DATA", invoice_data)
+def test_get_item_unit_value(item_data, expected, invoice_data, db_transaction):
+    ctx = InvoiceBuildContext(invoice=invoice_data, company={})
 
-    assert _get_item_unit_value(item_data) == expected
+    assert _get_item_unit_value(ctx, item_data) == expected
 
 
 @pytest.mark.parametrize(
@@ -127,10 +126,10 @@ def test_get_item_unit_value(monkeypatch, item_data, expected, invoice_data, db_
         ),
     ],
 )
-def test_get_sales_and_net_totals(monkeypatch, invoice_data, item_data, expected, db_transaction):
-    monkeypatch.setattr(einvoice_schema, "INVOICE_RAW_DATA", invoice_data)
+def test_get_sales_and_net_totals(invoice_data, item_data, expected, db_transaction):
+    ctx = InvoiceBuildContext(invoice=invoice_data, company={})
 
-    assert _get_sales_and_net_totals(item_data) == expected
+    assert _get_sales_and_net_totals(ctx, item_data) == expected
 
 
 @pytest.mark.parametrize(
@@ -158,7 +157,25 @@ def test_get_sales_and_net_totals(monkeypatch, invoice_data, item_data, expected
         ),
     ],
 )
-def test_get_net_total_amount(monkeypatch, invoice_data, expected, db_transaction):
-    monkeypatch.setattr(einvoice_schema, "INVOICE_RAW_DATA", invoice_data)
+def test_get_net_total_amount(invoice_data, expected, db_transaction):
+    ctx = InvoiceBuildContext(invoice=invoice_data, company={})
+
+    assert get_net_total_amount(ctx) == expected
+
+
+def test_get_item_taxable_items(db_transaction):
+    invoice_data = {
+        "taxes": [
+            {"eta_tax_type": "T1", "eta_tax_sub_type": "V009", "item_wise_tax_detail": '{"ITEM-1": [14, 14], "ITEM-2": [5, 5]}'},
+            {"disable_eta": 1, "item_wise_tax_detail": "not parsed"},
+            {"eta_tax_type": "T4", "eta_tax_sub_type": "W010", "item_wise_tax_detail": '{"ITEM-1": [1, 1]}'},
+        ]
+    }
+    ctx = InvoiceBuildContext(invoice=invoice_data, company={})
+
+    taxable_items = _get_item_taxable_items(ctx, {"item_code": "ITEM-1"}, 100)
 
-    assert get_net_total_amount() == expected
+    assert [(t.taxType, t.subType, t.rate, t.amount) for t in taxable_items] == [
+        ("T1", "V009", 14, 14),
+        ("T4", "W010", 1, 1),
+    ]
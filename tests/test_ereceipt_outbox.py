@@ -0,0 +1,127 @@
+import frappe
+import pytest
+
+from erpnext_egypt_compliance.erpnext_eta import ereceipt_outbox
+from erpnext_egypt_compliance.erpnext_eta.ereceipt_outbox import (
+    add_to_ereceipt_outbox,
+    is_eta_unreachable,
+    replay_connector_outbox,
+)
+
+DOCTYPE = "POS Invoice"
+
+
+def _receipt(receipt_number):
+    return {"header": {"receiptNumber": receipt_number, "uuid": f"uuid-{receipt_number}"}}
+
+
+class _Submitter:
+    def __init__(self, responses=None, received=None):
+        self.responses = responses or []
+        self.received = received or {}
+        self.submitted, self.looked_up = [], []
+
+    def __call__(self, connector):
+        return self
+
+    def submit_ereceipt_batches(self, batches, doctype):
+        self.submitted.extend([r["header"]["receiptNumber"] for r in batch["receipts"]] for batch in batches)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return [response(batch) for batch in batches]
+
+    def get_receipt_statuses(self, uuids):
+        self.looked_up.extend(uuids)
+        return {uuid: self.received[uuid] for uuid in uuids if uuid in self.received}
+
+
+def _accept_all(batch):
+    return {"status_code": 202, "acceptedDocuments": [r["header"] for r in batch["receipts"]], "eta_log": "ETA-LOG-1"}
+
+
+@pytest.fixture
+def connector(monkeypatch):
+    connector = frappe._dict(name=f"_Test POS {frappe.generate_hash(length=8)}", spool_max_receipts=2)
+    monkeypatch.setattr(frappe, "get_doc", lambda doctype, name: connector)
+    monkeypatch.setattr(ereceipt_outbox, "get_eta_http_concurrency", lambda: 2)
+    # the replay commits after each step, keep it inside the test transaction
+    monkeypatch.setattr(frappe.db, "commit", lambda: None)
+    monkeypatch.setattr(frappe.db, "rollback", lambda *args, **kwargs: None)
+    return connector
+
+
+def _statuses(connector):
+    return dict(
+        frappe.get_all(
+            "ETA Receipt Outbox",
+            filters={"pos_connector": connector.name},
+            fields=["reference_document", "status"],
+            as_list=True,
+        )
+    )
+
+
+@pytest.mark.parametrize(
+    "eta_response, expected",
+    [
+        ({"error": "Connection refused", "unreachable": True}, True),
+        ({"status_code": 429}, True),
+        ({"status_code": 503, "error": "Service Unavailable"}, True),
+        ({"status_code": 202, "acceptedDocuments": []}, False),
+        ({"status_code": 400, "error": "Bad Request"}, False),
+        # the ETA answered but recording the outcome failed, resubmitting would duplicate the receipts
+        ({"error": "Deadlock found", "status_code": 202}, False),
+    ],
+)
+def test_is_eta_unreachable(eta_response, expected):
+    assert is_eta_unreachable(eta_response) is expected
+
+
+def test_replay_submits_pending_receipts(monkeypatch, connector, db_transaction):
+    submitter = _Submitter(responses=[_accept_all])
+    monkeypatch.setattr(ereceipt_outbox, "EReceiptSubmitter", submitter)
+    add_to_ereceipt_outbox(connector.name, [_receipt(n) for n in ("R-1", "R-2", "R-3")], DOCTYPE)
+    # a receipt already in the outbox is not added twice
+    add_to_ereceipt_outbox(connector.name, [_receipt("R-1")], DOCTYPE)
+
+    replay_connector_outbox(connector.name)
+
+    assert submitter.submitted == [["R-1", "R-2"], ["R-3"]]
+    assert _statuses(connector) == {"R-1": "Accepted", "R-2": "Accepted", "R-3": "Accepted"}
+    assert frappe.db.get_value("ETA Receipt Outbox", "uuid-R-1", ["attempts", "eta_log"]) == (1, "ETA-LOG-1")
+
+
+def test_replay_stops_while_eta_is_unreachable(monkeypatch, connector, db_transaction):
+    submitter = _Submitter(responses=[lambda batch: {"error": "Connection refused", "unreachable": True}])
+    monkeypatch.setattr(ereceipt_outbox, "EReceiptSubmitter", submitter)
+    add_to_ereceipt_outbox(connector.name, [_receipt(n) for n in ("R-1", "R-2", "R-3")], DOCTYPE)
+
+    replay_connector_outbox(connector.name)
+
+    assert len(submitter.submitted) == 2
+    assert _statuses(connector) == {"R-1": "Pending", "R-2": "Pending", "R-3": "Pending"}
+
+
+def test_replay_recovers_in_flight_receipts(monkeypatch, connector, db_transaction):
+    submitter = _Submitter(responses=[_accept_all], received={"uuid-R-1": {"status": "Valid"}})
+    monkeypatch.setattr(ereceipt_outbox, "EReceiptSubmitter", submitter)
+    add_to_ereceipt_outbox(connector.name, [_receipt(n) for n in ("R-1", "R-2")], DOCTYPE)
+    ereceipt_outbox._claim_receipts(["uuid-R-1", "uuid-R-2"])
+
+    replay_connector_outbox(connector.name)
+
+    assert sorted(submitter.looked_up) == ["uuid-R-1", "uuid-R-2"]
+    # only the receipt the ETA never received is submitted again
+    assert submitter.submitted == [["R-2"]]
+    assert _statuses(connector) == {"R-1": "Accepted", "R-2": "Accepted"}
+
+
+def test_replay_releases_claimed_receipts_on_failure(monkeypatch, connector, db_transaction):
+    submitter = _Submitter(responses=[Exception("Token request failed")])
+    monkeypatch.setattr(ereceipt_outbox, "EReceiptSubmitter", submitter)
+    add_to_ereceipt_outbox(connector.name, [_receipt(n) for n in ("R-1", "R-2")], DOCTYPE)
+
+    replay_connector_outbox(connector.name)
+
+    assert _statuses(connector) == {"R-1": "Pending", "R-2": "Pending"}
@@ -0,0 +1,87 @@
+import frappe
+import pytest
+
+from erpnext_egypt_compliance.erpnext_eta import ereceipt_spool
+from erpnext_egypt_compliance.erpnext_eta.ereceipt_spool import (
+    flush_ereceipt_spool,
+    spool_ereceipt,
+)
+
+DOCTYPE = "POS Invoice"
+
+
+def _receipt(receipt_number):
+    return {"header": {"receiptNumber": receipt_number, "uuid": f"uuid-{receipt_number}"}}
+
+
+class _Submitter:
+    def __init__(self, responses):
+        self.responses = responses
+        self.submitted = []
+
+    def __call__(self, connector):
+        return self
+
+    def submit_ereceipt(self, ereceipts, doctype):
+        self.submitted.append([r["header"]["receiptNumber"] for r in ereceipts["receipts"]])
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture
+def connector(monkeypatch):
+    connector = frappe._dict(name=f"_Test POS {frappe.generate_hash(length=8)}", spool_max_receipts=2)
+    enqueued, outbox = [], []
+    monkeypatch.setattr(frappe, "get_doc", lambda doctype, name: connector)
+    monkeypatch.setattr(frappe, "enqueue", lambda **kwargs: enqueued.append(kwargs))
+    monkeypatch.setattr(
+        ereceipt_spool,
+        "add_to_ereceipt_outbox",
+        lambda pos_connector, receipts, doctype, error=None: outbox.append([r["header"]["receiptNumber"] for r in receipts]),
+    )
+    connector.enqueued, connector.outbox = enqueued, outbox
+    yield connector
+
+    keys = ereceipt_spool._get_spool_keys(connector.name, DOCTYPE)
+    frappe.cache().delete(keys.receipts, keys.size, keys.since, keys.lock)
+
+
+def _spooled(connector):
+    keys = ereceipt_spool._get_spool_keys(connector.name, DOCTYPE)
+    (count,) = frappe.cache().pipeline().llen(keys.receipts).execute()
+    return count
+
+
+def test_spool_then_flush(monkeypatch, connector, db_transaction):
+    submitter = _Submitter([{"status_code": 202}, {"status_code": 202}])
+    monkeypatch.setattr(ereceipt_spool, "EReceiptSubmitter", submitter)
+
+    for receipt_number in ("R-1", "R-2", "R-3"):
+        spool_ereceipt(connector, _receipt(receipt_number), DOCTYPE)
+
+    # flushes are enqueued once the spool holds `spool_max_receipts` receipts
+    assert len(connector.enqueued) == 2
+    assert _spooled(connector) == 3
+
+    flush_ereceipt_spool(connector.name, DOCTYPE)
+
+    assert submitter.submitted == [["R-1", "R-2"], ["R-3"]]
+    assert connector.outbox == []
+    assert _spooled(connector) == 0
+
+
+def test_flush_keeps_failed_batch_in_outbox(monkeypatch, connector, db_transaction):
+    submitter = _Submitter([Exception("Token request failed")])
+    monkeypatch.setattr(ereceipt_spool, "EReceiptSubmitter", submitter)
+
+    for receipt_number in ("R-1", "R-2", "R-3"):
+        spool_ereceipt(connector, _receipt(receipt_number), DOCTYPE)
+
+    flush_ereceipt_spool(connector.name, DOCTYPE)
+
+    assert submitter.submitted == [["R-1", "R-2"]]
+    assert connector.outbox == [["R-1", "R-2"]]
+    # the rest waits in the spool for the next flush
+    assert _spooled(connector) == 1
@@ -0,0 +1,128 @@
+import frappe
+import pytest
+
+from erpnext_egypt_compliance.erpnext_eta import eta_signer
+from erpnext_egypt_compliance.erpnext_eta.eta_signer import (
+    get_eta_invoices_for_signer,
+    set_invoice_signatures,
+)
+
+INVOICES = {
+    "SINV-A": frappe._dict(name="SINV-A", company="_Test Company", docstatus=1),
+    "SINV-B": frappe._dict(name="SINV-B", company="_Test Company", docstatus=1),
+    "SINV-C": frappe._dict(name="SINV-C", company="_Test Company", docstatus=2),
+}
+PERMITTED = {"SINV-A", "SINV-C"}
+
+
+@pytest.fixture
+def written(monkeypatch):
+    written = {}
+    monkeypatch.setattr(
+        frappe,
+        "get_all",
+        lambda doctype, filters, fields: [INVOICES[name] for name in filters["name"][1] if name in INVOICES],
+    )
+    monkeypatch.setattr(frappe, "has_permission", lambda doctype, ptype, doc: doc in PERMITTED)
+    monkeypatch.setattr(eta_signer, "bulk_set_values", lambda doctype, values_by_name: written.update(values_by_name))
+    monkeypatch.setattr(eta_signer, "get_company_eta_connector", lambda company: None)
+    monkeypatch.setattr(frappe.db, "commit", lambda: None)
+    return written
+
+
+def test_set_invoice_signatures_checks_permissions(written, db_transaction):
+    results = set_invoice_signatures(
+        [
+            {"docname": "SINV-A", "signature": "c2lnbmF0dXJl"},
+            {"docname": "SINV-B", "signature": "c2lnbmF0dXJl"},
+            {"docname": "SINV-C", "signature": "c2lnbmF0dXJl"},
+            {"docname": "SINV-D", "signature": "c2lnbmF0dXJl"},
+            {"docname": "SINV-E", "signature": "not base64!"},
+        ]
+    )
+
+    assert results == {
+        "SINV-A": "Signature Received",
+        "SINV-B": "Not Permitted",
+        "SINV-C": "Cannot Update After Submit",
+        "SINV-D": "Invoice Not Found",
+        "SINV-E": "Invalid Signature",
+    }
+    assert written == {"SINV-A": {"eta_signature": "c2lnbmF0dXJl"}}
+
+
+def test_get_eta_invoices_for_signer_checks_permissions(monkeypatch, written, db_transaction):
+    monkeypatch.setattr(
+        eta_signer,
+        "_build_einvoices_for_signer",
+        lambda docnames: {docname: {"internalID": docname, "totalAmount": 114.0} for docname in docnames},
+    )
+
+    payloads = {payload["docname"]: payload for payload in get_eta_invoices_for_signer(["SINV-A", "SINV-B"])}
+
+    assert payloads["SINV-B"] == {"docname": "SINV-B", "error": "Not Permitted"}
+    assert payloads["SINV-A"]["document"] == {"internalID": "SINV-A", "totalAmount": 114.0}
+    assert list(written) == ["SINV-A"]
+    assert written["SINV-A"]["eta_document_hash"] == payloads["SINV-A"]["sha256"]
+
+
+def test_signer_batches_are_bounded(written, db_transaction):
+    with pytest.raises(frappe.ValidationError):
+        set_invoice_signatures([{"docname": f"SINV-{i}", "signature": ""} for i in range(eta_signer.SIGNER_MAX_BATCH_SIZE + 1)])
+
+
+@pytest.fixture
+def signing_queue(monkeypatch):
+    queue = [frappe._dict(name=f"SINV-{i}", posting_date=f"2024-01-0{i}") for i in range(1, 6)]
+
+    def get_invoices_to_sign(company, after, page_size):
+        remaining = [invoice for invoice in queue if not after or [invoice.posting_date, invoice.name] > after]
+        return remaining[:page_size]
+
+    monkeypatch.setattr(eta_signer, "_get_invoices_to_sign", get_invoices_to_sign)
+    yield queue
+
+    frappe.cache().delete(*[eta_signer._get_signing_lease_key(invoice.name) for invoice in queue])
+
+
+def test_signing_queue_skips_claimed_invoices(signing_queue, db_transaction):
+    claim = eta_signer.claim_invoices_to_sign("_Test Company", page_size=2)
+    assert claim["invoices"] == ["SINV-1", "SINV-2"]
+    assert claim["next"] == ["2024-01-02", "SINV-2"]
+
+    page = eta_signer.get_invoice_names_to_sign("_Test Company", page_size=2)
+    assert page == [{"name": "SINV-3", "posting_date": "2024-01-03"}, {"name": "SINV-4", "posting_date": "2024-01-04"}]
+
+    after = [page[-1]["posting_date"], page[-1]["name"]]
+    assert eta_signer.get_invoice_names_to_sign("_Test Company", page_size=2, after=after) == [
+        {"name": "SINV-5", "posting_date": "2024-01-05"}
+    ]
+
+    # another signer claims past the invoices already leased
+    assert eta_signer.claim_invoices_to_sign("_Test Company", page_size=5)["invoices"] == ["SINV-3", "SINV-4", "SINV-5"]
+
+    eta_signer.release_invoices_to_sign(["SINV-1", "SINV-2"], "another lease")
+    assert eta_signer.get_invoice_names_to_sign("_Test Company") == []
+    eta_signer.release_invoices_to_sign(["SINV-1", "SINV-2"], claim["lease"])
+    assert [row["name"] for row in eta_signer.get_invoice_names_to_sign("_Test Company")] == ["SINV-1", "SINV-2"]
+
+
+def test_signer_skips_invoices_claimed_by_another_signer(monkeypatch, signing_queue, written, db_transaction):
+    monkeypatch.setattr(
+        eta_signer,
+        "_build_einvoices_for_signer",
+        lambda docnames: {docname: {"internalID": docname} for docname in docnames},
+    )
+    claim = eta_signer.claim_invoices_to_sign("_Test Company", page_size=1)
+    assert claim["invoices"] == ["SINV-1"]
+
+    payloads = get_eta_invoices_for_signer(["SINV-1"], lease="another lease")
+    assert payloads == [{"docname": "SINV-1", "error": eta_signer.CLAIMED_BY_ANOTHER_SIGNER}]
+    assert eta_signer.get_eta_invoice_for_signer("SINV-1") == {"error": eta_signer.CLAIMED_BY_ANOTHER_SIGNER}
+    assert written == {}
+
+    monkeypatch.setitem(INVOICES, "SINV-1", frappe._dict(name="SINV-1", company="_Test Company", docstatus=1))
+    monkeypatch.setattr(frappe, "has_permission", lambda doctype, ptype, doc: True)
+    payloads = get_eta_invoices_for_signer(["SINV-1"], lease=claim["lease"])
+    assert payloads[0]["document"] == {"internalID": "SINV-1"}
+    assert list(written) == ["SINV-1"]
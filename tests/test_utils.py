@@ -0,0 +1,28 @@
+import frappe
+
+from erpnext_egypt_compliance.erpnext_eta.utils import (
+    acquire_cache_lock,
+    extend_cache_lock,
+    release_cache_lock,
+)
+
+
+def test_cache_lock_is_owned_by_its_token(db_transaction):
+    cache = frappe.cache()
+    key = cache.make_key(f"_test_lock:{frappe.generate_hash(length=8)}")
+    try:
+        token = acquire_cache_lock(key, 60)
+        assert token
+        assert acquire_cache_lock(key, 60) is None
+        assert extend_cache_lock(key, token, 60)
+
+        # the lock expired and another holder took it
+        cache.set(key, "another holder")
+        assert not extend_cache_lock(key, token, 60)
+        release_cache_lock(key, token)
+        assert frappe.safe_decode(cache.get(key)) == "another holder"
+
+        release_cache_lock(key, "another holder")
+        assert cache.get(key) is None
+    finally:
+        cache.delete(key)